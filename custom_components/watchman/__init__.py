@@ -4,15 +4,17 @@ from datetime import timedelta
 import logging
 import time
 import json
+import os
 import voluptuous as vol
-from anyio import Path
 from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.entity_registry import EVENT_ENTITY_REGISTRY_UPDATED
 from homeassistant.components import persistent_notification
 from homeassistant.util import dt as dt_util
 from homeassistant.helpers.event import async_track_point_in_utc_time
+from homeassistant.helpers.storage import Store
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.config_entries import ConfigEntry, SOURCE_IMPORT
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse
 from homeassistant.exceptions import ConfigEntryNotReady
 from homeassistant.const import (
     EVENT_HOMEASSISTANT_STARTED,
@@ -23,15 +25,19 @@ from homeassistant.const import (
 )
 
 from .coordinator import WatchmanCoordinator
+from .history import MissingHistory
+from .metrics import WatchmanMetrics
+from .scheduler import ParseScheduler
 
 from .utils import (
     is_service,
-    report,
-    parse,
-    table_renderer,
-    text_renderer,
     get_config,
+    get_dashboard_files,
+    async_wait_dashboard_saved,
+    get_domain_files,
+    get_referenced_entries,
     async_get_report_path,
+    async_import_module,
 )
 
 from .const import (
@@ -47,6 +53,7 @@ from .const import (
     CONF_SERVICE_DATA2,
     CONF_INCLUDED_FOLDERS,
     CONF_CHECK_LOVELACE,
+    CONF_LOADED_CONFIGS,
     CONF_IGNORED_STATES,
     CONF_CHUNK_SIZE,
     CONF_CREATE_FILE,
@@ -55,19 +62,51 @@ from .const import (
     CONF_COLUMNS_WIDTH,
     CONF_STARTUP_DELAY,
     CONF_FRIENDLY_NAMES,
+    CONF_MAX_FILE_SIZE,
+    DEFAULT_MAX_FILE_SIZE,
+    CONF_SCAN_CONCURRENCY,
+    DEFAULT_SCAN_CONCURRENCY,
+    MAX_SCAN_CONCURRENCY,
+    CONF_THROTTLE_KBYTES,
+    CONF_THROTTLE_FILES,
     CONF_ALLOWED_SERVICE_PARAMS,
     CONF_TEST_MODE,
+    CONF_DELTA,
+    CONF_SUMMARY,
+    DELIVERED_STORAGE_KEY,
+    DELIVERED_STORAGE_VERSION,
+    CONF_QUERY_DOMAIN,
+    CONF_QUERY_FILE,
+    CONF_QUERY_GLOB,
+    CONF_QUERY_LIMIT,
+    CONF_QUERY_OFFSET,
+    CONF_QUERY_STATE,
+    CONF_QUERY_TYPE,
+    QUERY_DEFAULT_LIMIT,
+    QUERY_MAX_LIMIT,
+    QUERY_STATES,
     EVENT_AUTOMATION_RELOADED,
     EVENT_SCENE_RELOADED,
+    EVENT_LOVELACE_UPDATED,
     HASS_DATA_CANCEL_HANDLERS,
     HASS_DATA_COORDINATOR,
+    HASS_DATA_DOMAIN_FILES,
+    HASS_DATA_FILE_SCOPES,
     HASS_DATA_FILES_IGNORED,
     HASS_DATA_FILES_PARSED,
+    HASS_DATA_HISTORY,
+    HASS_DATA_LIMITED_FILES,
+    HASS_DATA_METRICS,
     HASS_DATA_PARSE_DURATION,
+    HASS_DATA_PARSE_MAX_STALL,
     HASS_DATA_PARSED_ENTITY_LIST,
     HASS_DATA_PARSED_SERVICE_LIST,
+    HASS_DATA_PARSE_SCHEDULER,
+    HASS_DATA_REFERENCES,
+    HASS_DATA_STARTED,
     TRACKED_EVENT_DOMAINS,
     MONITORED_STATES,
+    PARSE_STALL_BUDGET,
     PLATFORMS,
     VERSION,
 )
@@ -86,21 +125,45 @@ CONFIG_SCHEMA = vol.Schema(
                 vol.Optional(CONF_SERVICE_DATA): vol.Schema({}, extra=vol.ALLOW_EXTRA),
                 vol.Optional(CONF_INCLUDED_FOLDERS): cv.ensure_list,
                 vol.Optional(CONF_CHECK_LOVELACE, default=False): cv.boolean,
+                vol.Optional(CONF_LOADED_CONFIGS, default=False): cv.boolean,
                 vol.Optional(CONF_CHUNK_SIZE, default=3500): cv.positive_int,
                 vol.Optional(CONF_IGNORED_STATES): [
                     "missing",
                     "unavailable",
                     "unknown",
+                    "disabled",
                 ],
                 vol.Optional(CONF_COLUMNS_WIDTH): cv.ensure_list,
                 vol.Optional(CONF_STARTUP_DELAY, default=0): cv.positive_int,
                 vol.Optional(CONF_FRIENDLY_NAMES, default=False): cv.boolean,
+                vol.Optional(
+                    CONF_MAX_FILE_SIZE, default=DEFAULT_MAX_FILE_SIZE
+                ): cv.positive_int,
+                vol.Optional(
+                    CONF_SCAN_CONCURRENCY, default=DEFAULT_SCAN_CONCURRENCY
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_SCAN_CONCURRENCY)),
+                vol.Optional(CONF_THROTTLE_KBYTES, default=0): cv.positive_int,
+                vol.Optional(CONF_THROTTLE_FILES, default=0): cv.positive_int,
             }
         )
     },
     extra=vol.ALLOW_EXTRA,
 )
 
+QUERY_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_QUERY_TYPE): vol.In(["entity", "service"]),
+        vol.Optional(CONF_QUERY_DOMAIN): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional(CONF_QUERY_GLOB): cv.string,
+        vol.Optional(CONF_QUERY_FILE): cv.string,
+        vol.Optional(CONF_QUERY_STATE): vol.All(cv.ensure_list, [vol.In(QUERY_STATES)]),
+        vol.Optional(CONF_QUERY_LIMIT, default=QUERY_DEFAULT_LIMIT): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=QUERY_MAX_LIMIT)
+        ),
+        vol.Optional(CONF_QUERY_OFFSET, default=0): cv.positive_int,
+    }
+)
+
 
 async def async_setup(hass: HomeAssistant, config: dict):
     """Set up is called when Home Assistant is loading our component."""
@@ -129,13 +192,22 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
         raise ConfigEntryNotReady
 
     hass.data.setdefault(DOMAIN, {})[entry.entry_id] = coordinator
+    hass.data[DOMAIN][HASS_DATA_METRICS] = WatchmanMetrics()
+    history = MissingHistory(hass)
+    await history.async_load()
+    hass.data[DOMAIN][HASS_DATA_HISTORY] = history
     hass.data[DOMAIN][HASS_DATA_COORDINATOR] = coordinator
+    hass.data[DOMAIN][HASS_DATA_PARSE_SCHEDULER] = ParseScheduler(
+        hass, lambda reason, token, files: async_scan_config(hass, reason, token, files)
+    )
     hass.data[DOMAIN_DATA] = entry.options  # TODO: refactor
 
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
     entry.async_on_unload(entry.add_update_listener(update_listener))
     await add_services(hass)
+    websocket = await async_import_module(hass, "websocket")
+    websocket.async_register_commands(hass)
     await add_event_handlers(hass)
     if hass.is_running:
         # integration reloaded or options changed via UI
@@ -155,12 +227,20 @@ async def update_listener(hass: HomeAssistant, entry: ConfigEntry):
 
 async def async_unload_entry(hass: HomeAssistant, config_entry):  # pylint: disable=unused-argument
     """Handle integration unload"""
+    scheduler = hass.data[DOMAIN].get(HASS_DATA_PARSE_SCHEDULER)
+    if scheduler:
+        await scheduler.async_cancel()
+    history = hass.data[DOMAIN].get(HASS_DATA_HISTORY)
+    if history:
+        await history.async_save()
+
     for cancel_handle in hass.data[DOMAIN].get(HASS_DATA_CANCEL_HANDLERS, []):
         if cancel_handle:
             cancel_handle()
 
-    if hass.services.has_service(DOMAIN, "report"):
-        hass.services.async_remove(DOMAIN, "report")
+    for service in ("report", "query"):
+        if hass.services.has_service(DOMAIN, service):
+            hass.services.async_remove(DOMAIN, service)
 
     unload_ok = await hass.config_entries.async_unload_platforms(
         config_entry, PLATFORMS
@@ -180,7 +260,7 @@ async def async_unload_entry(hass: HomeAssistant, config_entry):  # pylint: disa
 
 
 async def add_services(hass: HomeAssistant):
-    """adds report service"""
+    """adds report and query services"""
 
     async def async_handle_report(call):
         """Handle the service call"""
@@ -189,6 +269,8 @@ async def add_services(hass: HomeAssistant):
         send_notification = call.data.get(CONF_SEND_NOTIFICATION, False)
         create_file = call.data.get(CONF_CREATE_FILE, True)
         test_mode = call.data.get(CONF_TEST_MODE, False)
+        delta = call.data.get(CONF_DELTA, False)
+        summary = call.data.get(CONF_SUMMARY, False)
         # validate service params
         for param in call.data:
             if param not in CONF_ALLOWED_SERVICE_PARAMS:
@@ -234,12 +316,14 @@ async def add_services(hass: HomeAssistant):
                 )
             else:
                 await async_report_to_notification(
-                    hass, service, service_data, chunk_size
+                    hass, service, service_data, chunk_size, delta, summary
                 )
 
         if create_file:
             try:
-                await async_report_to_file(hass, path, test_mode=test_mode)
+                await async_report_to_file(
+                    hass, path, test_mode=test_mode, summary=summary
+                )
             except OSError as exception:
                 await async_notification(
                     hass,
@@ -250,9 +334,23 @@ async def add_services(hass: HomeAssistant):
 
     hass.services.async_register(DOMAIN, "report", async_handle_report)
 
+    async def async_handle_query(call: ServiceCall):
+        """answer from parsed and missing lists without rendering a report"""
+        query = await async_import_module(hass, "query")
+        return query.query_entries(hass, call.data)
+
+    hass.services.async_register(
+        DOMAIN,
+        "query",
+        async_handle_query,
+        schema=QUERY_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+
 
 async def add_event_handlers(hass: HomeAssistant):
     """add event handlers"""
+    metrics = hass.data[DOMAIN][HASS_DATA_METRICS]
 
     async def async_schedule_refresh_states(hass, delay):
         """schedule refresh of the sensors state"""
@@ -267,7 +365,9 @@ async def add_event_handlers(hass: HomeAssistant):
         await coordinator.async_refresh()
 
     async def async_on_home_assistant_started(event):  # pylint: disable=unused-argument
-        await parse_config(hass, reason="HA restart")
+        # background scans back off while the rest of HA settles
+        hass.data[DOMAIN][HASS_DATA_STARTED] = time.monotonic()
+        await parse_config(hass, reason="HA restart", background=True)
         startup_delay = get_config(hass, CONF_STARTUP_DELAY, 0)
         await async_schedule_refresh_states(hass, startup_delay)
 
@@ -280,21 +380,83 @@ async def add_event_handlers(hass: HomeAssistant):
                 "reload_core_config",
                 "reload",
             ]:
-                await parse_config(hass, reason="configuration changes")
+                metrics.event("configuration_changed")
+                await parse_config(
+                    hass,
+                    reason=f"{domain}.{service} call",
+                    files=get_domain_files(hass, domain),
+                    background=True,
+                )
                 coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
                 await coordinator.async_refresh()
+            else:
+                metrics.event("configuration_changed", filtered=True)
 
         elif typ in [EVENT_AUTOMATION_RELOADED, EVENT_SCENE_RELOADED]:
-            await parse_config(hass, reason="configuration changes")
+            metrics.event("configuration_changed")
+            domain = typ.removesuffix("_reloaded")
+            # automations are reloaded by now, while script.reload call is
+            # announced before the scripts are read and has no such event
+            await parse_config(
+                hass,
+                reason=f"{typ} event",
+                files=get_domain_files(hass, domain),
+                background=True,
+                loaded=typ == EVENT_AUTOMATION_RELOADED,
+            )
             coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
             await coordinator.async_refresh()
 
+    async def async_on_lovelace_updated(event):
+        """rescan the dashboard saved in the UI and re-check its references"""
+        url_path = event.data.get("url_path")
+        files = None
+        if get_config(hass, CONF_CHECK_LOVELACE, False) and (
+            HASS_DATA_FILE_SCOPES in hass.data[DOMAIN]
+        ):
+            files = get_dashboard_files(hass, url_path)
+        if not files:
+            metrics.event("lovelace_updated", filtered=True)
+            return
+        metrics.event("lovelace_updated")
+        # the event fires before the new config is written to the file
+        await async_wait_dashboard_saved(
+            hass, url_path, files, event.time_fired.timestamp()
+        )
+
+        def referenced():
+            return (
+                get_referenced_entries(
+                    hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST], files
+                ),
+                get_referenced_entries(
+                    hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST], files
+                ),
+            )
+
+        # references dropped from the dashboard are checked again as well
+        old_entities, old_services = referenced()
+        await parse_config(
+            hass,
+            reason=f"{url_path or 'default'} dashboard update",
+            files=files,
+            background=True,
+        )
+        new_entities, new_services = referenced()
+        coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
+        coordinator.async_update_entities(
+            sorted(old_entities | new_entities), sorted(old_services | new_services)
+        )
+
     async def async_on_service_changed(event):
         service = f"{event.data['domain']}.{event.data['service']}"
         if service in hass.data[DOMAIN].get(HASS_DATA_PARSED_SERVICE_LIST, []):
+            metrics.event("service_changed")
             _LOGGER.debug("Monitored service changed: %s", service)
             coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
-            await coordinator.async_refresh()
+            coordinator.async_update_services([service])
+        else:
+            metrics.event("service_changed", filtered=True)
 
     async def async_on_state_changed(event):
         """refresh monitored entities on state change"""
@@ -310,10 +472,34 @@ async def add_event_handlers(hass: HomeAssistant):
             old_state = state_or_missing("old_state")
             new_state = state_or_missing("new_state")
             checked_states = set(MONITORED_STATES) - set(ignored_states)
+            if "disabled" in checked_states:
+                # disabled entities lose their state, registry tells them apart
+                checked_states.add("missing")
             if new_state in checked_states or old_state in checked_states:
+                metrics.event("state_changed")
                 _LOGGER.debug("Monitored entity changed: %s", event.data["entity_id"])
                 coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
-                await coordinator.async_refresh()
+                coordinator.async_update_entities([event.data["entity_id"]])
+                return
+        metrics.event("state_changed", filtered=True)
+
+    async def async_on_entity_registry_updated(event):
+        """apply renames, removals and disabled flags of monitored entities"""
+        entity_ids = {
+            event.data["entity_id"],
+            event.data.get("old_entity_id"),
+        } & hass.data[DOMAIN].get(HASS_DATA_PARSED_ENTITY_LIST, {}).keys()
+        if not entity_ids:
+            metrics.event("entity_registry_updated", filtered=True)
+            return
+        metrics.event("entity_registry_updated")
+        _LOGGER.debug(
+            "Monitored entity %s in registry: %s",
+            event.data["action"],
+            ", ".join(sorted(entity_ids)),
+        )
+        coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
+        coordinator.async_update_entities(sorted(entity_ids))
 
     # hass is not started yet, schedule config parsing once it loaded
     if not hass.is_running:
@@ -331,29 +517,137 @@ async def add_event_handlers(hass: HomeAssistant):
     hdlr.append(
         hass.bus.async_listen(EVENT_SCENE_RELOADED, async_on_configuration_changed)
     )
+    hdlr.append(
+        hass.bus.async_listen(EVENT_LOVELACE_UPDATED, async_on_lovelace_updated)
+    )
     hdlr.append(
         hass.bus.async_listen(EVENT_SERVICE_REGISTERED, async_on_service_changed)
     )
     hdlr.append(hass.bus.async_listen(EVENT_SERVICE_REMOVED, async_on_service_changed))
     hdlr.append(hass.bus.async_listen(EVENT_STATE_CHANGED, async_on_state_changed))
+    hdlr.append(
+        hass.bus.async_listen(
+            EVENT_ENTITY_REGISTRY_UPDATED, async_on_entity_registry_updated
+        )
+    )
     hass.data[DOMAIN][HASS_DATA_CANCEL_HANDLERS] = hdlr
 
 
-async def parse_config(hass: HomeAssistant, reason=None):
-    """parse home assistant configuration files"""
+async def parse_config(
+    hass: HomeAssistant, reason=None, files=None, background=False, loaded=False
+):
+    """parse home assistant configuration files, or only given ones
+
+    Background scans are throttled if throttle options are set. Loaded scans
+    take automations from memory if loaded configs option is set.
+    """
     assert hass.data.get(DOMAIN_DATA)
+    scheduler = hass.data[DOMAIN][HASS_DATA_PARSE_SCHEDULER]
+    await scheduler.async_parse(reason, files, background, loaded)
+
+
+async def async_scan_config(hass: HomeAssistant, reason, token, files=None):
+    """scan configuration files, invoked by parse scheduler only"""
     start_time = time.time()
-    included_folders = get_included_folders(hass)
     ignored_files = hass.data[DOMAIN_DATA].get(CONF_IGNORED_FILES, None)
-
-    parsed_entity_list, parsed_service_list, files_parsed, files_ignored = await parse(
-        hass, included_folders, ignored_files, hass.config.config_dir
+    parser = await async_import_module(hass, "parser")
+    if files is None:
+        folders = get_included_folders(hass)
+    else:
+        folders = parser.get_scope_folders(files, hass.config.config_dir)
+
+    meter = parser.StallMeter()
+    metrics = hass.data[DOMAIN][HASS_DATA_METRICS]
+    loaded = None
+    if (
+        token.loaded
+        and get_config(hass, CONF_LOADED_CONFIGS, False)
+        and HASS_DATA_FILE_SCOPES in hass.data[DOMAIN]
+    ):
+        # files of automations and scripts are known after the first scan
+        loaded = parser.load_configs(
+            hass,
+            hass.config.config_dir,
+            hass.data[DOMAIN][HASS_DATA_FILE_SCOPES],
+            hass.data[DOMAIN][HASS_DATA_DOMAIN_FILES],
+        )
+    (
+        parsed_entity_list,
+        parsed_service_list,
+        files_parsed,
+        files_ignored,
+        file_scopes,
+        limited_files,
+    ) = await parser.parse(
+        hass,
+        folders,
+        ignored_files,
+        hass.config.config_dir,
+        token,
+        meter,
+        metrics,
+        loaded,
     )
+    hass.data[DOMAIN][HASS_DATA_PARSE_MAX_STALL] = meter.max_stall
+    if meter.max_stall > PARSE_STALL_BUDGET:
+        _LOGGER.warning(
+            "Parsing held the event loop for %.3fs., more than %.3fs. budget",
+            meter.max_stall,
+            PARSE_STALL_BUDGET,
+        )
+
+    if files is not None:
+        # partial scan: swap occurrences of rescanned files only
+        old_scopes = hass.data[DOMAIN][HASS_DATA_FILE_SCOPES]
+        rescanned = (
+            parser.get_scope_files(old_scopes, files)
+            | file_scopes.keys()
+            | limited_files.keys()
+        )
+        hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST] = parser.merge_entries(
+            hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST],
+            parsed_entity_list,
+            rescanned,
+        )
+        hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST] = parser.merge_entries(
+            hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST],
+            parsed_service_list,
+            rescanned,
+        )
+        file_scopes = {
+            k: v for k, v in old_scopes.items() if k not in rescanned
+        } | file_scopes
+        hass.data[DOMAIN][HASS_DATA_FILE_SCOPES] = file_scopes
+        hass.data[DOMAIN][HASS_DATA_DOMAIN_FILES] = parser.build_domain_map(file_scopes)
+        hass.data[DOMAIN][HASS_DATA_REFERENCES] = parser.build_reference_index(
+            file_scopes, hass.data[DOMAIN][HASS_DATA_DOMAIN_FILES]
+        )
+        hass.data[DOMAIN][HASS_DATA_LIMITED_FILES] = {
+            k: v
+            for k, v in hass.data[DOMAIN][HASS_DATA_LIMITED_FILES].items()
+            if k not in rescanned
+        } | limited_files
+        metrics.observe("partial_parse", time.time() - start_time)
+        _LOGGER.info(
+            "%s files rescanned in %.2fs. due to %s",
+            files_parsed,
+            time.time() - start_time,
+            reason,
+        )
+        return
+
     hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST] = parsed_entity_list
     hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST] = parsed_service_list
     hass.data[DOMAIN][HASS_DATA_FILES_PARSED] = files_parsed
     hass.data[DOMAIN][HASS_DATA_FILES_IGNORED] = files_ignored
+    hass.data[DOMAIN][HASS_DATA_FILE_SCOPES] = file_scopes
+    hass.data[DOMAIN][HASS_DATA_DOMAIN_FILES] = parser.build_domain_map(file_scopes)
+    hass.data[DOMAIN][HASS_DATA_REFERENCES] = parser.build_reference_index(
+        file_scopes, hass.data[DOMAIN][HASS_DATA_DOMAIN_FILES]
+    )
+    hass.data[DOMAIN][HASS_DATA_LIMITED_FILES] = limited_files
     hass.data[DOMAIN][HASS_DATA_PARSE_DURATION] = time.time() - start_time
+    metrics.observe("parse", hass.data[DOMAIN][HASS_DATA_PARSE_DURATION])
     _LOGGER.info(
         "%s files parsed and %s files ignored in %.2fs. due to %s",
         files_parsed,
@@ -375,6 +669,7 @@ def get_included_folders(hass):
 
     for fld in config_folders:
         folders.append((fld, "**/*.yaml"))
+    folders.append((hass.config.config_dir, "custom_templates/**/*.jinja"))
 
     if DOMAIN_DATA in hass.data and hass.data[DOMAIN_DATA].get(CONF_CHECK_LOVELACE):
         folders.append((hass.config.config_dir, ".storage/**/lovelace*"))
@@ -382,13 +677,17 @@ def get_included_folders(hass):
     return folders
 
 
-async def async_report_to_file(hass, path, test_mode):
+async def async_report_to_file(hass, path, test_mode, summary=False):
     """save report to a file"""
     coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
     await coordinator.async_refresh()
-    report_chunks = await report(
-        hass, table_renderer, chunk_size=0, test_mode=test_mode
-    )
+    rpt = await async_import_module(hass, "report")
+    if summary:
+        report_chunks = rpt.summary_report(hass, chunk_size=0, test_mode=test_mode)
+    else:
+        report_chunks = await rpt.report(
+            hass, rpt.table_renderer, chunk_size=0, test_mode=test_mode
+        )
 
     def write(path):
         with open(path, "w", encoding="utf-8") as report_file:
@@ -398,8 +697,14 @@ async def async_report_to_file(hass, path, test_mode):
     await hass.async_add_executor_job(write, path)
 
 
-async def async_report_to_notification(hass, service_str, service_data, chunk_size):
-    """send report via notification service"""
+async def async_report_to_notification(
+    hass, service_str, service_data, chunk_size, delta=False, summary=False
+):
+    """send report via notification service, only changes if delta is set
+
+    With summary set, totals are sent instead of the list of missing items,
+    along with delta only if anything changed.
+    """
     if not service_str:
         service_str = get_config(hass, CONF_SERVICE_NAME, None)
         service_data = get_config(hass, CONF_SERVICE_DATA2, None)
@@ -426,15 +731,28 @@ async def async_report_to_notification(hass, service_str, service_data, chunk_si
 
     coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
     await coordinator.async_refresh()
-    report_chunks = await report(hass, text_renderer, chunk_size)
+    rpt = await async_import_module(hass, "report")
+    store = Store(hass, DELIVERED_STORAGE_VERSION, DELIVERED_STORAGE_KEY)
+    if delta:
+        delivered = await store.async_load() or {}
+        report_chunks, delivered = rpt.delta_report(hass, delivered, chunk_size)
+        if not report_chunks:
+            hass.data[DOMAIN][HASS_DATA_METRICS].count("notifications_unchanged")
+            _LOGGER.debug("Nothing changed since the last report, skip notification")
+            return
+        if summary:
+            report_chunks = rpt.summary_report(hass, chunk_size)
+    elif summary:
+        report_chunks = rpt.summary_report(hass, chunk_size)
+        delivered = rpt.delivery(rpt.reported_entries(hass))
+    else:
+        report_chunks = await rpt.report(hass, rpt.text_renderer, chunk_size)
+        delivered = rpt.delivery(rpt.reported_entries(hass))
     for chunk in report_chunks:
         data["message"] = chunk
-        # blocking=True ensures execution order
-        if not await hass.services.async_call(domain, service, data, blocking=True):
-            _LOGGER.error(
-                "Unable to call service %s.%s due to an error.", domain, service
-            )
-            break
+        # blocking=True ensures execution order, failed calls raise
+        await hass.services.async_call(domain, service, data, blocking=True)
+    await store.async_save(delivered)
 
 
 async def async_notification(hass, title, message, error=False, n_id="watchman"):
@@ -452,4 +770,4 @@ async def async_notification(hass, title, message, error=False, n_id="watchman")
 async def async_onboarding(hass, service, path):
     """check if the user runs report for the first time"""
     service = service or get_config(hass, CONF_SERVICE_NAME, None)
-    return not (service or await Path(path).exists())
+    return not (service or await hass.async_add_executor_job(os.path.exists, path))
@@ -0,0 +1,180 @@
+"""Offline check of a configuration folder without running Home Assistant
+
+    python -m custom_components.watchman.cli /path/to/config --snapshot dump.json
+
+Configuration files are scanned by the same parser as the integration and
+ids are checked by the same functions, against a bare Home Assistant core
+object filled from a snapshot instead of running integrations. The entity
+registry is read from .storage/core.entity_registry of the storage folder,
+the snapshot is a json file with "states" and "services" keys holding the
+output of /api/states and /api/services REST endpoints. Exit code is 1 if
+anything is missing, so the check can gate merges in CI.
+"""
+
+import argparse
+import asyncio
+from copy import deepcopy
+import json
+import logging
+import os
+import sys
+import time
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import entity_registry as er
+
+from . import get_included_folders
+from . import parser
+from .config_flow import DEFAULT_DATA
+from .const import (
+    CONF_CHECK_LOVELACE,
+    CONF_IGNORED_FILES,
+    CONF_IGNORED_ITEMS,
+    CONF_IGNORED_STATES,
+    CONF_INCLUDED_FOLDERS,
+    CONF_SCAN_CONCURRENCY,
+    DOMAIN,
+    DOMAIN_DATA,
+    HASS_DATA_PARSED_ENTITY_LIST,
+    HASS_DATA_PARSED_SERVICE_LIST,
+    MAX_SCAN_CONCURRENCY,
+)
+from .utils import check_entitites, check_services, format_occurrences, get_entity_state
+
+
+def load_snapshot(hass, snapshot):
+    """fill state machine and service registry from a REST API dump"""
+    for state in snapshot.get("states", []):
+        hass.states.async_set(
+            state["entity_id"], state["state"], state.get("attributes")
+        )
+    for domain in snapshot.get("services", []):
+        for service in domain.get("services", {}):
+            hass.services.async_register(domain["domain"], service, _no_handler)
+
+
+async def _no_handler(call):
+    """services of a snapshot are only checked for existence"""
+
+
+async def async_check(hass, root, concurrency):
+    """scan configuration and return missing entities and services"""
+    options = hass.data[DOMAIN_DATA]
+    options[CONF_SCAN_CONCURRENCY] = concurrency
+    (
+        parsed_entity_list,
+        parsed_service_list,
+        files_parsed,
+        _,
+        _,
+        _,
+    ) = await parser.parse(
+        hass, get_included_folders(hass), options[CONF_IGNORED_FILES], root
+    )
+    hass.data[DOMAIN] = {
+        HASS_DATA_PARSED_ENTITY_LIST: parsed_entity_list,
+        HASS_DATA_PARSED_SERVICE_LIST: parsed_service_list,
+    }
+    return check_entitites(hass), check_services(hass), files_parsed
+
+
+async def async_main(args, out=sys.stdout):
+    """run the check, returns process exit code"""
+    start_time = time.time()
+    config_dir = os.path.abspath(args.config)
+    hass = HomeAssistant(os.path.abspath(args.storage or config_dir))
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = args.include or [config_dir]
+    options[CONF_IGNORED_FILES] = args.ignored_files
+    options[CONF_IGNORED_ITEMS] = args.ignored_items
+    options[CONF_IGNORED_STATES] = args.ignored_states
+    options[CONF_CHECK_LOVELACE] = args.check_lovelace
+    hass.data[DOMAIN_DATA] = options
+
+    await er.async_load(hass)
+    if args.snapshot:
+        with open(args.snapshot, encoding="utf-8") as snapshot_file:
+            load_snapshot(hass, json.load(snapshot_file))
+
+    entities_missing, services_missing, files_parsed = await async_check(
+        hass, config_dir, args.concurrency
+    )
+    for entry in sorted(entities_missing):
+        state, _ = get_entity_state(hass, entry)
+        print(
+            f"entity  {entry}  {state}  {format_occurrences(entities_missing[entry])}",
+            file=out,
+        )
+    for entry in sorted(services_missing):
+        print(
+            f"service  {entry}  missing  {format_occurrences(services_missing[entry])}",
+            file=out,
+        )
+    print(
+        f"{len(entities_missing)} entities and {len(services_missing)} services "
+        f"missing in {files_parsed} files, checked in {time.time() - start_time:.2f}s.",
+        file=sys.stderr,
+    )
+    return 1 if entities_missing or services_missing else 0
+
+
+def get_arg_parser():
+    """command line arguments of the offline check"""
+    arg_parser = argparse.ArgumentParser(
+        prog="watchman",
+        description="Report missing entities and actions of a Home Assistant "
+        "configuration folder without running Home Assistant.",
+    )
+    arg_parser.add_argument("config", help="configuration folder to check")
+    arg_parser.add_argument(
+        "--snapshot", help="json file with states and services of a live instance"
+    )
+    arg_parser.add_argument(
+        "--storage",
+        help="folder holding .storage snapshot with the entity registry "
+        "and dashboards, defaults to the configuration folder",
+    )
+    arg_parser.add_argument(
+        "--include",
+        action="append",
+        help="folder to scan, may be repeated, defaults to the configuration folder",
+    )
+    arg_parser.add_argument(
+        "--ignored-files", action="append", default=[], help="file glob to skip"
+    )
+    arg_parser.add_argument(
+        "--ignored-items", action="append", default=[], help="id glob to skip"
+    )
+    arg_parser.add_argument(
+        "--ignored-states",
+        action="append",
+        default=[],
+        choices=["missing", "unavailable", "unknown", "disabled"],
+        help="state not reported as missing",
+    )
+    arg_parser.add_argument(
+        "--check-lovelace",
+        action="store_true",
+        help="scan dashboards stored in the .storage folder",
+    )
+    arg_parser.add_argument(
+        "--concurrency",
+        type=int,
+        choices=range(1, MAX_SCAN_CONCURRENCY + 1),
+        default=min(os.cpu_count() or 1, MAX_SCAN_CONCURRENCY),
+        metavar=f"1..{MAX_SCAN_CONCURRENCY}",
+        help="number of files read at once",
+    )
+    arg_parser.add_argument("-v", "--verbose", action="store_true")
+    return arg_parser
+
+
+def main(argv=None):
+    """entry point of python -m custom_components.watchman.cli"""
+    args = get_arg_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    return asyncio.run(async_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
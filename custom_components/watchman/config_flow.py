@@ -21,11 +21,19 @@ from .const import (
     CONF_SERVICE_DATA2,
     CONF_INCLUDED_FOLDERS,
     CONF_CHECK_LOVELACE,
+    CONF_LOADED_CONFIGS,
     CONF_IGNORED_STATES,
     CONF_CHUNK_SIZE,
     CONF_COLUMNS_WIDTH,
     CONF_STARTUP_DELAY,
     CONF_FRIENDLY_NAMES,
+    CONF_MAX_FILE_SIZE,
+    DEFAULT_MAX_FILE_SIZE,
+    CONF_SCAN_CONCURRENCY,
+    DEFAULT_SCAN_CONCURRENCY,
+    MAX_SCAN_CONCURRENCY,
+    CONF_THROTTLE_KBYTES,
+    CONF_THROTTLE_FILES,
 )
 
 DEFAULT_DATA = {
@@ -39,14 +47,19 @@ DEFAULT_DATA = {
     CONF_CHUNK_SIZE: 3500,
     CONF_IGNORED_FILES: [],
     CONF_CHECK_LOVELACE: False,
+    CONF_LOADED_CONFIGS: False,
     CONF_COLUMNS_WIDTH: [30, 7, 60],
     CONF_STARTUP_DELAY: 0,
     CONF_FRIENDLY_NAMES: False,
+    CONF_MAX_FILE_SIZE: DEFAULT_MAX_FILE_SIZE,
+    CONF_SCAN_CONCURRENCY: DEFAULT_SCAN_CONCURRENCY,
+    CONF_THROTTLE_KBYTES: 0,
+    CONF_THROTTLE_FILES: 0,
 }
 
 INCLUDED_FOLDERS_SCHEMA = vol.Schema(vol.All(cv.ensure_list, [cv.string]))
 IGNORED_ITEMS_SCHEMA = vol.Schema(vol.All(cv.ensure_list, [cv.string]))
-IGNORED_STATES_SCHEMA = vol.Schema(["missing", "unavailable", "unknown"])
+IGNORED_STATES_SCHEMA = vol.Schema(["missing", "unavailable", "unknown", "disabled"])
 IGNORED_FILES_SCHEMA = vol.Schema(vol.All(cv.ensure_list, [cv.string]))
 COLUMNS_WIDTH_SCHEMA = vol.Schema(vol.All(cv.ensure_list, [cv.positive_int]))
 
@@ -232,6 +245,40 @@ class OptionsFlowHandler(OptionsFlow):
                             )
                         },
                     ): cv.positive_int,
+                    vol.Optional(
+                        CONF_MAX_FILE_SIZE,
+                        description={
+                            "suggested_value": await self.async_default(
+                                CONF_MAX_FILE_SIZE, uinput
+                            )
+                        },
+                    ): cv.positive_int,
+                    vol.Optional(
+                        CONF_SCAN_CONCURRENCY,
+                        description={
+                            "suggested_value": await self.async_default(
+                                CONF_SCAN_CONCURRENCY, uinput
+                            )
+                        },
+                    ): vol.All(
+                        vol.Coerce(int), vol.Range(min=1, max=MAX_SCAN_CONCURRENCY)
+                    ),
+                    vol.Optional(
+                        CONF_THROTTLE_KBYTES,
+                        description={
+                            "suggested_value": await self.async_default(
+                                CONF_THROTTLE_KBYTES, uinput
+                            )
+                        },
+                    ): cv.positive_int,
+                    vol.Optional(
+                        CONF_THROTTLE_FILES,
+                        description={
+                            "suggested_value": await self.async_default(
+                                CONF_THROTTLE_FILES, uinput
+                            )
+                        },
+                    ): cv.positive_int,
                     vol.Optional(
                         CONF_FRIENDLY_NAMES,
                         description={
@@ -248,6 +295,14 @@ class OptionsFlowHandler(OptionsFlow):
                             )
                         },
                     ): cv.boolean,
+                    vol.Optional(
+                        CONF_LOADED_CONFIGS,
+                        description={
+                            "suggested_value": await self.async_default(
+                                CONF_LOADED_CONFIGS, uinput
+                            )
+                        },
+                    ): cv.boolean,
                 }
             ),
             errors=errors or {},
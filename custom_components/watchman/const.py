@@ -9,14 +9,66 @@ VERSION = "0.6.3"
 DEFAULT_REPORT_FILENAME = "watchman_report.txt"
 DEFAULT_HEADER = "-== WATCHMAN REPORT ==- "
 DEFAULT_CHUNK_SIZE = 3500
+# files and items listed by the summary report
+SUMMARY_TOP_COUNT = 10
+# fixed width of the table report's Since column, fits YYYY-MM-DD HH:MM
+SINCE_COLUMN_WIDTH = 16
+# longest time in seconds a configuration scan may hold the event loop
+PARSE_STALL_BUDGET = 0.05
+# files larger than this are scanned through mmap with bytes regexes
+MMAP_SCAN_THRESHOLD = 1024 * 1024
+# lines longer than this are matched by a linear time fallback pattern
+SCAN_MAX_LINE_LENGTH = 512
+# longest time in seconds spent scanning a single file
+SCAN_FILE_TIME_BUDGET = 10.0
+# longer templates are left to the reference pattern
+TEMPLATE_MAX_LENGTH = 4096
+# distinct templates whose references are kept between scans
+TEMPLATE_CACHE_SIZE = 4096
+# line numbers kept per file and per entry, further occurrences are counted
+OCCURRENCES_LIMIT = 10
+# number of recent runs kept for timing statistics
+METRICS_HISTORY = 20
+# upper bounds in seconds of timing histogram buckets
+METRICS_TIMING_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5)
+# transitions kept in the missing status history ring
+HISTORY_SIZE = 1000
+# seconds to batch history changes before they are written to storage
+HISTORY_SAVE_DELAY = 10
+HISTORY_STORAGE_KEY = "watchman.history"
+HISTORY_STORAGE_VERSION = 1
+DELIVERED_STORAGE_KEY = "watchman.delivered"
+DELIVERED_STORAGE_VERSION = 1
+# files larger than this (in megabytes) are skipped, 0 disables the limit
+DEFAULT_MAX_FILE_SIZE = 50
+DEFAULT_SCAN_CONCURRENCY = 4
+MAX_SCAN_CONCURRENCY = 32
+# recorder queue length above which throttled scans back off
+SCAN_BACKOFF_BACKLOG = 50
+# largest factor waits of throttled scans are stretched by while HA is busy
+SCAN_BACKOFF_MAX = 8
+# seconds after Home Assistant started during which throttled scans back off
+SCAN_SETTLE_TIME = 120
+# seconds a saved dashboard file is waited for, and polled every
+DASHBOARD_SAVE_TIMEOUT = 5
+DASHBOARD_SAVE_POLL = 0.25
 
 HASS_DATA_PARSED_ENTITY_LIST = "entity_list"
 HASS_DATA_PARSED_SERVICE_LIST = "service_list"
 HASS_DATA_FILES_PARSED = "files_parsed"
 HASS_DATA_FILES_IGNORED = "files_ignored"
 HASS_DATA_PARSE_DURATION = "parse_duration"
+HASS_DATA_PARSE_MAX_STALL = "parse_max_stall"
+HASS_DATA_FILE_SCOPES = "file_scopes"
+HASS_DATA_DOMAIN_FILES = "domain_files"
+HASS_DATA_LIMITED_FILES = "limited_files"
+HASS_DATA_REFERENCES = "references"
+HASS_DATA_METRICS = "metrics"
+HASS_DATA_HISTORY = "history"
 HASS_DATA_CANCEL_HANDLERS = "cancel_handlers"
 HASS_DATA_COORDINATOR = "coordinator"
+HASS_DATA_PARSE_SCHEDULER = "parse_scheduler"
+HASS_DATA_STARTED = "started"
 HASS_DATA_MISSING_ENTITIES = "entities_missing"
 HASS_DATA_MISSING_SERVICES = "services_missing"
 HASS_DATA_CHECK_DURATION = "check_duration"
@@ -39,6 +91,7 @@ CONF_SERVICE_DATA = "data"
 CONF_SERVICE_DATA2 = "service_data"
 CONF_INCLUDED_FOLDERS = "included_folders"
 CONF_CHECK_LOVELACE = "check_lovelace"
+CONF_LOADED_CONFIGS = "loaded_configs"
 CONF_IGNORED_STATES = "ignored_states"
 CONF_CHUNK_SIZE = "chunk_size"
 CONF_CREATE_FILE = "create_file"
@@ -47,7 +100,13 @@ CONF_PARSE_CONFIG = "parse_config"
 CONF_COLUMNS_WIDTH = "columns_width"
 CONF_STARTUP_DELAY = "startup_delay"
 CONF_FRIENDLY_NAMES = "friendly_names"
+CONF_MAX_FILE_SIZE = "max_file_size"
+CONF_SCAN_CONCURRENCY = "scan_concurrency"
+CONF_THROTTLE_KBYTES = "throttle_kbytes"
+CONF_THROTTLE_FILES = "throttle_files"
 CONF_TEST_MODE = "test_mode"
+CONF_DELTA = "delta"
+CONF_SUMMARY = "summary"
 # configuration parameters allowed in watchman.report service data
 CONF_ALLOWED_SERVICE_PARAMS = [
     CONF_SERVICE_NAME,
@@ -57,15 +116,31 @@ CONF_ALLOWED_SERVICE_PARAMS = [
     CONF_PARSE_CONFIG,
     CONF_SERVICE_DATA,
     CONF_TEST_MODE,
+    CONF_DELTA,
+    CONF_SUMMARY,
 ]
 
+# watchman.query service parameters
+CONF_QUERY_TYPE = "type"
+CONF_QUERY_DOMAIN = "domain"
+CONF_QUERY_GLOB = "glob"
+CONF_QUERY_FILE = "file"
+CONF_QUERY_STATE = "state"
+CONF_QUERY_LIMIT = "limit"
+CONF_QUERY_OFFSET = "offset"
+QUERY_DEFAULT_LIMIT = 100
+QUERY_MAX_LIMIT = 10000
+QUERY_STATES = ["ok", "missing", "unknown", "unavail", "disabled"]
+
 EVENT_AUTOMATION_RELOADED = "automation_reloaded"
 EVENT_SCENE_RELOADED = "scene_reloaded"
+EVENT_LOVELACE_UPDATED = "lovelace_updated"
 
 SENSOR_LAST_UPDATE = "watchman_last_updated"
 SENSOR_MISSING_ENTITIES = "watchman_missing_entities"
 SENSOR_MISSING_SERVICES = "watchman_missing_services"
-MONITORED_STATES = ["unavailable", "unknown", "missing"]
+SENSOR_METRICS = "watchman_metrics"
+MONITORED_STATES = ["unavailable", "unknown", "missing", "disabled"]
 
 TRACKED_EVENT_DOMAINS = [
     "homeassistant",
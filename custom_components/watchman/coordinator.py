@@ -2,6 +2,7 @@
 
 import logging
 import time
+from homeassistant.core import callback
 from homeassistant.util import dt as dt_util
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
 from .const import (
@@ -12,12 +13,22 @@ from .const import (
     COORD_DATA_SERVICE_ATTRS,
     DOMAIN,
     HASS_DATA_CHECK_DURATION,
+    HASS_DATA_HISTORY,
+    HASS_DATA_METRICS,
     HASS_DATA_MISSING_ENTITIES,
     HASS_DATA_MISSING_SERVICES,
     HASS_DATA_PARSED_ENTITY_LIST,
     HASS_DATA_PARSED_SERVICE_LIST,
 )
-from .utils import check_entitites, check_services, get_entity_state, fill
+from .utils import (
+    check_entitites,
+    check_services,
+    get_entity_state,
+    format_occurrences,
+    get_owners,
+    update_missing_entities,
+    update_missing_services,
+)
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -42,41 +53,123 @@ class WatchmanCoordinator(DataUpdateCoordinator):
         services_missing = check_services(self.hass)
         entities_missing = check_entitites(self.hass)
         self.hass.data[DOMAIN][HASS_DATA_CHECK_DURATION] = time.time() - start_time
+        metrics = self.hass.data[DOMAIN][HASS_DATA_METRICS]
+        metrics.count("refreshes")
+        metrics.observe("check", self.hass.data[DOMAIN][HASS_DATA_CHECK_DURATION])
         self.hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES] = entities_missing
         self.hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES] = services_missing
+        self.data = self._build_data()
+
+        _LOGGER.debug("Watchman sensors updated")
+        _LOGGER.debug("entities missing: %s", len(entities_missing))
+        _LOGGER.debug("services missing: %s", len(services_missing))
+
+        return self.data
+
+    @callback
+    def async_update_entities(self, entity_ids, service_ids=()):
+        """re-check given entities and services only, publish updated sensor data"""
+        if HASS_DATA_MISSING_ENTITIES not in self.hass.data[DOMAIN]:
+            # no full check has been done yet
+            return
+        update_missing_entities(self.hass, entity_ids)
+        if service_ids:
+            update_missing_services(self.hass, service_ids)
+        self.hass.data[DOMAIN][HASS_DATA_METRICS].count("partial_refreshes")
+        self.async_set_updated_data(self._build_data())
+        _LOGGER.debug(
+            "Watchman sensors updated for %s", ", ".join([*entity_ids, *service_ids])
+        )
+
+    @callback
+    def async_update_services(self, service_ids):
+        """re-check given services only, publish sensor data with them replaced
+
+        Missing entities and their attributes are left as they are, so each
+        service registered or removed costs a single lookup.
+        """
+        if not self.data or HASS_DATA_MISSING_SERVICES not in self.hass.data[DOMAIN]:
+            # no full check has been done yet
+            return
+        update_missing_services(self.hass, service_ids)
+        services_missing = self.hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+        history = self.hass.data[DOMAIN][HASS_DATA_HISTORY]
+        history.async_update(
+            {s: "missing" for s in service_ids if s in services_missing}, service_ids
+        )
+        # a new list, sensor state attributes still refer to the previous one
+        service_attrs = [
+            attrs
+            for attrs in self.data[COORD_DATA_SERVICE_ATTRS]
+            if attrs["id"] not in service_ids
+        ]
+        service_attrs.extend(
+            self._service_attrs(service)
+            for service in service_ids
+            if service in services_missing
+        )
+        self.hass.data[DOMAIN][HASS_DATA_METRICS].count("partial_refreshes")
+        self.async_set_updated_data(
+            self.data
+            | {
+                COORD_DATA_MISSING_SERVICES: len(services_missing),
+                COORD_DATA_LAST_UPDATE: dt_util.now(),
+                COORD_DATA_SERVICE_ATTRS: service_attrs,
+            }
+        )
+        _LOGGER.debug("Watchman sensors updated for %s", ", ".join(service_ids))
+
+    def _service_attrs(self, service):
+        """attributes of a missing service for missing_services sensor"""
+        parsed_service_list = self.hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+        since = self.hass.data[DOMAIN][HASS_DATA_HISTORY].missing_since(service)
+        return {
+            "id": service,
+            "occurrences": format_occurrences(parsed_service_list[service]),
+            "missing_since": since.isoformat() if since else None,
+            "used_by": get_owners(self.hass, service),
+        }
+
+    def _build_data(self):
+        """sensor data from the lists of missing entities and services"""
+        entities_missing = self.hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
+        services_missing = self.hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+        history = self.hass.data[DOMAIN][HASS_DATA_HISTORY]
+        states = {
+            entity: get_entity_state(self.hass, entity, friendly_names=True)
+            for entity in entities_missing
+        }
+        history.async_update(
+            {service: "missing" for service in services_missing}
+            | {entity: state for entity, (state, _) in states.items()}
+        )
+
+        def missing_since(entry):
+            since = history.missing_since(entry)
+            return since.isoformat() if since else None
 
         # build entity attributes map for missing_entities sensor
         entity_attrs = []
         parsed_entity_list = self.hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
-        for entity in entities_missing:
-            state, name = get_entity_state(self.hass, entity, friendly_names=True)
+        for entity, (state, name) in states.items():
             entity_attrs.append(
                 {
                     "id": entity,
                     "state": state,
                     "friendly_name": name or "",
-                    "occurrences": fill(parsed_entity_list[entity], 0),
+                    "occurrences": format_occurrences(parsed_entity_list[entity]),
+                    "missing_since": missing_since(entity),
+                    "used_by": get_owners(self.hass, entity),
                 }
             )
 
         # build service attributes map for missing_services sensor
-        service_attrs = []
-        parsed_service_list = self.hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
-        for service in services_missing:
-            service_attrs.append(
-                {"id": service, "occurrences": fill(parsed_service_list[service], 0)}
-            )
+        service_attrs = [self._service_attrs(service) for service in services_missing]
 
-        self.data = {
+        return {
             COORD_DATA_MISSING_ENTITIES: len(entities_missing),
             COORD_DATA_MISSING_SERVICES: len(services_missing),
             COORD_DATA_LAST_UPDATE: dt_util.now(),
             COORD_DATA_SERVICE_ATTRS: service_attrs,
             COORD_DATA_ENTITY_ATTRS: entity_attrs,
         }
-
-        _LOGGER.debug("Watchman sensors updated")
-        _LOGGER.debug("entities missing: %s", len(entities_missing))
-        _LOGGER.debug("services missing: %s", len(services_missing))
-
-        return self.data
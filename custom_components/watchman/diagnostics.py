@@ -0,0 +1,46 @@
+"""Diagnostics support for watchman"""
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import (
+    CONF_SERVICE_DATA2,
+    CONF_SERVICE_NAME,
+    DOMAIN,
+    HASS_DATA_FILES_IGNORED,
+    HASS_DATA_FILES_PARSED,
+    HASS_DATA_LIMITED_FILES,
+    HASS_DATA_METRICS,
+    HASS_DATA_MISSING_ENTITIES,
+    HASS_DATA_MISSING_SERVICES,
+    HASS_DATA_PARSE_MAX_STALL,
+    HASS_DATA_PARSED_ENTITY_LIST,
+    HASS_DATA_PARSED_SERVICE_LIST,
+)
+from .metrics import get_index_size
+
+TO_REDACT = {CONF_SERVICE_NAME, CONF_SERVICE_DATA2}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry):
+    """return runtime metrics and index statistics of watchman"""
+    data = hass.data.get(DOMAIN, {})
+    metrics = data.get(HASS_DATA_METRICS)
+    # the walk is too slow to follow every parse, it runs on request in executor
+    index_size = await hass.async_add_executor_job(get_index_size, data)
+    return {
+        "options": async_redact_data(dict(entry.options), TO_REDACT),
+        "index": {
+            "entities": len(data.get(HASS_DATA_PARSED_ENTITY_LIST, {})),
+            "services": len(data.get(HASS_DATA_PARSED_SERVICE_LIST, {})),
+            "entities_missing": len(data.get(HASS_DATA_MISSING_ENTITIES, {})),
+            "services_missing": len(data.get(HASS_DATA_MISSING_SERVICES, {})),
+            "files_parsed": data.get(HASS_DATA_FILES_PARSED),
+            "files_ignored": data.get(HASS_DATA_FILES_IGNORED),
+            "limited_files": data.get(HASS_DATA_LIMITED_FILES, {}),
+            "parse_max_stall": data.get(HASS_DATA_PARSE_MAX_STALL),
+            "size": index_size,
+        },
+        "metrics": metrics.as_dict() if metrics else {},
+    }
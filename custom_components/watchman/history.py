@@ -0,0 +1,89 @@
+"""Missing status history of watchman entries"""
+
+from collections import deque
+from datetime import datetime, timezone
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    HISTORY_SAVE_DELAY,
+    HISTORY_SIZE,
+    HISTORY_STORAGE_KEY,
+    HISTORY_STORAGE_VERSION,
+)
+
+STATUS_OK = "ok"
+
+
+class MissingHistory:
+    """Bounded transition log of missing entries kept in HA storage.
+
+    Each transition is stored as a compact [id, old status, new status, unix
+    time] row in a ring of HISTORY_SIZE rows, the oldest rows are rotated
+    out. Current status of every missing entry and the time it went missing
+    are kept apart, so "missing since" survives rotation and restarts.
+    """
+
+    def __init__(self, hass: HomeAssistant, size=HISTORY_SIZE):
+        self._store = Store(hass, HISTORY_STORAGE_VERSION, HISTORY_STORAGE_KEY)
+        self.log = deque(maxlen=size)
+        # id -> [status, unix time the entry went missing]
+        self.status = {}
+
+    async def async_load(self):
+        """restore history saved by previous runs"""
+        data = await self._store.async_load()
+        if data:
+            self.log.extend(data.get("log", []))
+            self.status = data.get("status", {})
+
+    async def async_save(self):
+        """write pending changes immediately"""
+        await self._store.async_save(self._data_to_save())
+
+    @callback
+    def async_update(self, current, entries=None):
+        """record transitions to the current {id: status} of missing entries
+
+        If entries are given, only these ids are updated and current holds
+        the missing ones among them.
+        """
+        now = int(dt_util.utcnow().timestamp())
+        changed = False
+        known = self.status if entries is None else set(entries) & self.status.keys()
+        for entry in [e for e in known if e not in current]:
+            status, _ = self.status.pop(entry)
+            self.log.append([entry, status, STATUS_OK, now])
+            changed = True
+        for entry, status in current.items():
+            old_status, since = self.status.get(entry, (STATUS_OK, now))
+            if old_status != status:
+                self.log.append([entry, old_status, status, now])
+                self.status[entry] = [status, since]
+                changed = True
+        if changed:
+            self._store.async_delay_save(self._data_to_save, HISTORY_SAVE_DELAY)
+
+    def missing_since(self, entry):
+        """time the entry went missing, None if it is not missing"""
+        if entry not in self.status:
+            return None
+        return datetime.fromtimestamp(self.status[entry][1], timezone.utc)
+
+    def transitions(self, entry=None):
+        """logged transitions as dicts, oldest first"""
+        return [
+            {
+                "id": row[0],
+                "old": row[1],
+                "new": row[2],
+                "time": datetime.fromtimestamp(row[3], timezone.utc).isoformat(),
+            }
+            for row in self.log
+            if entry is None or row[0] == entry
+        ]
+
+    def _data_to_save(self):
+        return {"status": self.status, "log": list(self.log)}
@@ -0,0 +1,110 @@
+"""Runtime counters and timings of watchman hot paths"""
+
+import sys
+from collections import Counter, deque
+
+from .const import (
+    HASS_DATA_DOMAIN_FILES,
+    HASS_DATA_FILE_SCOPES,
+    HASS_DATA_PARSED_ENTITY_LIST,
+    HASS_DATA_PARSED_SERVICE_LIST,
+    HASS_DATA_REFERENCES,
+    METRICS_HISTORY,
+    METRICS_TIMING_BUCKETS,
+)
+
+
+class WatchmanMetrics:
+    """Counters, gauges and timing history of the last METRICS_HISTORY runs"""
+
+    def __init__(self, history=METRICS_HISTORY):
+        self.history = history
+        self.counters = Counter()
+        self.gauges = {}
+        self.timings = {}
+        # number of timed runs ever observed, snapshots go stale when it grows
+        self.runs = 0
+
+    def count(self, name, value=1):
+        """increase a counter"""
+        self.counters[name] += value
+
+    def event(self, handler, filtered=False):
+        """count an event received by a handler, filtered ones caused no work"""
+        self.counters[f"events_received.{handler}"] += 1
+        if filtered:
+            self.counters[f"events_filtered.{handler}"] += 1
+
+    def observe(self, name, duration):
+        """record duration of a run in seconds"""
+        self.timings.setdefault(name, deque(maxlen=self.history)).append(duration)
+        self.runs += 1
+
+    @property
+    def last_parse_duration(self):
+        """duration of the latest full configuration scan"""
+        timings = self.timings.get("parse")
+        return round(timings[-1], 4) if timings else None
+
+    def as_dict(self):
+        """json serializable snapshot of all metrics"""
+        return {
+            "counters": dict(sorted(self.counters.items())),
+            "gauges": dict(self.gauges),
+            "timings": {
+                name: summarize(durations)
+                for name, durations in sorted(self.timings.items())
+            },
+        }
+
+
+def summarize(durations):
+    """statistics and cumulative histogram of recorded durations"""
+    ordered = sorted(durations)
+    histogram = {
+        f"le_{bound}": sum(1 for d in ordered if d <= bound)
+        for bound in METRICS_TIMING_BUCKETS
+    }
+    histogram["le_inf"] = len(ordered)
+    return {
+        "runs": len(ordered),
+        "last": round(durations[-1], 4),
+        "min": round(ordered[0], 4),
+        "max": round(ordered[-1], 4),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p95": round(ordered[int(0.95 * (len(ordered) - 1))], 4),
+        "histogram": histogram,
+    }
+
+
+def get_deep_size(obj, seen=None):
+    """approximate memory footprint of an object and everything it refers to"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(
+            get_deep_size(k, seen) + get_deep_size(v, seen) for k, v in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(get_deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += get_deep_size(vars(obj), seen)
+    return size
+
+
+def get_index_size(data):
+    """memory footprint in bytes of parsed lists, references and file structure"""
+    seen = set()
+    return sum(
+        get_deep_size(data.get(key), seen)
+        for key in (
+            HASS_DATA_PARSED_ENTITY_LIST,
+            HASS_DATA_PARSED_SERVICE_LIST,
+            HASS_DATA_FILE_SCOPES,
+            HASS_DATA_DOMAIN_FILES,
+            HASS_DATA_REFERENCES,
+        )
+    )
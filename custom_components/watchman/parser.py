@@ -0,0 +1,1586 @@
+"""Configuration files parser for watchman, loaded when a parse is scheduled"""
+
+import bisect
+import copy
+import hashlib
+import io
+import re
+import fnmatch
+import glob
+import logging
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+import anyio
+import jinja2
+from jinja2 import nodes
+from homeassistant.const import Platform
+from homeassistant.core import CoreState
+
+from .metrics import WatchmanMetrics
+from .utils import Locations, add_occurrences, count_occurrences, get_config
+
+from .const import (
+    DOMAIN,
+    CONF_IGNORED_ITEMS,
+    CONF_MAX_FILE_SIZE,
+    CONF_SCAN_CONCURRENCY,
+    BUNDLED_IGNORED_ITEMS,
+    DEFAULT_MAX_FILE_SIZE,
+    CONF_THROTTLE_FILES,
+    CONF_THROTTLE_KBYTES,
+    DEFAULT_SCAN_CONCURRENCY,
+    HASS_DATA_STARTED,
+    MMAP_SCAN_THRESHOLD,
+    SCAN_BACKOFF_BACKLOG,
+    SCAN_BACKOFF_MAX,
+    SCAN_FILE_TIME_BUDGET,
+    SCAN_MAX_LINE_LENGTH,
+    SCAN_SETTLE_TIME,
+    TEMPLATE_CACHE_SIZE,
+    TEMPLATE_MAX_LENGTH,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+ENTITY_PATTERN = re.compile(
+    r"(?:(?<=\s)|(?<=^)|(?<=\")|(?<=\'))([A-Za-z_0-9]*\s*:)?(?:\s*)?(?:states.)?"
+    rf"(({ "|".join(Platform) })\.[A-Za-z_*0-9]+)"
+)
+SERVICE_PATTERN = re.compile(r"service:\s*([A-Za-z_0-9]*\.[A-Za-z_0-9]+)")
+COMMENT_PATTERN = re.compile(r"\s*#.*")
+# bytes flavour for large files, whitespace never spans lines
+ENTITY_PATTERN_BYTES = re.compile(
+    rb"(?:(?<=\s)|(?<=^)|(?<=\")|(?<=\'))([A-Za-z_0-9]*[^\S\n]*:)?(?:[^\S\n]*)?"
+    rb"(?:states.)?" + rf"(({ "|".join(Platform) })\.[A-Za-z_*0-9]+)".encode(),
+    re.MULTILINE,
+)
+SERVICE_PATTERN_BYTES = re.compile(rb"service:[^\S\n]*([A-Za-z_0-9]*\.[A-Za-z_0-9]+)")
+STRUCTURE_PATTERN_BYTES = re.compile(
+    rb"^(?:[A-Za-z_][^\n]*|[^\n]*!include[^\n]*)", re.MULTILINE
+)
+# linear time flavour of ENTITY_PATTERN for oversized lines: a candidate may
+# only start at a word boundary and its domain is checked against a set
+FALLBACK_ENTITY_PATTERN = re.compile(
+    r"(?<![A-Za-z0-9_.])(?:states\.)?([a-z_]+)\.[A-Za-z_*0-9]+"
+)
+FALLBACK_ENTITY_PATTERN_BYTES = re.compile(
+    rb"(?<![A-Za-z0-9_.])(?:states\.)?([a-z_]+)\.[A-Za-z_*0-9]+"
+)
+LONG_LINE_PATTERN_BYTES = re.compile(
+    rb"^[^\n]{%d}" % SCAN_MAX_LINE_LENGTH, re.MULTILINE
+)
+PLATFORM_DOMAINS = frozenset(str(platform) for platform in Platform)
+# lines which may start, name or close an owner, for files scanned via mmap
+OWNER_LINE_PATTERN_BYTES = re.compile(
+    rb"^(?:[A-Za-z_]|[^\S\n]*(?:-[^\S\n]|[}\]]|[A-Za-z_][A-Za-z0-9_]*:[^\S\n]*$"
+    rb"|\"?(?:alias|name|id|type|title)\"?[^\S\n]*:))[^\n]*",
+    re.MULTILINE,
+)
+OWNER_DOMAINS = ("automation", "script", "scene")
+# domains whose loaded configs keep file and line of every string
+LOADED_DOMAINS = ("automation", "script")
+SERVICE_KEYS = ("service", "action")
+SERVICE_ID_PATTERN = re.compile(r"[A-Za-z_0-9]*\.[A-Za-z_0-9]+")
+# domain keys may carry a label, as in automation manual: !include ...
+KEY_LABEL = r"(?:[ \t]+[^\s:#][^:#\n]*?)?"
+
+
+def translate_glob(pattern):
+    """regex of a glob pattern relative to its folder, ** spans directories"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            out.append("[^/]*")
+        elif char == "?":
+            out.append("[^/]")
+        elif char == "[" and (end := pattern.find("]", i + 2)) != -1:
+            chars = pattern[i + 1 : end]
+            negate = chars.startswith("!")
+            out.append(f"[{'^' if negate else ''}{re.escape(chars[negate:])}]")
+            i = end
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return "".join(out) + r"\Z"
+
+
+def find_files(folder, pattern):
+    """files below folder matching a glob pattern with their (device, inode)
+
+    Symlinks to directories are followed, but a directory is never entered
+    from within itself, so symlink loops are cut. Runs in executor.
+    """
+    parts = pattern.split("/")
+    literal = []
+    while len(parts) > 1 and not any(c in parts[0] for c in "*?["):
+        literal.append(parts.pop(0))
+    pattern = "/".join(parts)
+    match = re.compile(translate_glob(pattern)).match
+    max_depth = None if "**" in pattern else pattern.count("/")
+    found = []
+
+    def walk(path, rel, depth, ancestors):
+        try:
+            stat = os.stat(path)
+            entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+        except OSError as exception:
+            _LOGGER.debug("Unable to list %s: %s", path, exception)
+            return
+        identity = (stat.st_dev, stat.st_ino)
+        if identity in ancestors:
+            _LOGGER.warning("Symlink loop at %s, folder skipped", path)
+            return
+        ancestors = ancestors | {identity}
+        folders = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    folders.append(entry)
+                elif entry.is_file() and match(rel + entry.name):
+                    if entry.is_symlink():
+                        target = entry.stat()
+                        found.append((entry.path, (target.st_dev, target.st_ino)))
+                    else:
+                        found.append((entry.path, (stat.st_dev, entry.inode())))
+            except OSError:
+                continue
+        if max_depth is None or depth < max_depth:
+            for entry in folders:
+                walk(entry.path, f"{rel}{entry.name}/", depth + 1, ancestors)
+
+    walk(os.path.join(folder, *literal), "", 0, frozenset())
+    return found
+
+
+async def async_get_next_file(folder_tuples, ignored_files):
+    """Returns next file for scan, the folder it was found in and its inode
+
+    A file matched by several folder tuples is returned once.
+    """
+    if not ignored_files:
+        ignored_files = ""
+    else:
+        ignored_files = "|".join([f"({fnmatch.translate(f)})" for f in ignored_files])
+    ignored_files_re = re.compile(ignored_files)
+    seen = set()
+    for folder_name, glob_pattern in folder_tuples:
+        _LOGGER.debug(
+            "Scan folder %s with pattern %s for configuration files",
+            folder_name,
+            glob_pattern,
+        )
+        files = await anyio.to_thread.run_sync(find_files, folder_name, glob_pattern)
+        for filename, identity in files:
+            if filename in seen:
+                continue
+            seen.add(filename)
+            _LOGGER.debug("Found file %s.", filename)
+            yield (
+                filename,
+                (ignored_files and ignored_files_re.match(filename)),
+                folder_name,
+                identity,
+            )
+
+
+def add_entry(_list, entry, yaml_file, lineno):
+    """Add entry to list of missing entities/services with line number information"""
+    _LOGGER.debug("Added %s to the list", entry)
+    if entry in _list:
+        _list[entry].setdefault(yaml_file, Locations()).add(lineno)
+    else:
+        _list[entry] = {yaml_file: Locations([lineno])}
+
+
+class OwnerMap:
+    """Top-level objects which lines of a file belong to
+
+    Automations and scenes are list items, scripts are mapping keys, either
+    at the top of a file or below a domain key. Dashboard cards are objects
+    with a type key, which the dashboard editor writes first. Owners are recorded in the order they start, a line
+    belongs to the last owner started at or before it. Owners at the top of
+    a file, like items of automations.yaml, get their kind ("") from the
+    domain map once all files are scanned, None kind means no owner.
+    """
+
+    key_pattern = re.compile(rf"([A-Za-z_][A-Za-z0-9_]*){KEY_LABEL}\s*:")
+    label_pattern = re.compile(r"(alias|name|id)\s*:\s*[\"']?([^\"'\n]*)")
+    card_pattern = re.compile(r"\"?type\"?\s*:\s*[\"']?([^\"',\n]+)")
+    title_pattern = re.compile(r"\"?title\"?\s*:\s*[\"']?([^\"',\n]+)")
+    label_rank = {"id": 1, "name": 2, "alias": 3}
+
+    def __init__(self, dashboard=False):
+        self.dashboard = dashboard
+        self.starts = []
+        # [kind, name, rank of the key name was taken from]
+        self.owners = []
+        self._domain = None
+        self._indent = None
+        self._label_indent = None
+        self._cards = []
+        self._view = None
+
+    @property
+    def current(self):
+        """index of the owner of the last fed line"""
+        return len(self.owners) - 1
+
+    def at(self, lineno):
+        """index of the owner of a line"""
+        return bisect.bisect_right(self.starts, lineno) - 1
+
+    def _start(self, lineno, kind, name=None):
+        self.starts.append(lineno)
+        self.owners.append([kind, name, 0])
+
+    def feed(self, line, lineno):
+        """track owners from a line of the file with comments removed"""
+        text = line.lstrip(" ")
+        if not text.strip():
+            return
+        indent = len(line) - len(text)
+        item = text[:2] == "- " or text.rstrip() == "-"
+        body = text[1:].lstrip() if item else text
+        key_indent = indent + 2 if item else indent
+        if self.dashboard:
+            self._feed_card(body, item, key_indent, lineno)
+            return
+        if indent == 0 and not item:
+            self._indent = self._label_indent = None
+            if not (match := self.key_pattern.match(text)):
+                return
+            key = match.group(1)
+            self._domain = key if key in OWNER_DOMAINS else None
+            if self._domain:
+                self._start(lineno, None)
+            else:
+                self._start(lineno, "", key)
+            return
+        if indent == 0 or self._domain in ("automation", "scene"):
+            if item and self._indent in (None, indent):
+                self._indent = indent
+                self._label_indent = key_indent
+                self._start(lineno, self._domain or "")
+        elif self._domain == "script" and not item:
+            if self._indent in (None, indent):
+                self._indent = indent
+                if match := self.key_pattern.match(body):
+                    self._start(lineno, "script", match.group(1))
+        if key_indent == self._label_indent and self.owners:
+            if match := self.label_pattern.match(body):
+                owner = self.owners[-1]
+                rank = self.label_rank[match.group(1)]
+                if rank > owner[2] and match.group(2).strip():
+                    owner[1:] = [match.group(2).strip(), rank]
+
+    def _feed_card(self, body, item, key_indent, lineno):
+        depth = len(self._cards)
+        while self._cards and (
+            key_indent < self._cards[-1][0]
+            or (key_indent == self._cards[-1][0] and item)
+        ):
+            self._cards.pop()
+        if match := self.card_pattern.match(body):
+            card = match.group(1).strip()
+            if self._view:
+                card = f"{card} ({self._view})"
+            self._cards.append((key_indent, card))
+            self._start(lineno, "card", card)
+        elif len(self._cards) != depth:
+            if self._cards:
+                self._start(lineno, "card", self._cards[-1][1])
+            else:
+                self._start(lineno, None)
+        if not self._cards and (match := self.title_pattern.match(body)):
+            self._view = match.group(1).strip()
+
+    def labels(self, path, default_kind=None):
+        """label of every owner, None for lines without an owner"""
+        result = []
+        for start, (kind, name, _) in zip(self.starts, self.owners):
+            kind = default_kind if kind == "" else kind
+            result.append(f"{kind}: {name or f'{path}:{start}'}" if kind else None)
+        return result
+
+
+class FileScope:
+    """Structure of a configuration file: top-level keys and !include targets"""
+
+    top_key_pattern = re.compile(rf"^([A-Za-z_][A-Za-z0-9_]*){KEY_LABEL}\s*:")
+    sub_key_pattern = re.compile(rf"^(\s+)([A-Za-z_][A-Za-z0-9_]*){KEY_LABEL}\s*:")
+    include_pattern = re.compile(
+        rf"(?:([A-Za-z_][A-Za-z0-9_]*){KEY_LABEL}\s*:\s*)?"
+        r"!(include(?:_dir_(?:named|list|merge_named|merge_list))?)\s+([^\s#]+)"
+    )
+
+    def __init__(self, path, size=0):
+        self.path = path
+        self.size = size
+        self.keys = []
+        self.subkeys = []
+        # (top-level key, key of the include line, directive, target path)
+        self.includes = []
+        self.owner_map = OwnerMap("lovelace" in os.path.basename(path))
+        # entry -> indexes of owners in owner_map
+        self.references = {}
+        # content hash, files with equal digests are scanned once
+        self.digest = None
+        self._top_key = None
+        self._sub_indent = None
+
+    def feed(self, line):
+        """collect structure from a line of the file with comments removed"""
+        if match := self.top_key_pattern.match(line):
+            self._top_key = match.group(1)
+            self._sub_indent = None
+            self.keys.append(self._top_key)
+        elif match := self.sub_key_pattern.match(line):
+            indent = len(match.group(1))
+            if self._sub_indent is None:
+                self._sub_indent = indent
+            if indent == self._sub_indent:
+                self.subkeys.append(match.group(2))
+        if "!include" not in line:
+            return
+        for match in self.include_pattern.finditer(line):
+            line_key, directive, target = match.groups()
+            target = os.path.normpath(
+                os.path.join(os.path.dirname(self.path), target.strip("\"'"))
+            )
+            if directive != "include":
+                target = os.path.join(target, "")
+            self.includes.append((self._top_key, line_key, directive, target))
+
+    def alias(self, path):
+        """copy of the structure for another path of the same file"""
+        scope = copy.copy(self)
+        scope.path = path
+        source_dir, alias_dir = os.path.dirname(self.path), os.path.dirname(path)
+
+        def rebase(target):
+            rebased = os.path.normpath(
+                os.path.join(alias_dir, os.path.relpath(target, source_dir))
+            )
+            return os.path.join(rebased, "") if target.endswith(os.sep) else rebased
+
+        scope.includes = [
+            (top_key, line_key, directive, rebase(target))
+            for top_key, line_key, directive, target in self.includes
+        ]
+        return scope
+
+    def add_reference(self, entry, owner):
+        """record that an entry is referenced within an owner"""
+        if owner >= 0 and self.owner_map.owners[owner][0] is not None:
+            self.references.setdefault(entry, set()).add(owner)
+
+
+def build_domain_map(file_scopes):
+    """map configuration domains to the files which may define them
+
+    Top-level keys of the root files (configuration.yaml and packages) are
+    domains, files included below a domain key belong to that domain, as
+    well as any file they include in turn. Directories of !include_dir_*
+    directives are added to the domain so new files are picked up.
+    """
+    edges = []
+    package_files = set()
+    merged_packages = set()
+    included_files = set()
+    for path, scope in file_scopes.items():
+        for top_key, line_key, directive, target in scope.includes:
+            if target.endswith(os.sep):
+                targets = {f for f in file_scopes if f.startswith(target)}
+            else:
+                targets = {target} & file_scopes.keys()
+            if line_key == "packages":
+                package_files |= targets
+                if directive == "include_dir_merge_named":
+                    merged_packages |= targets
+            included_files |= targets
+            edges.append((path, top_key, line_key, target, targets))
+
+    roots = (file_scopes.keys() - included_files) | package_files
+    owners = {path: set() for path in file_scopes}
+    for path in roots:
+        scope = file_scopes[path]
+        owners[path].update(scope.subkeys if path in merged_packages else scope.keys)
+
+    def contribution(path, top_key, line_key):
+        if path not in roots:
+            return owners[path]
+        key = line_key if path in merged_packages else top_key
+        return {key} if key else set()
+
+    changed = True
+    while changed:
+        changed = False
+        for path, top_key, line_key, _, targets in edges:
+            if line_key == "packages":
+                continue
+            domains = contribution(path, top_key, line_key)
+            for target in targets:
+                if not domains <= owners[target]:
+                    owners[target] |= domains
+                    changed = True
+
+    domain_files = {}
+    for path, domains in owners.items():
+        for domain in domains:
+            domain_files.setdefault(domain, set()).add(path)
+    for path, top_key, line_key, target, targets in edges:
+        if not target.endswith(os.sep):
+            continue
+        if line_key == "packages":
+            domains = set().union(*(owners[t] for t in targets))
+        else:
+            domains = contribution(path, top_key, line_key)
+        for domain in domains:
+            domain_files.setdefault(domain, set()).add(target)
+    return domain_files
+
+
+def build_reference_index(file_scopes, domain_files):
+    """map referenced ids to their owning automations, scripts, scenes and cards
+
+    Owners at the top of a file get the kind of the single automation,
+    script or scene domain which includes the file.
+    """
+    file_domains = {}
+    for domain in OWNER_DOMAINS:
+        for path in domain_files.get(domain, ()):
+            file_domains.setdefault(path, []).append(domain)
+    index = {}
+    for path, scope in file_scopes.items():
+        if not scope.references:
+            continue
+        domains = [d for d in file_domains.get(path, []) if d not in scope.keys]
+        labels = scope.owner_map.labels(path, domains[0] if len(domains) == 1 else None)
+        for entry, owners in scope.references.items():
+            index.setdefault(entry, set()).update(
+                labels[owner] for owner in owners if labels[owner]
+            )
+    return {entry: sorted(labels) for entry, labels in index.items() if labels}
+
+
+def get_scope_folders(files, root):
+    """folder tuples which cover files and directories of a partial scan"""
+    folders = []
+    for path in sorted(files):
+        full_path = os.path.join(root, path)
+        if path.endswith(os.sep):
+            folders.append((full_path, "**/*.yaml"))
+        else:
+            folders.append(
+                (os.path.dirname(full_path), glob.escape(os.path.basename(full_path)))
+            )
+    return folders
+
+
+def get_scope_files(file_scopes, files):
+    """known files covered by files and directories of a partial scan"""
+    dirs = tuple(f for f in files if f.endswith(os.sep))
+    return {f for f in file_scopes if f in files or (dirs and f.startswith(dirs))}
+
+
+def merge_entries(parsed_list, update, files):
+    """replace occurrences found in rescanned files with fresh results"""
+    merged = {}
+    for entry, occurrences in parsed_list.items():
+        occurrences = {k: v for k, v in occurrences.items() if k not in files}
+        if occurrences:
+            merged[entry] = occurrences
+    for entry, occurrences in update.items():
+        add_occurrences(merged, entry, occurrences)
+    return merged
+
+
+def get_loaded_files(file_scopes, domain_files):
+    """files which define nothing but automations or scripts"""
+    file_domains = {}
+    for domain, paths in domain_files.items():
+        for path in paths:
+            file_domains.setdefault(path, set()).add(domain)
+    return {
+        path
+        for path, domains in file_domains.items()
+        if len(domains) == 1
+        and not domains.isdisjoint(LOADED_DOMAINS)
+        and path in file_scopes
+        and not file_scopes[path].includes
+    }
+
+
+def iter_strings(config):
+    """(key, string) of keys and string values of a loaded config, nested"""
+    stack = [(None, config)]
+    while stack:
+        key, value = stack.pop()
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                if isinstance(sub_key, str):
+                    yield None, sub_key
+                stack.append((sub_key, sub_value))
+        elif isinstance(value, list):
+            stack.extend((key, item) for item in value)
+        elif isinstance(value, str):
+            yield key, value
+
+
+def extract_config(extraction, config, owner):
+    """add references of a loaded config found in the file being extracted"""
+    for key, text in iter_strings(config):
+        lineno = getattr(text, "__line__", None)
+        if lineno is None or getattr(text, "__config_file__", None) != (
+            extraction.yaml_file
+        ):
+            continue
+        if key in SERVICE_KEYS and SERVICE_ID_PATTERN.fullmatch(text):
+            extraction.add_service(str(text), lineno, owner)
+            continue
+        # only block scalars keep line breaks, their text starts a line below
+        first = lineno + 1 if "\n" in text else lineno
+        for match in ENTITY_PATTERN.finditer(text):
+            val = match.group(2)
+            if "*" not in val and not val.endswith(".yaml"):
+                lineno = first + text.count("\n", 0, match.start())
+                extraction.add_entity(val, lineno, owner)
+
+
+def load_configs(hass, root, file_scopes, domain_files):
+    """results of files taken from configs loaded by Home Assistant
+
+    Home Assistant keeps raw automation and script configs, whose strings
+    carry the file and line they were read from. Files of the last scan
+    which define nothing else are extracted from memory, which also picks
+    up configs reloaded since. Returns {short_path: (entities, services,
+    scope)} of these files.
+    """
+    loaded_files = get_loaded_files(file_scopes, domain_files)
+    configs = {}
+    for domain in LOADED_DOMAINS:
+        for entity in getattr(hass.data.get(domain), "entities", ()):
+            config = getattr(entity, "raw_config", None)
+            keys = [key for key in config or () if hasattr(key, "__line__")]
+            if not keys:
+                continue
+            yaml_file = keys[0].__config_file__
+            if os.path.relpath(yaml_file, root) not in loaded_files:
+                continue
+            name = config.get("alias") or config.get("id") or entity.entity_id
+            start = min(key.__line__ for key in keys)
+            configs.setdefault(yaml_file, []).append((start, str(name), config))
+    results = {}
+    for yaml_file, items in configs.items():
+        short_path = os.path.relpath(yaml_file, root)
+        extraction = Extraction(yaml_file, short_path, b"")
+        scope = extraction.scope
+        old_scope = file_scopes[short_path]
+        scope.keys, scope.subkeys = old_scope.keys, old_scope.subkeys
+        # owners start in line order, kind comes from the domain map
+        for start, name, config in sorted(items, key=lambda item: item[0]):
+            scope.owner_map._start(start, "", name)
+            extract_config(extraction, config, scope.owner_map.current)
+        results[short_path] = (extraction.entities, extraction.services, scope)
+    return results
+
+
+class ScanLimitError(Exception):
+    """File exceeds the configured maximum file size"""
+
+
+class DuplicateFileError(Exception):
+    """Content of the file is scanned under another path"""
+
+    def __init__(self, digest):
+        super().__init__(digest)
+        self.digest = digest
+
+
+def file_digest(data):
+    """content hash of a file"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ScanBudget:
+    """Work budget of a single file scan, records the limits which were hit"""
+
+    def __init__(self):
+        self.deadline = time.monotonic() + SCAN_FILE_TIME_BUDGET
+        self.long_lines = 0
+        self.stopped_at = None
+
+    def exhausted(self, lineno):
+        """whether the time budget of the file is spent"""
+        if self.stopped_at is None and time.monotonic() > self.deadline:
+            self.stopped_at = lineno
+        return self.stopped_at is not None
+
+    @property
+    def limits(self):
+        """limits hit by the scan in human readable form"""
+        limits = []
+        if self.long_lines:
+            limits.append(
+                f"{self.long_lines} line(s) longer than {SCAN_MAX_LINE_LENGTH} "
+                "characters scanned with fallback pattern"
+            )
+        if self.stopped_at is not None:
+            limits.append(
+                f"scan stopped at line {self.stopped_at} after "
+                f"{SCAN_FILE_TIME_BUDGET}s."
+            )
+        return limits
+
+
+def strip_comment(line):
+    """remove comment from a line, in linear time for oversized lines"""
+    if len(line) > SCAN_MAX_LINE_LENGTH:
+        index = line.find("#")
+        return line if index == -1 else line[:index]
+    return COMMENT_PATTERN.sub("", line)
+
+
+def find_entities_linear(text, pos=0, endpos=None):
+    """Linear time replacement of ENTITY_PATTERN for oversized lines
+
+    Works on str and bytes, yields (offset, entity) for candidates which are
+    preceded by start of line, whitespace, quote or a key other than service:
+    """
+    is_bytes = not isinstance(text, str)
+    pattern = FALLBACK_ENTITY_PATTERN_BYTES if is_bytes else FALLBACK_ENTITY_PATTERN
+    endpos = len(text) if endpos is None else endpos
+    for match in pattern.finditer(text, pos, endpos):
+        domain = match.group(1)
+        val = text[match.start(1) : match.end()]
+        before = text[max(pos, match.start() - len("service:") - 16) : match.start()]
+        if is_bytes:
+            # bytes patterns match ASCII characters only
+            domain, val = domain.decode("ascii"), val.decode("ascii")
+            before = before.decode("latin-1")
+        if domain not in PLATFORM_DOMAINS:
+            continue
+        if before and not (before[-1].isspace() or before[-1] in "\"':"):
+            continue
+        if before.rstrip().endswith("service:"):
+            continue
+        yield match.start(), val
+
+
+def iter_segments(buf):
+    """split buffer into line aligned (start, end, oversized) segments
+
+    Oversized lines get a segment of their own, other segments are kept
+    below MMAP_SCAN_THRESHOLD so the scan budget is checked between them.
+    """
+
+    def chunks(start, end):
+        while end - start > MMAP_SCAN_THRESHOLD:
+            cut = buf.rfind(b"\n", start + 1, start + MMAP_SCAN_THRESHOLD)
+            if cut == -1:
+                break
+            yield start, cut, False
+            start = cut
+        yield start, end, False
+
+    pos = 0
+    for match in LONG_LINE_PATTERN_BYTES.finditer(buf):
+        yield from chunks(pos, match.start())
+        end = buf.find(b"\n", match.start())
+        if end == -1:
+            end = len(buf)
+        yield match.start(), end, True
+        pos = end
+    yield from chunks(pos, len(buf))
+
+
+class StallMeter:
+    """Longest stretch of time the scan held the event loop without awaiting"""
+
+    def __init__(self):
+        self.max_stall = 0.0
+        self._resumed = time.monotonic()
+
+    def resume(self):
+        """scan got control back from the event loop"""
+        self._resumed = time.monotonic()
+
+    def pause(self):
+        """scan is about to hand control over to the event loop"""
+        self.max_stall = max(self.max_stall, time.monotonic() - self._resumed)
+
+
+class ScanThrottle:
+    """Token buckets of files and bytes read per second by background scans
+
+    Files are charged once they are handed over to the executor, bytes once
+    they were read, the next file waits until both buckets are refilled.
+    Waits are stretched twice per file, up to SCAN_BACKOFF_MAX times, while
+    Home Assistant is starting or settling for SCAN_SETTLE_TIME seconds
+    after start, or while the recorder is behind with its writes.
+    """
+
+    # time source of the buckets
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, hass, token, kbytes_rate, files_rate):
+        self.hass = hass
+        self.token = token
+        self.bytes_rate = kbytes_rate * 1024
+        self.files_rate = files_rate
+        # seconds until each bucket is refilled
+        self.files_debt = 0.0
+        self.bytes_debt = 0.0
+        self.backoff = 1
+        self.waited = 0.0
+        self._refilled = self.clock()
+
+    def _refill(self):
+        now = self.clock()
+        elapsed, self._refilled = now - self._refilled, now
+        self.files_debt = max(0.0, self.files_debt - elapsed)
+        self.bytes_debt = max(0.0, self.bytes_debt - elapsed)
+
+    def charge(self, files=0, size=0):
+        """account for files handed over and bytes read"""
+        self._refill()
+        if self.files_rate:
+            self.files_debt += files / self.files_rate
+        if self.bytes_rate:
+            self.bytes_debt += size / self.bytes_rate
+
+    def is_busy(self):
+        """whether home assistant is starting or settling, or the recorder lags"""
+        # hass.is_running is already set while integrations are starting
+        if self.hass.state is not CoreState.running:
+            return True
+        # the state is running by the time watchman gets the started event
+        started = self.hass.data.get(DOMAIN, {}).get(HASS_DATA_STARTED)
+        if started is not None and self.clock() - started < SCAN_SETTLE_TIME:
+            return True
+        recorder = self.hass.data.get("recorder_instance")
+        return getattr(recorder, "backlog", 0) > SCAN_BACKOFF_BACKLOG
+
+    async def async_wait(self):
+        """wait until the budget allows reading the next file"""
+        self._refill()
+        if self.is_busy():
+            self.backoff = min(self.backoff * 2, SCAN_BACKOFF_MAX)
+        else:
+            self.backoff = 1
+        delay = max(self.files_debt, self.bytes_debt) * self.backoff
+        if delay > 0:
+            started = self.clock()
+            await self.token.async_sleep(delay)
+            self.waited += self.clock() - started
+            # stretched part of the wait is not owed to the buckets anymore
+            self._refill()
+            self.files_debt = self.bytes_debt = 0.0
+
+
+def scan_file(yaml_file, short_path, max_size=0, claim=None, timings=None):
+    """Extract entities/services and structure of a file, runs in executor
+
+    Returns limits of ScanBudget which were hit along with the results,
+    raises ScanLimitError if the file is larger than max_size bytes. Size
+    is taken from the open file, so a file costs a single lookup on
+    network filesystems. Optional claim is called with the content hash
+    and DuplicateFileError is raised if it returns False. Optional timings
+    list gets (extractor name, seconds or None if prefiltered) appended.
+    """
+    with open(yaml_file, "rb") as raw:
+        size = os.fstat(raw.fileno()).st_size
+        if max_size and size > max_size:
+            raise ScanLimitError(f"skipped, size of {size} bytes exceeds max_file_size")
+        if size > MMAP_SCAN_THRESHOLD:
+            return scan_file_mmap(yaml_file, short_path, raw, claim, timings)
+        data = raw.read()
+    return extract(Extraction(yaml_file, short_path, data), claim, timings)
+
+
+def extract(extraction, claim=None, timings=None):
+    """run extractors which handle the file and accept its content"""
+    extraction.scope.digest = file_digest(extraction.data)
+    if claim and not claim(extraction.scope.digest):
+        raise DuplicateFileError(extraction.scope.digest)
+    for extractor in EXTRACTORS:
+        if not extractor.handles(extraction.short_path):
+            continue
+        if not extractor.accepts(extraction.data):
+            if timings is not None:
+                timings.append((extractor.name, None))
+            continue
+        start = time.monotonic()
+        extractor.extract(extraction)
+        if timings is not None:
+            timings.append((extractor.name, time.monotonic() - start))
+    return (
+        extraction.entities,
+        extraction.services,
+        extraction.scope,
+        extraction.budget.limits,
+    )
+
+
+class Extraction:
+    """Content of a file being scanned and references found so far"""
+
+    def __init__(self, yaml_file, short_path, data):
+        self.yaml_file = yaml_file
+        self.short_path = short_path
+        # bytes, or mmap of files larger than MMAP_SCAN_THRESHOLD
+        self.data = data
+        self.entities = {}
+        self.services = {}
+        self.scope = FileScope(short_path, len(data))
+        self.budget = ScanBudget()
+
+    def add_entity(self, entry, lineno, owner=None):
+        """record an entity referenced at a line, within its owner"""
+        add_entry(self.entities, entry, self.short_path, lineno)
+        if owner is None:
+            owner = self.scope.owner_map.at(lineno)
+        self.scope.add_reference(entry, owner)
+
+    def add_service(self, entry, lineno, owner=None):
+        """record a service referenced at a line, within its owner"""
+        add_entry(self.services, entry, self.short_path, lineno)
+        if owner is None:
+            owner = self.scope.owner_map.at(lineno)
+        self.scope.add_reference(entry, owner)
+
+    def has_entity(self, entry, lineno):
+        """whether an entity was already found at a line"""
+        return lineno in self.entities.get(entry, {}).get(self.short_path, ())
+
+    def discard_entity(self, entry, lineno):
+        """forget an entity found at a line, e.g. a service taken for one"""
+        lines = self.entities.get(entry, {}).get(self.short_path)
+        if not lines or lineno not in lines:
+            return
+        lines.remove(lineno)
+        lines.total -= 1
+        if not lines.total:
+            del self.entities[entry][self.short_path]
+            if not self.entities[entry]:
+                del self.entities[entry]
+
+
+def scan_lines(f, extraction):
+    """Extract entities/services and structure from lines of a text file"""
+    scope = extraction.scope
+    budget = extraction.budget
+    for lineno, line in enumerate(f, start=1):
+        if budget.exhausted(lineno):
+            break
+        line = strip_comment(line)
+        scope.feed(line)
+        scope.owner_map.feed(line, lineno)
+        owner = scope.owner_map.current
+        if len(line) > SCAN_MAX_LINE_LENGTH:
+            budget.long_lines += 1
+            matches = (val for _, val in find_entities_linear(line))
+        else:
+            matches = (
+                match.group(2)
+                for match in ENTITY_PATTERN.finditer(line)
+                if match.group(1) != "service:"
+            )
+        for val in matches:
+            if "*" not in val and not val.endswith(".yaml"):
+                extraction.add_entity(val, lineno, owner)
+        for match in SERVICE_PATTERN.finditer(line):
+            extraction.add_service(match.group(1), lineno, owner)
+
+
+def add_aliases(parsed_entity_list, parsed_service_list, file_scopes, aliases, digests):
+    """attribute results of scanned files to other paths of the same file"""
+    sources = {path: source or digests.get(digest) for path, source, digest in aliases}
+    resolved = {}
+    for path in sources:
+        # an alias may point to another alias, e.g. a symlink to a copy
+        source, seen = sources[path], {path}
+        while source in sources and source not in seen:
+            seen.add(source)
+            source = sources[source]
+        if source in file_scopes and source not in sources:
+            resolved.setdefault(source, []).append(path)
+            file_scopes[path] = file_scopes[source].alias(path)
+    if not resolved:
+        return
+    for parsed_list in (parsed_entity_list, parsed_service_list):
+        for entry, occurrences in parsed_list.items():
+            for source in [s for s in occurrences if s in resolved]:
+                for path in resolved[source]:
+                    add_occurrences(parsed_list, entry, {path: occurrences[source]})
+
+
+async def aenumerate(iterable):
+    """enumerate for async iterables"""
+    index = 0
+    async for item in iterable:
+        yield index, item
+        index += 1
+
+
+def timed_scan(
+    durations, timings, folder, yaml_file, short_path, max_size=0, claim=None
+):
+    """scan_file which appends (folder, seconds) to durations, runs in executor"""
+    start = time.monotonic()
+    try:
+        return scan_file(yaml_file, short_path, max_size, claim, timings)
+    finally:
+        durations.append((folder, time.monotonic() - start))
+
+
+class LineCursor:
+    """Line numbers and comments of buffer offsets, offsets must not decrease"""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.lineno = 0
+        self.end = -1
+        self._next_line()
+
+    def _next_line(self):
+        self.lineno += 1
+        self.start = self.end + 1
+        self.end = self.buf.find(b"\n", self.start)
+        if self.end == -1:
+            self.end = len(self.buf)
+        self.comment = self.buf.find(b"#", self.start, self.end)
+
+    def seek(self, offset):
+        """move to the line which contains offset"""
+        while offset > self.end:
+            self._next_line()
+        return self.lineno
+
+    def in_comment(self, offset):
+        """whether offset of the current line is commented out"""
+        return self.comment != -1 and offset >= self.comment
+
+
+def scan_file_mmap(yaml_file, short_path, f=None, claim=None, timings=None):
+    """Scan a large file through mmap with bytes regexes, runs in executor
+
+    The file is never decoded as a whole, only matched spans are. An already
+    open binary file f of yaml_file is mapped if given, claim and timings
+    work as in scan_file.
+    """
+    with (
+        open(yaml_file, "rb") if f is None else nullcontext(f) as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf,
+    ):
+        return extract(Extraction(yaml_file, short_path, buf), claim, timings)
+
+
+def scan_buffer(extraction):
+    """Extract entities/services and structure of a mapped file
+
+    A span which is not valid UTF-8 is reported with its offset and skipped.
+    """
+    buf = extraction.data
+    scope = extraction.scope
+    budget = extraction.budget
+    for match in STRUCTURE_PATTERN_BYTES.finditer(buf):
+        try:
+            line = match.group(0).decode("utf-8")
+        except UnicodeDecodeError as exception:
+            _LOGGER.error(
+                "Unable to decode %s at offset %s: %s",
+                extraction.yaml_file,
+                match.start() + exception.start,
+                exception.reason,
+            )
+            continue
+        scope.feed(strip_comment(line))
+
+    cursor = LineCursor(buf)
+    for match in OWNER_LINE_PATTERN_BYTES.finditer(buf):
+        lineno = cursor.seek(match.start())
+        try:
+            line = match.group(0).decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+        scope.owner_map.feed(strip_comment(line), lineno)
+
+    cursor = LineCursor(buf)
+    for start, end, oversized in iter_segments(buf):
+        if budget.exhausted(cursor.lineno):
+            break
+        if oversized:
+            budget.long_lines += 1
+            matches = find_entities_linear(buf, start, end)
+        else:
+            # bytes patterns match ASCII characters only
+            matches = (
+                (match.start(), match.group(2).decode("ascii"))
+                for match in ENTITY_PATTERN_BYTES.finditer(buf, start, end)
+                if match.group(1) != b"service:"
+            )
+        for offset, val in matches:
+            lineno = cursor.seek(offset)
+            if cursor.in_comment(offset):
+                continue
+            if "*" not in val and not val.endswith(".yaml"):
+                extraction.add_entity(val, lineno)
+
+    cursor = LineCursor(buf)
+    for match in SERVICE_PATTERN_BYTES.finditer(buf):
+        lineno = cursor.seek(match.start())
+        if budget.exhausted(lineno):
+            break
+        if not cursor.in_comment(match.start()):
+            extraction.add_service(match.group(1).decode("ascii"), lineno)
+
+
+# template functions, filters and tests which take entity ids
+STATE_FUNCTIONS = frozenset(
+    (
+        "states",
+        "is_state",
+        "state_attr",
+        "is_state_attr",
+        "state_translated",
+        "expand",
+        "has_value",
+    )
+)
+TEMPLATE_ID_PATTERN = re.compile(r"([a-z_]+)\.[A-Za-z_0-9]+")
+# templates are only parsed, never rendered
+TEMPLATE_ENV = jinja2.Environment(
+    extensions=["jinja2.ext.loopcontrols", "jinja2.ext.do"]
+)
+
+
+def literals(node):
+    """string constants of a node, items of a list or tuple included"""
+    if isinstance(node, nodes.Const) and isinstance(node.value, str):
+        yield node.value
+    elif isinstance(node, (nodes.List, nodes.Tuple)):
+        for item in node.items:
+            yield from literals(item)
+
+
+def template_ids(node):
+    """literal ids a template node passes to states and state functions"""
+    if isinstance(node, nodes.Call):
+        if isinstance(node.node, nodes.Name) and node.node.name in STATE_FUNCTIONS:
+            args = node.args if node.node.name == "expand" else node.args[:1]
+            for arg in args:
+                yield from literals(arg)
+    elif isinstance(node, (nodes.Filter, nodes.Test)):
+        if node.name in STATE_FUNCTIONS and node.node is not None:
+            yield from literals(node.node)
+    elif isinstance(node, nodes.Getattr):
+        # states.sensor.x
+        parent = node.node
+        if (
+            isinstance(parent, nodes.Getattr)
+            and isinstance(parent.node, nodes.Name)
+            and parent.node.name == "states"
+        ):
+            yield f"{parent.attr}.{node.attr}"
+    elif isinstance(node, nodes.Getitem):
+        # states['sensor.x'] and states.sensor['x']
+        parent = node.node
+        if isinstance(parent, nodes.Name) and parent.name == "states":
+            yield from literals(node.arg)
+        elif (
+            isinstance(parent, nodes.Getattr)
+            and isinstance(parent.node, nodes.Name)
+            and parent.node.name == "states"
+        ):
+            yield from (f"{parent.attr}.{val}" for val in literals(node.arg))
+
+
+def analyze_template(source):
+    """(entity id, line offset) of literal ids in a template, None if invalid"""
+    try:
+        tree = TEMPLATE_ENV.parse(str(source, "utf-8"))
+    except (UnicodeDecodeError, jinja2.TemplateSyntaxError):
+        return None
+    found = {}
+    for node in tree.find_all(
+        (nodes.Call, nodes.Filter, nodes.Test, nodes.Getattr, nodes.Getitem)
+    ):
+        for val in template_ids(node):
+            match = TEMPLATE_ID_PATTERN.fullmatch(val)
+            if match and match.group(1) in PLATFORM_DOMAINS:
+                found[(val, node.lineno - 1)] = None
+    return tuple(found)
+
+
+class TemplateCache:
+    """References of distinct templates, keyed by a hash of their source
+
+    A template is parsed once, repeated ones cost a lookup. The cache lives
+    as long as this module, so it is kept between scans, least recently
+    used templates are dropped beyond maxsize. Executor threads share it.
+    """
+
+    def __init__(self, maxsize=TEMPLATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def references(self, source):
+        """cached result of analyze_template"""
+        key = hashlib.blake2b(source, digest_size=16).digest()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        result = analyze_template(source)
+        with self._lock:
+            self._entries[key] = result
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+
+TEMPLATES = TemplateCache()
+
+
+class Extractor:
+    """Source of references in files of given patterns
+
+    Patterns are globs of paths relative to the configuration folder. A
+    file is only handed over to extract() if it contains one of prefilter
+    substrings, which is much cheaper than the extraction itself. Extractors
+    run in the order of EXTRACTORS, later ones see results of earlier ones.
+    """
+
+    name = None
+    patterns = ()
+    prefilter = ()
+
+    def __init__(self):
+        self._match = re.compile(
+            "|".join(f"(?:{translate_glob(p)})" for p in self.patterns)
+        ).match
+
+    def handles(self, short_path):
+        """whether the extractor is interested in a file"""
+        return self._match(short_path.replace(os.sep, "/")) is not None
+
+    def accepts(self, data):
+        """whether content of a file may contain references of interest"""
+        return not self.prefilter or any(data.find(s) != -1 for s in self.prefilter)
+
+    def extract(self, extraction):
+        """add references found in extraction.data to extraction"""
+        raise NotImplementedError
+
+
+class ReferenceExtractor(Extractor):
+    """Entity and service ids anywhere in yaml and dashboard files"""
+
+    name = "references"
+    patterns = ("**/*.yaml", "**/lovelace*")
+
+    def extract(self, extraction):
+        if isinstance(extraction.data, mmap.mmap):
+            scan_buffer(extraction)
+        else:
+            text = io.StringIO(extraction.data.decode("utf-8"), newline=None)
+            scan_lines(text, extraction)
+
+
+class LovelaceExtractor(Extractor):
+    """Services called by dashboard card actions stored as json"""
+
+    name = "lovelace"
+    patterns = ("**/lovelace*",)
+    prefilter = (b'"service"', b'"perform_action"')
+    action_pattern = re.compile(
+        rb'"(?:service|perform_action)"[^\S\n]*:[^\S\n]*'
+        rb'"([A-Za-z_0-9]+\.[A-Za-z_0-9]+)"'
+    )
+
+    def extract(self, extraction):
+        cursor = LineCursor(extraction.data)
+        for match in self.action_pattern.finditer(extraction.data):
+            lineno = cursor.seek(match.start())
+            val = match.group(1).decode("ascii")
+            # the quoted value looks like an entity to the reference extractor
+            extraction.discard_entity(val, lineno)
+            extraction.add_service(val, lineno)
+
+
+class TemplateExtractor(Extractor):
+    """Literal ids passed to state functions by templates in yaml and dashboards
+
+    The reference extractor misses ids which follow a bracket or brace, as
+    in {{states.sensor.x}}. Statements are completed into a template of
+    their own, e.g. {% if ... %} gets an {% endif %}.
+    """
+
+    name = "templates"
+    patterns = ("**/*.yaml", "**/lovelace*")
+    prefilter = (b"{{", b"{%")
+    segment_pattern = re.compile(
+        rb"\{\{.{0,%d}?\}\}|\{%%-?\s*(if|elif|for|set)\b.{0,%d}?%%\}"
+        % (TEMPLATE_MAX_LENGTH, TEMPLATE_MAX_LENGTH),
+        re.DOTALL,
+    )
+    closing = {b"if": b"{% endif %}", b"for": b"{% endfor %}", b"set": b""}
+
+    def extract(self, extraction):
+        cursor = LineCursor(extraction.data)
+        for match in self.segment_pattern.finditer(extraction.data):
+            lineno = cursor.seek(match.start())
+            if extraction.budget.exhausted(lineno):
+                break
+            if cursor.in_comment(match.start()):
+                continue
+            # quotes are escaped within json and double quoted yaml strings
+            source = match.group(0).replace(b'\\"', b'"')
+            if keyword := match.group(1):
+                if keyword == b"elif":
+                    source, keyword = source.replace(b"elif", b"if", 1), b"if"
+                source += self.closing[keyword]
+            for val, offset in TEMPLATES.references(source) or ():
+                if not extraction.has_entity(val, lineno + offset):
+                    extraction.add_entity(val, lineno + offset)
+
+
+class JinjaExtractor(Extractor):
+    """Entities used by reusable templates in custom_templates folder
+
+    A file is a single template, which falls back to patterns if it can
+    not be parsed.
+    """
+
+    name = "jinja"
+    patterns = ("custom_templates/**/*.jinja",)
+    prefilter = (b"state", b"expand", b"has_value")
+    call_pattern = re.compile(
+        rb"\b(?:states|is_state|state_attr|is_state_attr|state_translated|expand"
+        rb"|has_value)\(\s*['\"]([a-z_]+)\.([A-Za-z_0-9]+)['\"]"
+    )
+    attr_pattern = re.compile(rb"\bstates\.([a-z_]+)\.([A-Za-z_0-9]+)")
+
+    def extract(self, extraction):
+        data = extraction.data
+        references = TEMPLATES.references(data)
+        if references is not None:
+            for val, offset in references:
+                extraction.add_entity(val, offset + 1)
+            return
+        matches = sorted(
+            [*self.call_pattern.finditer(data), *self.attr_pattern.finditer(data)],
+            key=lambda match: match.start(),
+        )
+        cursor = LineCursor(data)
+        for match in matches:
+            domain = match.group(1).decode("ascii")
+            if domain in PLATFORM_DOMAINS:
+                val = f"{domain}.{match.group(2).decode('ascii')}"
+                extraction.add_entity(val, cursor.seek(match.start()))
+
+
+class BlueprintExtractor(Extractor):
+    """Default entities of blueprint inputs given as flow sequences or maps
+
+    The reference extractor misses ids which follow an opening bracket,
+    as in default: [light.kitchen, light.hall].
+    """
+
+    name = "blueprint"
+    patterns = ("blueprints/**/*.yaml",)
+    prefilter = (b"blueprint:",)
+    default_pattern = re.compile(
+        rb"^[^\S\n]*default:[^\S\n]*[\[{][^\n#]*", re.MULTILINE
+    )
+
+    def extract(self, extraction):
+        cursor = LineCursor(extraction.data)
+        for match in self.default_pattern.finditer(extraction.data):
+            lineno = cursor.seek(match.start())
+            for candidate in FALLBACK_ENTITY_PATTERN_BYTES.finditer(match.group(0)):
+                if candidate.group(1).decode("ascii") not in PLATFORM_DOMAINS:
+                    continue
+                val = candidate.group(0).decode("ascii").removeprefix("states.")
+                if not extraction.has_entity(val, lineno):
+                    extraction.add_entity(val, lineno)
+
+
+EXTRACTORS = [
+    ReferenceExtractor(),
+    LovelaceExtractor(),
+    TemplateExtractor(),
+    JinjaExtractor(),
+    BlueprintExtractor(),
+]
+
+
+async def parse(
+    hass,
+    folders,
+    ignored_files,
+    root=None,
+    token=None,
+    meter=None,
+    metrics=None,
+    loaded=None,
+):
+    """Parse a yaml or json file for entities/services
+
+    Files are read and matched in the executor, so the event loop is only
+    held to merge results of a single file. Up to scan_concurrency files are
+    kept in flight to hide latency of network filesystems, their results
+    are merged in the order files were found. Background scans read a file
+    at a time within throttle options, if set. Optional StallMeter records
+    the longest time the event loop was held by the scan, optional
+    WatchmanMetrics counts files, bytes and matches. Files which hit scan
+    limits are returned along with the limits. Files found in optional
+    loaded results of load_configs are taken from there instead of disk.
+    """
+    files_parsed = 0
+    parsed_entity_list = {}
+    parsed_service_list = {}
+    file_scopes = {}
+    limited_files = {}
+    max_size = get_config(hass, CONF_MAX_FILE_SIZE, DEFAULT_MAX_FILE_SIZE) * 1024**2
+    concurrency = max(
+        1, get_config(hass, CONF_SCAN_CONCURRENCY, DEFAULT_SCAN_CONCURRENCY)
+    )
+    effectively_ignored = []
+    meter = meter or StallMeter()
+    metrics = metrics or WatchmanMetrics()
+    throttle = None
+    kbytes_rate = get_config(hass, CONF_THROTTLE_KBYTES, 0)
+    files_rate = get_config(hass, CONF_THROTTLE_FILES, 0)
+    if token and token.background and (kbytes_rate or files_rate):
+        throttle = ScanThrottle(hass, token, kbytes_rate, files_rate)
+        concurrency = 1
+    # (yaml_file, short_path, executor future) in the order files were found
+    pending = deque()
+    # (folder, seconds) and (extractor, seconds) appended by executor threads
+    durations = []
+    timings = []
+    # the first path of a (device, inode) or content hash is scanned, other
+    # paths of the same file are aliases which share its results
+    identities = {}
+    digests = {}
+    claims = {}
+    # (alias path, source path or None, digest or None)
+    aliases = []
+
+    def claimer(index):
+        """let executor skip content already claimed by a file found earlier"""
+        return lambda digest: claims.setdefault(digest, index) >= index
+
+    def add_results(entities, services):
+        for entry, occurrences in entities.items():
+            add_occurrences(parsed_entity_list, entry, occurrences)
+        for entry, occurrences in services.items():
+            add_occurrences(parsed_service_list, entry, occurrences)
+
+    async def async_merge_next():
+        nonlocal files_parsed
+        yaml_file, short_path, future = pending.popleft()
+        try:
+            entities, services, scope, limits = await future
+        except DuplicateFileError as exception:
+            metrics.count("files_deduplicated")
+            aliases.append((short_path, None, exception.digest))
+            return
+        except ScanLimitError as exception:
+            metrics.count("files_skipped")
+            _LOGGER.warning("%s is %s", yaml_file, exception)
+            limited_files[short_path] = [str(exception)]
+            return
+        except OSError as exception:
+            metrics.count("files_failed")
+            _LOGGER.error("Unable to parse %s: %s", yaml_file, exception)
+            return
+        except UnicodeDecodeError as exception:
+            metrics.count("files_failed")
+            _LOGGER.error(
+                "Unable to parse %s: %s. Use UTF-8 encoding to avoid this error",
+                yaml_file,
+                exception,
+            )
+            return
+
+        if digests.setdefault(scope.digest, short_path) != short_path:
+            # scanned concurrently with a file of the same content found earlier
+            metrics.count("files_deduplicated")
+            aliases.append((short_path, None, scope.digest))
+            return
+        meter.resume()
+        if throttle:
+            throttle.charge(size=scope.size)
+        add_results(entities, services)
+        files_parsed += 1
+        metrics.count("files_scanned")
+        metrics.count("bytes_read", scope.size)
+        metrics.count(
+            "regex_matches",
+            sum(count_occurrences(o) for o in entities.values())
+            + sum(count_occurrences(o) for o in services.values()),
+        )
+        file_scopes[short_path] = scope
+        if limits:
+            _LOGGER.warning("Scan limits hit in %s: %s", yaml_file, ", ".join(limits))
+            limited_files[short_path] = limits
+        _LOGGER.debug("%s parsed", yaml_file)
+        meter.pause()
+
+    _LOGGER.debug("::parse started")
+    try:
+        async for index, (yaml_file, ignored, folder, identity) in aenumerate(
+            async_get_next_file(folders, ignored_files)
+        ):
+            meter.resume()
+            if token:
+                # stop between files if the scan was superseded or cancelled
+                token.raise_if_cancelled()
+            short_path = os.path.relpath(yaml_file, root)
+            if ignored:
+                metrics.count("files_skipped")
+                effectively_ignored.append(short_path)
+                _LOGGER.debug("%s ignored", yaml_file)
+                meter.pause()
+                continue
+
+            source = identities.setdefault(identity, short_path)
+            if source != short_path:
+                _LOGGER.debug("%s is the same file as %s", yaml_file, source)
+                metrics.count("files_deduplicated")
+                aliases.append((short_path, source, None))
+                meter.pause()
+                continue
+
+            if loaded and short_path in loaded:
+                while pending:
+                    # keep results in the order files were found
+                    meter.pause()
+                    await async_merge_next()
+                    meter.resume()
+                entities, services, scope = loaded[short_path]
+                add_results(entities, services)
+                files_parsed += 1
+                metrics.count("files_loaded")
+                file_scopes[short_path] = scope
+                _LOGGER.debug("%s taken from loaded configuration", yaml_file)
+                meter.pause()
+                continue
+
+            if throttle:
+                meter.pause()
+                await throttle.async_wait()
+                meter.resume()
+                token.raise_if_cancelled()
+                throttle.charge(files=1)
+            future = hass.async_add_executor_job(
+                timed_scan,
+                durations,
+                timings,
+                folder,
+                yaml_file,
+                short_path,
+                max_size,
+                claimer(index),
+            )
+            pending.append((yaml_file, short_path, future))
+            meter.pause()
+            if len(pending) >= concurrency:
+                # results are merged in the order files were found
+                await async_merge_next()
+        while pending:
+            if token:
+                token.raise_if_cancelled()
+            await async_merge_next()
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+    meter.resume()
+    add_aliases(parsed_entity_list, parsed_service_list, file_scopes, aliases, digests)
+    meter.pause()
+
+    folder_times = {}
+    for folder, duration in durations:
+        folder_times[folder] = folder_times.get(folder, 0) + duration
+    metrics.gauges["scan_time_by_folder"] = {
+        folder: round(duration, 4) for folder, duration in folder_times.items()
+    }
+    for folder, duration in folder_times.items():
+        _LOGGER.debug("Files of %s scanned in %.4fs.", folder, duration)
+    extractor_times = {}
+    for name, duration in timings:
+        if duration is None:
+            metrics.count(f"extractor_prefiltered.{name}")
+            continue
+        metrics.count(f"extractor_runs.{name}")
+        extractor_times[name] = extractor_times.get(name, 0) + duration
+    metrics.gauges["scan_time_by_extractor"] = {
+        name: round(duration, 4) for name, duration in extractor_times.items()
+    }
+    metrics.gauges["template_cache"] = {
+        "size": len(TEMPLATES),
+        "hits": TEMPLATES.hits,
+        "misses": TEMPLATES.misses,
+    }
+    if throttle:
+        metrics.observe("scan_throttle_wait", throttle.waited)
+        _LOGGER.debug("Background scan throttled for %.2fs.", throttle.waited)
+
+    meter.resume()
+    # remove ignored entities and services from resulting lists
+    ignored_items = get_config(hass, CONF_IGNORED_ITEMS, [])
+    ignored_items = list(set(ignored_items + BUNDLED_IGNORED_ITEMS))
+    excluded_entities = set()
+    excluded_services = set()
+    for itm in ignored_items:
+        if itm:
+            excluded_entities.update(fnmatch.filter(parsed_entity_list, itm))
+            excluded_services.update(fnmatch.filter(parsed_service_list, itm))
+
+    parsed_entity_list = {
+        k: v for k, v in parsed_entity_list.items() if k not in excluded_entities
+    }
+    parsed_service_list = {
+        k: v for k, v in parsed_service_list.items() if k not in excluded_services
+    }
+    meter.pause()
+
+    _LOGGER.debug("Parsed files: %s", files_parsed)
+    _LOGGER.debug("Ignored files: %s", effectively_ignored)
+    _LOGGER.debug("Found entities: %s", len(parsed_entity_list))
+    _LOGGER.debug("Found services: %s", len(parsed_service_list))
+    _LOGGER.debug("Max event loop stall: %.4fs.", meter.max_stall)
+    return (
+        parsed_entity_list,
+        parsed_service_list,
+        files_parsed,
+        len(effectively_ignored),
+        file_scopes,
+        limited_files,
+    )
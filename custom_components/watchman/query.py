@@ -0,0 +1,105 @@
+"""Filtered lookups in the in-memory indexes of watchman"""
+
+import re
+from fnmatch import translate
+
+from homeassistant.exceptions import HomeAssistantError
+
+from .const import (
+    CONF_QUERY_DOMAIN,
+    CONF_QUERY_FILE,
+    CONF_QUERY_GLOB,
+    CONF_QUERY_LIMIT,
+    CONF_QUERY_OFFSET,
+    CONF_QUERY_STATE,
+    CONF_QUERY_TYPE,
+    DOMAIN,
+    HASS_DATA_HISTORY,
+    HASS_DATA_MISSING_ENTITIES,
+    HASS_DATA_MISSING_SERVICES,
+    HASS_DATA_PARSED_ENTITY_LIST,
+    HASS_DATA_PARSED_SERVICE_LIST,
+    QUERY_DEFAULT_LIMIT,
+)
+from .history import STATUS_OK
+from .utils import count_occurrences, get_entity_state, get_owners
+
+
+def _matcher(pattern):
+    """compiled match function of a shell-style pattern, None if not set"""
+    return re.compile(translate(pattern)).match if pattern else None
+
+
+def query_entries(hass, filters):
+    """parsed entries matching filters along with their status, paginated
+
+    Entries are sorted by id so pages are stable between calls as long as
+    configuration is not rescanned.
+    """
+    data = hass.data.get(DOMAIN, {})
+    if HASS_DATA_MISSING_ENTITIES not in data:
+        raise HomeAssistantError("Watchman has not checked configuration yet")
+
+    def entity_status(entry):
+        if entry not in data[HASS_DATA_MISSING_ENTITIES]:
+            return STATUS_OK
+        return get_entity_state(hass, entry)[0]
+
+    def service_status(entry):
+        if entry not in data[HASS_DATA_MISSING_SERVICES]:
+            return STATUS_OK
+        return "missing"
+
+    sources = {
+        "entity": (data[HASS_DATA_PARSED_ENTITY_LIST], entity_status),
+        "service": (data[HASS_DATA_PARSED_SERVICE_LIST], service_status),
+    }
+    if filters.get(CONF_QUERY_TYPE):
+        sources = {filters[CONF_QUERY_TYPE]: sources[filters[CONF_QUERY_TYPE]]}
+    domains = set(filters.get(CONF_QUERY_DOMAIN, []))
+    states = set(filters.get(CONF_QUERY_STATE, []))
+    id_match = _matcher(filters.get(CONF_QUERY_GLOB))
+    file_match = _matcher(filters.get(CONF_QUERY_FILE))
+
+    matched = []
+    for kind, (parsed_list, status) in sources.items():
+        for entry, occurrences in parsed_list.items():
+            if domains and entry.split(".", 1)[0] not in domains:
+                continue
+            if id_match and not id_match(entry):
+                continue
+            if file_match and not any(file_match(path) for path in occurrences):
+                continue
+            # status is only resolved once cheaper filters passed
+            state = status(entry) if states else None
+            if states and state not in states:
+                continue
+            matched.append((entry, kind, state))
+    matched.sort()
+
+    offset = filters.get(CONF_QUERY_OFFSET, 0)
+    limit = filters.get(CONF_QUERY_LIMIT, QUERY_DEFAULT_LIMIT)
+    history = data[HASS_DATA_HISTORY]
+    items = []
+    for entry, kind, state in matched[offset : offset + limit]:
+        parsed_list, status = sources[kind]
+        since = history.missing_since(entry)
+        items.append(
+            {
+                "id": entry,
+                "type": kind,
+                "state": state or status(entry),
+                "missing_since": since.isoformat() if since else None,
+                "used_by": get_owners(hass, entry),
+                "count": count_occurrences(parsed_list[entry]),
+                "occurrences": {
+                    path: list(lines) for path, lines in parsed_list[entry].items()
+                },
+            }
+        )
+    return {
+        "total": len(matched),
+        "offset": offset,
+        "limit": limit,
+        "items": items,
+    }
@@ -0,0 +1,386 @@
+"""Report rendering for watchman, loaded on first use of watchman.report"""
+
+import hashlib
+import heapq
+import json
+import time
+from collections import Counter
+from datetime import datetime
+from textwrap import wrap
+import pytz
+from prettytable import PrettyTable
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.util import dt as dt_util
+
+from .utils import (
+    count_occurrences,
+    get_config,
+    get_columns_width,
+    get_entity_state,
+    format_occurrences,
+    get_owners,
+)
+
+from .const import (
+    DOMAIN,
+    DEFAULT_HEADER,
+    DEFAULT_CHUNK_SIZE,
+    CONF_HEADER,
+    CONF_CHUNK_SIZE,
+    CONF_COLUMNS_WIDTH,
+    CONF_FRIENDLY_NAMES,
+    HASS_DATA_CHECK_DURATION,
+    HASS_DATA_FILES_IGNORED,
+    HASS_DATA_FILES_PARSED,
+    HASS_DATA_HISTORY,
+    HASS_DATA_LIMITED_FILES,
+    HASS_DATA_METRICS,
+    HASS_DATA_MISSING_ENTITIES,
+    HASS_DATA_MISSING_SERVICES,
+    HASS_DATA_PARSE_DURATION,
+    HASS_DATA_PARSED_ENTITY_LIST,
+    HASS_DATA_PARSED_SERVICE_LIST,
+    REPORT_ENTRY_TYPE_ENTITY,
+    REPORT_ENTRY_TYPE_SERVICE,
+    SINCE_COLUMN_WIDTH,
+    SUMMARY_TOP_COUNT,
+)
+
+
+def missing_since(hass, entry, test_mode=False):
+    """local time the entry went missing according to watchman history"""
+    if test_mode:
+        return "1970-01-01 00:00"
+    since = hass.data[DOMAIN][HASS_DATA_HISTORY].missing_since(entry)
+    return dt_util.as_local(since).strftime("%Y-%m-%d %H:%M") if since else "-"
+
+
+def location(hass, entry, parsed_list):
+    """file:line locations of an entry followed by objects which use it"""
+    out = format_occurrences(parsed_list[entry])
+    owners = get_owners(hass, entry)
+    return f"{out} used by {', '.join(owners)}" if owners else out
+
+
+def table_renderer(hass, entry_type, test_mode=False):
+    """Render ASCII tables in the report"""
+    table = PrettyTable()
+    columns_width = get_config(hass, CONF_COLUMNS_WIDTH, None)
+    columns_width = get_columns_width(columns_width)
+    if entry_type == REPORT_ENTRY_TYPE_SERVICE:
+        services_missing = hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+        service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+        table.field_names = ["Service ID", "State", "Since", "Location"]
+        for service in services_missing:
+            row = [
+                fill(service, columns_width[0]),
+                fill("missing", columns_width[1]),
+                fill(missing_since(hass, service, test_mode), SINCE_COLUMN_WIDTH),
+                fill(location(hass, service, service_list), columns_width[2]),
+            ]
+            table.add_row(row)
+        table.align = "l"
+        return table.get_string()
+    elif entry_type == REPORT_ENTRY_TYPE_ENTITY:
+        entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
+        parsed_entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+        friendly_names = get_config(hass, CONF_FRIENDLY_NAMES, False)
+        header = ["Entity ID", "State", "Since", "Location"]
+        table.field_names = header
+        for entity in entities_missing:
+            state, name = get_entity_state(hass, entity, friendly_names)
+            table.add_row(
+                [
+                    fill(entity, columns_width[0], name),
+                    fill(state, columns_width[1]),
+                    fill(missing_since(hass, entity, test_mode), SINCE_COLUMN_WIDTH),
+                    fill(location(hass, entity, parsed_entity_list), columns_width[2]),
+                ]
+            )
+
+        table.align = "l"
+        return table.get_string()
+
+    else:
+        return f"Table render error: unknown entry type: {entry_type}"
+
+
+def text_renderer(hass, entry_type, test_mode=False):
+    """Render plain lists in the report"""
+    result = ""
+    if entry_type == REPORT_ENTRY_TYPE_SERVICE:
+        services_missing = hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+        service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+        for service in services_missing:
+            since = missing_since(hass, service, test_mode)
+            result += (
+                f"{service} since {since} in {location(hass, service, service_list)}\n"
+            )
+        return result
+    elif entry_type == REPORT_ENTRY_TYPE_ENTITY:
+        entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
+        entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+        friendly_names = get_config(hass, CONF_FRIENDLY_NAMES, False)
+        for entity in entities_missing:
+            state, name = get_entity_state(hass, entity, friendly_names)
+            entity_col = entity if not name else f"{entity} ('{name}')"
+            since = missing_since(hass, entity, test_mode)
+            result += (
+                f"{entity_col} [{state}] since {since} "
+                f"in: {location(hass, entity, entity_list)}\n"
+            )
+
+        return result
+    else:
+        return f"Text render error: unknown entry type: {entry_type}"
+
+
+def fill(data, width, extra=None):
+    """arrange data by table column width"""
+    if data and isinstance(data, dict):
+        out = format_occurrences(data)
+    else:
+        out = str(data) if not extra else f"{data} ('{extra}')"
+
+    return (
+        "\n".join([out.ljust(width) for out in wrap(out, width)]) if width > 0 else out
+    )
+
+
+async def report(hass, render, chunk_size, test_mode=False):
+    """generates watchman report either as a table or as a list"""
+    if DOMAIN not in hass.data:
+        raise HomeAssistantError("No data for report, refresh required.")
+
+    start_time = time.time()
+    header = get_config(hass, CONF_HEADER, DEFAULT_HEADER)
+    services_missing = hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+    service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+    entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
+    entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+    files_parsed = hass.data[DOMAIN][HASS_DATA_FILES_PARSED]
+    files_ignored = hass.data[DOMAIN][HASS_DATA_FILES_IGNORED]
+    limited_files = hass.data[DOMAIN][HASS_DATA_LIMITED_FILES]
+    chunk_size = (
+        get_config(hass, CONF_CHUNK_SIZE, DEFAULT_CHUNK_SIZE)
+        if chunk_size is None
+        else chunk_size
+    )
+
+    rep = f"{header} \n"
+    if services_missing:
+        rep += f"\n-== Missing {len(services_missing)} service(s) from "
+        rep += f"{len(service_list)} found in your config:\n"
+        rep += render(hass, REPORT_ENTRY_TYPE_SERVICE, test_mode)
+        rep += "\n"
+    elif len(service_list) > 0:
+        rep += f"\n-== Congratulations, all {len(service_list)} services from "
+        rep += "your config are available!\n"
+    else:
+        rep += "\n-== No services found in configuration files!\n"
+
+    if entities_missing:
+        rep += f"\n-== Missing {len(entities_missing)} entity(ies) from "
+        rep += f"{len(entity_list)} found in your config:\n"
+        rep += render(hass, REPORT_ENTRY_TYPE_ENTITY, test_mode)
+        rep += "\n"
+
+    elif len(entity_list) > 0:
+        rep += f"\n-== Congratulations, all {len(entity_list)} entities from "
+        rep += "your config are available!\n"
+    else:
+        rep += "\n-== No entities found in configuration files!\n"
+
+    def get_timezone(hass):
+        return pytz.timezone(hass.config.time_zone)
+
+    timezone = await hass.async_add_executor_job(get_timezone, hass)
+
+    render_duration = time.time() - start_time
+    hass.data[DOMAIN][HASS_DATA_METRICS].observe("render", render_duration)
+    if not test_mode:
+        report_datetime = datetime.now(timezone).strftime("%d %b %Y %H:%M:%S")
+        parse_duration = hass.data[DOMAIN][HASS_DATA_PARSE_DURATION]
+        check_duration = hass.data[DOMAIN][HASS_DATA_CHECK_DURATION]
+    else:
+        report_datetime = "01 Jan 1970 00:00:00"
+        parse_duration = 0.01
+        check_duration = 0.105
+        render_duration = 0.0003
+
+    rep += f"\n-== Report created on {report_datetime}\n"
+    rep += (
+        f"-== Parsed {files_parsed} files in {parse_duration:.2f}s., "
+        f"ignored {files_ignored} files \n"
+    )
+    if limited_files:
+        rep += f"-== Scan limits hit in {len(limited_files)} file(s):\n"
+        for path, limits in sorted(limited_files.items()):
+            rep += f"   {path}: {'; '.join(limits)}\n"
+    rep += f"-== Generated in: {render_duration:.2f}s. Validated in: {check_duration:.2f}s."
+    return split_chunks(rep, chunk_size)
+
+
+def split_chunks(rep, chunk_size):
+    """split report text into chunks of about chunk_size, 0 means no split"""
+    report_chunks = []
+    chunk = ""
+    for line in iter(rep.splitlines()):
+        chunk += f"{line}\n"
+        if chunk_size > 0 and len(chunk) > chunk_size:
+            report_chunks.append(chunk)
+            chunk = ""
+    if chunk:
+        report_chunks.append(chunk)
+    return report_chunks
+
+
+def reported_entries(hass):
+    """{(kind, id): state} of all missing entities and services
+
+    An id may be both an entity and a service, e.g. a script, so entries
+    are told apart by their kind.
+    """
+    entries = {
+        ("service", service): "missing"
+        for service in hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+    }
+    for entity in hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]:
+        entries[("entity", entity)], _ = get_entity_state(hass, entity)
+    return entries
+
+
+def fingerprint(entries):
+    """digest of a result set which does not depend on its order"""
+    data = json.dumps(stored_entries(entries), separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def stored_entries(entries):
+    """sorted [kind, id, state] rows of a result set, json serializable"""
+    return [[kind, entry, state] for (kind, entry), state in sorted(entries.items())]
+
+
+def by_id(key):
+    """sort key of a (kind, id) pair which orders by id first"""
+    return key[1], key[0]
+
+
+def delivery(entries):
+    """result set to be stored once a report of it is delivered"""
+    return {"fingerprint": fingerprint(entries), "entries": stored_entries(entries)}
+
+
+def delta_report(hass, delivered, chunk_size, test_mode=False):
+    """report only entries which changed since the delivered result set
+
+    Returns report chunks, empty if nothing changed, along with the result
+    set to be stored once the chunks are delivered. Nothing is rendered when
+    the fingerprint matches the delivered one.
+    """
+    if DOMAIN not in hass.data:
+        raise HomeAssistantError("No data for report, refresh required.")
+    current = reported_entries(hass)
+    digest = fingerprint(current)
+    if digest == delivered.get("fingerprint"):
+        return [], delivered
+
+    start_time = time.time()
+    previous = {
+        (kind, entry): state for kind, entry, state in delivered.get("entries", [])
+    }
+    changed = [key for key, state in current.items() if previous.get(key) != state]
+    resolved = [key for key in previous if key not in current]
+    parsed_lists = {
+        "entity": hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST],
+        "service": hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST],
+    }
+    rep = f"{get_config(hass, CONF_HEADER, DEFAULT_HEADER)} \n"
+    if changed:
+        rep += f"\n-== {len(changed)} new or changed missing item(s):\n"
+        for kind, entry in sorted(changed, key=by_id):
+            since = missing_since(hass, entry, test_mode)
+            rep += (
+                f"{entry} [{current[(kind, entry)]}] since {since} "
+                f"in: {location(hass, entry, parsed_lists[kind])}\n"
+            )
+    if resolved:
+        rep += f"\n-== {len(resolved)} resolved item(s):\n"
+        rep += "".join(f"{entry}\n" for _, entry in sorted(resolved, key=by_id))
+    rep += (
+        f"\n-== {len(current)} item(s) missing in total, "
+        f"report created on {report_time(hass, test_mode)}"
+    )
+    hass.data[DOMAIN][HASS_DATA_METRICS].observe("render", time.time() - start_time)
+    return split_chunks(rep, chunk_size), delivery(current)
+
+
+def top(counts, count=SUMMARY_TOP_COUNT):
+    """largest (key, number) pairs of counts, ties ordered by key"""
+    return heapq.nsmallest(count, counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def summary_report(hass, chunk_size, test_mode=False):
+    """totals of missing items by state, domain and file, worst ones first
+
+    Only counts are kept per item and the largest ones are picked with a
+    heap, nothing is sorted or rendered per missing item.
+    """
+    if DOMAIN not in hass.data:
+        raise HomeAssistantError("No data for report, refresh required.")
+    start_time = time.time()
+    entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
+    entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+    service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+    entries = reported_entries(hass)
+    states = Counter(entries.values())
+    domains = Counter(entry.split(".", 1)[0] for _, entry in entries)
+    files = Counter()
+    # (id, kind) keys, so ties are ordered by id
+    references = {}
+    for kind, entry in entries:
+        parsed_list = entity_list if kind == "entity" else service_list
+        occurrences = parsed_list.get(entry, {})
+        references[(entry, kind)] = count_occurrences(occurrences)
+        for path, lines in occurrences.items():
+            files[path] += getattr(lines, "total", len(lines))
+
+    def totals(counts):
+        return ", ".join(f"{key} {number}" for key, number in top(counts, len(counts)))
+
+    rep = f"{get_config(hass, CONF_HEADER, DEFAULT_HEADER)} \n"
+    services_count = len(entries) - len(entities_missing)
+    if entries:
+        rep += (
+            f"\n-== Missing {services_count} service(s) and {len(entities_missing)} "
+            f"entity(ies) from {len(service_list) + len(entity_list)} "
+            "found in your config\n"
+        )
+        rep += f"-== By state: {totals(states)}\n"
+        rep += f"-== By domain: {totals(domains)}\n"
+        rep += f"\n-== Referenced from {len(files)} file(s), most affected:\n"
+        rep += "".join(f"   {path}: {number}\n" for path, number in top(files))
+        rep += "\n-== Most referenced missing items:\n"
+        rep += "".join(
+            f"   {entry} [{entries[(kind, entry)]}]: {number}\n"
+            for (entry, kind), number in top(references)
+        )
+    else:
+        rep += (
+            f"\n-== Congratulations, all {len(service_list)} services and "
+            f"{len(entity_list)} entities from your config are available!\n"
+        )
+    render_duration = 0.0 if test_mode else time.time() - start_time
+    hass.data[DOMAIN][HASS_DATA_METRICS].observe("render", render_duration)
+    rep += (
+        f"\n-== Report created on {report_time(hass, test_mode)}\n"
+        f"-== Generated in: {render_duration:.2f}s."
+    )
+    return split_chunks(rep, chunk_size)
+
+
+def report_time(hass, test_mode=False):
+    """local time of the report"""
+    if test_mode:
+        return "01 Jan 1970 00:00:00"
+    return dt_util.now().strftime("%d %b %Y %H:%M:%S")
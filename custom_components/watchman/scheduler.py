@@ -0,0 +1,162 @@
+"""Single-flight scheduler for configuration parsing"""
+
+import asyncio
+import logging
+from contextlib import suppress
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ParseCancelledError(Exception):
+    """Scan was superseded by a newer request or cancelled on unload"""
+
+
+class ScanToken:
+    """Cooperative cancellation token, checked by the parser between files
+
+    Background scans may be throttled by the parser, their waits are cut
+    short once the scan is cancelled. Only loaded scans may take configs
+    loaded by Home Assistant instead of reading their files.
+    """
+
+    def __init__(self, background=False, loaded=False):
+        self.cancelled = False
+        self.background = background
+        self.loaded = loaded
+        self._wakeup = asyncio.Event()
+
+    def cancel(self):
+        """request the scan to stop at the next file boundary"""
+        self.cancelled = True
+        self._wakeup.set()
+
+    def raise_if_cancelled(self):
+        """abort the scan if it was cancelled"""
+        if self.cancelled:
+            raise ParseCancelledError
+
+    async def async_sleep(self, delay):
+        """sleep for delay seconds or until the scan is cancelled"""
+        with suppress(TimeoutError):
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+
+
+class ParseScheduler:
+    """Keeps at most one configuration scan in flight.
+
+    Requests which arrive while a scan is running supersede it: the running
+    scan is cancelled between files and all pending requests are coalesced
+    into a single follow-up scan. Partial scans are merged into one, a full
+    scan request absorbs all partial ones. Callers are released once a scan
+    which started after their request has completed. A scan runs in the
+    background only if all of its requests were background ones, so a
+    foreground request takes over a throttled scan in progress. Loaded
+    configs are likewise used only if all requests allow them.
+    """
+
+    def __init__(self, hass, scan):
+        """scan is a coroutine function accepting reason, ScanToken and files"""
+        self.hass = hass
+        self._scan = scan
+        self._task = None
+        self._token = None
+        self._pending = []
+        self._running = []
+        self._reasons = {}
+        # files for the next scan, None stands for a full scan
+        self._files = set()
+        self._background = True
+        self._loaded = True
+
+    @property
+    def is_running(self):
+        """whether a scan is in flight"""
+        return self._token is not None
+
+    async def async_parse(
+        self, reason=None, files=None, background=False, loaded=False
+    ):
+        """request a scan of given files (all files if None) and wait for it"""
+        future = self.hass.loop.create_future()
+        if not self._pending:
+            self._files = set()
+            self._background = True
+            self._loaded = True
+        self._files = merge_scope(self._files, files)
+        self._background = self._background and background
+        self._loaded = self._loaded and loaded
+        self._pending.append(future)
+        self._reasons[reason] = None
+        if self._token is not None:
+            _LOGGER.debug("Scan in flight is superseded due to %s", reason)
+            self._token.cancel()
+        if self._task is None:
+            self._task = self.hass.async_create_background_task(
+                self._async_run(), "watchman parse scheduler"
+            )
+        await future
+
+    async def _async_run(self):
+        """run scans until there are no pending requests"""
+        try:
+            while self._pending:
+                self._running, self._pending = self._pending, []
+                reasons, self._reasons = self._reasons, {}
+                files, self._files = self._files, set()
+                background, self._background = self._background, True
+                loaded, self._loaded = self._loaded, True
+                self._token = token = ScanToken(background, loaded)
+                try:
+                    await self._scan(", ".join(str(r) for r in reasons), token, files)
+                except ParseCancelledError:
+                    # waiters of the superseded scan join the follow-up one
+                    self._pending = self._running + self._pending
+                    self._reasons = reasons | self._reasons
+                    self._files = merge_scope(files, self._files)
+                    self._background = background and self._background
+                    self._loaded = loaded and self._loaded
+                    continue
+                except Exception as exception:  # pylint: disable=broad-exception-caught
+                    self._release(exception)
+                    continue
+                finally:
+                    self._token = None
+                self._release()
+        finally:
+            self._task = None
+
+    def _release(self, exception=None):
+        """wake up callers waiting for the current scan"""
+        for future in self._running:
+            if future.done():
+                continue
+            if exception:
+                future.set_exception(exception)
+            else:
+                future.set_result(None)
+        self._running = []
+
+    async def async_cancel(self):
+        """cancel scan in flight and all pending requests"""
+        if self._token is not None:
+            self._token.cancel()
+        task = self._task
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        for future in self._running + self._pending:
+            future.cancel()
+        self._running = []
+        self._pending = []
+        self._reasons = {}
+        self._files = set()
+        self._background = True
+        self._loaded = True
+
+
+def merge_scope(files, other):
+    """union of two scan scopes, None stands for a full scan"""
+    if files is None or other is None:
+        return None
+    return files | set(other)
@@ -9,6 +9,7 @@ from homeassistant.components.sensor.const import (
     SensorDeviceClass,
     SensorStateClass,
 )
+from homeassistant.const import EntityCategory, UnitOfTime
 from homeassistant.core import callback
 from .entity import WatchmanEntity
 
@@ -19,7 +20,9 @@ from .const import (
     COORD_DATA_MISSING_SERVICES,
     COORD_DATA_SERVICE_ATTRS,
     DOMAIN,
+    HASS_DATA_METRICS,
     SENSOR_LAST_UPDATE,
+    SENSOR_METRICS,
     SENSOR_MISSING_ENTITIES,
     SENSOR_MISSING_SERVICES,
 )
@@ -57,6 +60,17 @@ async def async_setup_entry(hass, entry, async_add_devices):
                     state_class=SensorStateClass.MEASUREMENT,
                 ),
             ),
+            MetricsSensor(
+                coordinator=coordinator,
+                entity_description=SensorEntityDescription(
+                    key=SENSOR_METRICS,
+                    name=SENSOR_METRICS,
+                    device_class=SensorDeviceClass.DURATION,
+                    native_unit_of_measurement=UnitOfTime.SECONDS,
+                    entity_category=EntityCategory.DIAGNOSTIC,
+                    entity_registry_enabled_default=False,
+                ),
+            ),
         ]
     )
 
@@ -167,3 +181,32 @@ class MissingServicesSensor(WatchmanEntity, SensorEntity):
             }
         self.async_write_ha_state()
         super()._handle_coordinator_update()
+
+
+class MetricsSensor(WatchmanEntity, SensorEntity):
+    """Duration of the last configuration scan, runtime metrics as attributes
+
+    Attributes are a snapshot taken after timed runs like scans and full
+    checks, partial updates on state and registry changes reuse it.
+    """
+
+    _attr_should_poll = False
+    _attr_icon = "mdi:chart-timeline-variant"
+    _metrics_runs = None
+
+    @property
+    def should_poll(self) -> bool:
+        """No polling needed."""
+        return False
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Handle updated data from the coordinator."""
+        metrics = self.hass.data[DOMAIN][HASS_DATA_METRICS]
+        if metrics.runs == self._metrics_runs:
+            return
+        self._metrics_runs = metrics.runs
+        self._attr_native_value = metrics.last_parse_duration
+        self._attr_extra_state_attributes = metrics.as_dict()
+        self.async_write_ha_state()
+        super()._handle_coordinator_update()
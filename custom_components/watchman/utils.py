@@ -1,43 +1,30 @@
 """Miscellaneous support functions for watchman"""
 
-import anyio
-import re
-import fnmatch
-import time
+import asyncio
+import importlib
 import logging
-from datetime import datetime
-from textwrap import wrap
 import os
-from typing import Any
-import pytz
-from prettytable import PrettyTable
+import sys
+import time
 from homeassistant.exceptions import HomeAssistantError
-from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.storage import STORAGE_DIR
 
 from .const import (
     DOMAIN,
     DOMAIN_DATA,
-    DEFAULT_HEADER,
-    DEFAULT_CHUNK_SIZE,
-    CONF_HEADER,
-    CONF_IGNORED_ITEMS,
     CONF_IGNORED_STATES,
-    CONF_CHUNK_SIZE,
-    CONF_COLUMNS_WIDTH,
-    CONF_FRIENDLY_NAMES,
-    BUNDLED_IGNORED_ITEMS,
+    DASHBOARD_SAVE_POLL,
+    DASHBOARD_SAVE_TIMEOUT,
     DEFAULT_REPORT_FILENAME,
-    HASS_DATA_CHECK_DURATION,
-    HASS_DATA_FILES_IGNORED,
-    HASS_DATA_FILES_PARSED,
+    HASS_DATA_DOMAIN_FILES,
     HASS_DATA_MISSING_ENTITIES,
     HASS_DATA_MISSING_SERVICES,
-    HASS_DATA_PARSE_DURATION,
     HASS_DATA_PARSED_ENTITY_LIST,
     HASS_DATA_PARSED_SERVICE_LIST,
-    REPORT_ENTRY_TYPE_ENTITY,
-    REPORT_ENTRY_TYPE_SERVICE,
+    HASS_DATA_REFERENCES,
+    OCCURRENCES_LIMIT,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -55,11 +42,19 @@ async def async_get_report_path(hass, path):
     if not path:
         path = hass.config.path(DEFAULT_REPORT_FILENAME)
     folder, _ = os.path.split(path)
-    if not await anyio.Path(folder).exists():
+    if not await hass.async_add_executor_job(os.path.exists, folder):
         raise HomeAssistantError(f"Incorrect report_path: {path}.")
     return path
 
 
+async def async_import_module(hass, name):
+    """import watchman submodule on first use without blocking the event loop"""
+    module = f"{__package__}.{name}"
+    if module in sys.modules:
+        return sys.modules[module]
+    return await hass.async_add_import_executor_job(importlib.import_module, module)
+
+
 def get_columns_width(user_width):
     """define width of the report columns"""
     default_width = [30, 7, 60]
@@ -75,99 +70,82 @@ def get_columns_width(user_width):
     return default_width
 
 
-def table_renderer(hass, entry_type):
-    """Render ASCII tables in the report"""
-    table = PrettyTable()
-    columns_width = get_config(hass, CONF_COLUMNS_WIDTH, None)
-    columns_width = get_columns_width(columns_width)
-    if entry_type == REPORT_ENTRY_TYPE_SERVICE:
-        services_missing = hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
-        service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
-        table.field_names = ["Service ID", "State", "Location"]
-        for service in services_missing:
-            row = [
-                fill(service, columns_width[0]),
-                fill("missing", columns_width[1]),
-                fill(service_list[service], columns_width[2]),
-            ]
-            table.add_row(row)
-        table.align = "l"
-        return table.get_string()
-    elif entry_type == REPORT_ENTRY_TYPE_ENTITY:
-        entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
-        parsed_entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
-        friendly_names = get_config(hass, CONF_FRIENDLY_NAMES, False)
-        header = ["Entity ID", "State", "Location"]
-        table.field_names = header
-        for entity in entities_missing:
-            state, name = get_entity_state(hass, entity, friendly_names)
-            table.add_row(
-                [
-                    fill(entity, columns_width[0], name),
-                    fill(state, columns_width[1]),
-                    fill(parsed_entity_list[entity], columns_width[2]),
-                ]
-            )
-
-        table.align = "l"
-        return table.get_string()
-
-    else:
-        return f"Table render error: unknown entry type: {entry_type}"
-
-
-def text_renderer(hass, entry_type):
-    """Render plain lists in the report"""
-    result = ""
-    if entry_type == REPORT_ENTRY_TYPE_SERVICE:
-        services_missing = hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
-        service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
-        for service in services_missing:
-            result += f"{service} in {fill(service_list[service], 0)}\n"
-        return result
-    elif entry_type == REPORT_ENTRY_TYPE_ENTITY:
-        entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
-        entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
-        friendly_names = get_config(hass, CONF_FRIENDLY_NAMES, False)
-        for entity in entities_missing:
-            state, name = get_entity_state(hass, entity, friendly_names)
-            entity_col = entity if not name else f"{entity} ('{name}')"
-            result += f"{entity_col} [{state}] in: {fill(entity_list[entity], 0)}\n"
-
-        return result
-    else:
-        return f"Text render error: unknown entry type: {entry_type}"
+def get_domain_files(hass, domain):
+    """files which may affect configuration of the domain, None if unknown"""
+    if domain == "homeassistant":
+        # core config reload may change packages and customizations
+        return None
+    domain_files = hass.data[DOMAIN].get(HASS_DATA_DOMAIN_FILES)
+    if not domain_files:
+        return None
+    return domain_files.get(domain) or None
 
 
-async def async_get_next_file(folder_tuples, ignored_files):
-    """Returns next file for scan"""
-    if not ignored_files:
-        ignored_files = ""
+def get_dashboard(hass, url_path):
+    """dashboard config object of the lovelace integration, None if unknown"""
+    data = hass.data.get("lovelace")
+    if isinstance(data, dict):
+        dashboards = data.get("dashboards", {})
     else:
-        ignored_files = "|".join([f"({fnmatch.translate(f)})" for f in ignored_files])
-    ignored_files_re = re.compile(ignored_files)
-    for folder_name, glob_pattern in folder_tuples:
-        _LOGGER.debug(
-            "Scan folder %s with pattern %s for configuration files",
-            folder_name,
-            glob_pattern,
-        )
-        async for filename in anyio.Path(folder_name).glob(glob_pattern):
-            _LOGGER.debug("Found file %s.", filename)
-            yield (
-                str(filename),
-                (ignored_files and ignored_files_re.match(str(filename))),
-            )
-
-
-def add_entry(_list, entry, yaml_file, lineno):
-    """Add entry to list of missing entities/services with line number information"""
-    _LOGGER.debug("Added %s to the list", entry)
-    if entry in _list:
-        if yaml_file in _list[entry]:
-            _list[entry].get(yaml_file, []).append(lineno)
-    else:
-        _list[entry] = {yaml_file: [lineno]}
+        dashboards = getattr(data, "dashboards", {})
+    return dashboards.get(url_path)
+
+
+def get_dashboard_files(hass, url_path):
+    """storage file of a dashboard edited in the UI, None if unknown"""
+    if url_path is None:
+        return {os.path.join(STORAGE_DIR, "lovelace")}
+    dashboard = get_dashboard(hass, url_path)
+    if getattr(dashboard, "mode", None) != "storage" or not dashboard.config:
+        # yaml dashboards are picked up by the next full scan
+        return None
+    return {os.path.join(STORAGE_DIR, f"lovelace.{dashboard.config['id']}")}
+
+
+async def async_wait_dashboard_saved(hass, url_path, files, fired):
+    """wait until a dashboard saved in the UI is written to its storage file
+
+    Lovelace fires the update event before it saves the dashboard, the
+    save then writes the file holding the write lock of dashboard's store.
+    Waiting for that lock is a best-effort hook into private internals of
+    Home Assistant. Without the lock, files older than the event are polled
+    until they are written or DASHBOARD_SAVE_TIMEOUT passes.
+    """
+    store = getattr(get_dashboard(hass, url_path), "_store", None)
+    lock = getattr(store, "_write_lock", None)
+    # let the save which fired the event take the lock first
+    await asyncio.sleep(0)
+    if lock is not None:
+        async with lock:
+            return
+    _LOGGER.debug("No store lock of %s dashboard, polling its files", url_path)
+
+    def unwritten():
+        pending = []
+        for path in files:
+            path = os.path.join(hass.config.config_dir, path)
+            try:
+                if os.path.getmtime(path) < fired:
+                    pending.append(path)
+            except FileNotFoundError:
+                pending.append(path)
+        return pending
+
+    deadline = time.monotonic() + DASHBOARD_SAVE_TIMEOUT
+    while pending := await hass.async_add_executor_job(unwritten):
+        if time.monotonic() > deadline:
+            _LOGGER.debug("Dashboard files were not written in time: %s", pending)
+            return
+        await asyncio.sleep(DASHBOARD_SAVE_POLL)
+
+
+def get_referenced_entries(parsed_list, files):
+    """entries of a parsed list which occur in any of given files"""
+    return {
+        entry
+        for entry, occurrences in parsed_list.items()
+        if not files.isdisjoint(occurrences)
+    }
 
 
 def is_service(hass, entry):
@@ -177,17 +155,20 @@ def is_service(hass, entry):
 
 
 def get_entity_state(hass, entry, friendly_names=False):
-    """returns entity state or missing if entity does not extst"""
+    """returns entity state, disabled or missing if entity does not extst"""
     entity = hass.states.get(entry)
     name = None
     if entity and entity.attributes.get("friendly_name", None):
         if friendly_names:
             name = entity.name
+    if not entity:
+        # disabled entities have no state, but are kept in the registry
+        registry_entry = er.async_get(hass).async_get(entry)
+        if registry_entry and registry_entry.disabled_by:
+            return "disabled", name
+        return "missing", name
     # fix for #75, some integrations return non-string states
-    state = (
-        "missing" if not entity else str(entity.state).replace("unavailable", "unavail")
-    )
-    return state, name
+    return str(entity.state).replace("unavailable", "unavail"), name
 
 
 def check_services(hass):
@@ -209,12 +190,34 @@ def check_services(hass):
     return services_missing
 
 
-def check_entitites(hass):
-    """check if entries from config file are entities with an active state"""
-    ignored_states = [
+def get_ignored_states(hass):
+    """ignored states in the form returned by get_entity_state"""
+    return [
         "unavail" if s == "unavailable" else s
         for s in get_config(hass, CONF_IGNORED_STATES, [])
     ]
+
+
+def is_entity_missing(hass, entry, ignored_states):
+    """check whether entry is an entity in one of reported states"""
+    if is_service(hass, entry):  # this is a service, not entity
+        _LOGGER.debug("entry %s is service, skipping", entry)
+        return False
+    state, _ = get_entity_state(hass, entry)
+    if state in ignored_states:
+        _LOGGER.debug("entry %s ignored due to ignored_states", entry)
+        return False
+    return state in ["missing", "unknown", "unavail", "disabled"]
+
+
+def get_owners(hass, entry):
+    """automations, scripts, scenes and cards which reference the entry"""
+    return hass.data[DOMAIN].get(HASS_DATA_REFERENCES, {}).get(entry, [])
+
+
+def check_entitites(hass):
+    """check if entries from config file are entities with an active state"""
+    ignored_states = get_ignored_states(hass)
     if DOMAIN not in hass.data or HASS_DATA_PARSED_ENTITY_LIST not in hass.data[DOMAIN]:
         _LOGGER.error("Entity list not found")
         raise Exception("Entity list not found")
@@ -222,183 +225,75 @@ def check_entitites(hass):
     entities_missing = {}
     _LOGGER.debug("::check_entities")
     for entry, occurrences in parsed_entity_list.items():
-        if is_service(hass, entry):  # this is a service, not entity
-            _LOGGER.debug("entry %s is service, skipping", entry)
-            continue
-        state, _ = get_entity_state(hass, entry)
-        if state in ignored_states:
-            _LOGGER.debug("entry %s ignored due to ignored_states", entry)
-            continue
-        if state in ["missing", "unknown", "unavail"]:
+        if is_entity_missing(hass, entry, ignored_states):
             entities_missing[entry] = occurrences
             _LOGGER.debug("entry %s added to missing list", entry)
     return entities_missing
 
 
-async def parse(hass, folders, ignored_files, root=None):
-    """Parse a yaml or json file for entities/services"""
-    files_parsed = 0
-    entity_pattern = re.compile(
-        r"(?:(?<=\s)|(?<=^)|(?<=\")|(?<=\'))([A-Za-z_0-9]*\s*:)?(?:\s*)?(?:states.)?"
-        fr"(({ "|".join(Platform) })\.[A-Za-z_*0-9]+)"
-    )
-    service_pattern = re.compile(r"service:\s*([A-Za-z_0-9]*\.[A-Za-z_0-9]+)")
-    comment_pattern = re.compile(r"\s*#.*")
-    parsed_entity_list = {}
-    parsed_service_list = {}
-    effectively_ignored = []
-    _LOGGER.debug("::parse started")
-    async for yaml_file, ignored in async_get_next_file(folders, ignored_files):
-        short_path = os.path.relpath(yaml_file, root)
-        if ignored:
-            effectively_ignored.append(short_path)
-            _LOGGER.debug("%s ignored", yaml_file)
-            continue
-
-        try:
-            lineno = 1
-            async with await anyio.open_file(
-                yaml_file, mode="r", encoding="utf-8"
-            ) as f:
-                async for line in f:
-                    line = re.sub(comment_pattern, "", line)
-                    for match in re.finditer(entity_pattern, line):
-                        typ, val = match.group(1), match.group(2)
-                        if (
-                            typ != "service:"
-                            and "*" not in val
-                            and not val.endswith(".yaml")
-                        ):
-                            add_entry(parsed_entity_list, val, short_path, lineno)
-                    for match in re.finditer(service_pattern, line):
-                        val = match.group(1)
-                        add_entry(parsed_service_list, val, short_path, lineno)
-                    lineno += 1
-            files_parsed += 1
-            _LOGGER.debug("%s parsed", yaml_file)
-        except OSError as exception:
-            _LOGGER.error("Unable to parse %s: %s", yaml_file, exception)
-        except UnicodeDecodeError as exception:
-            _LOGGER.error(
-                "Unable to parse %s: %s. Use UTF-8 encoding to avoid this error",
-                yaml_file,
-                exception,
-            )
-
-    # remove ignored entities and services from resulting lists
-    ignored_items = get_config(hass, CONF_IGNORED_ITEMS, [])
-    ignored_items = list(set(ignored_items + BUNDLED_IGNORED_ITEMS))
-    excluded_entities = []
-    excluded_services = []
-    for itm in ignored_items:
-        if itm:
-            excluded_entities.extend(fnmatch.filter(parsed_entity_list, itm))
-            excluded_services.extend(fnmatch.filter(parsed_service_list, itm))
-
-    parsed_entity_list = {
-        k: v for k, v in parsed_entity_list.items() if k not in excluded_entities
-    }
-    parsed_service_list = {
-        k: v for k, v in parsed_service_list.items() if k not in excluded_services
-    }
+def update_missing_entities(hass, entity_ids):
+    """re-check given entities only and update the list of missing ones"""
+    parsed_entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+    entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
+    ignored_states = get_ignored_states(hass)
+    for entry in entity_ids:
+        entities_missing.pop(entry, None)
+        if entry in parsed_entity_list and is_entity_missing(
+            hass, entry, ignored_states
+        ):
+            entities_missing[entry] = parsed_entity_list[entry]
+            _LOGGER.debug("entry %s added to missing list", entry)
 
-    _LOGGER.debug("Parsed files: %s", files_parsed)
-    _LOGGER.debug("Ignored files: %s", effectively_ignored)
-    _LOGGER.debug("Found entities: %s", len(parsed_entity_list))
-    _LOGGER.debug("Found services: %s", len(parsed_service_list))
-    return (
-        parsed_entity_list,
-        parsed_service_list,
-        files_parsed,
-        len(effectively_ignored),
-    )
-
-
-def fill(data, width, extra=None):
-    """arrange data by table column width"""
-    if data and isinstance(data, dict):
-        key, val = next(iter(data.items()))
-        out = f"{key}:{','.join([str(v) for v in val])}"
-    else:
-        out = str(data) if not extra else f"{data} ('{extra}')"
 
-    return (
-        "\n".join([out.ljust(width) for out in wrap(out, width)]) if width > 0 else out
-    )
+def update_missing_services(hass, service_ids):
+    """re-check given services only and update the list of missing ones"""
+    parsed_service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+    services_missing = hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+    ignored = "missing" in get_config(hass, CONF_IGNORED_STATES, [])
+    for entry in service_ids:
+        services_missing.pop(entry, None)
+        if not ignored and entry in parsed_service_list and not is_service(hass, entry):
+            services_missing[entry] = parsed_service_list[entry]
+            _LOGGER.debug("service %s added to missing list", entry)
+
 
+class Locations(list):
+    """Line numbers of an entry in a file along with the exact occurrence count
 
-async def report(hass, render, chunk_size, test_mode=False):
-    """generates watchman report either as a table or as a list"""
-    if DOMAIN not in hass.data:
-        raise HomeAssistantError("No data for report, refresh required.")
+    Only first OCCURRENCES_LIMIT line numbers are stored, the rest is counted.
+    """
 
-    start_time = time.time()
-    header = get_config(hass, CONF_HEADER, DEFAULT_HEADER)
-    services_missing = hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
-    service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
-    entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
-    entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
-    files_parsed = hass.data[DOMAIN][HASS_DATA_FILES_PARSED]
-    files_ignored = hass.data[DOMAIN][HASS_DATA_FILES_IGNORED]
-    chunk_size = (
-        get_config(hass, CONF_CHUNK_SIZE, DEFAULT_CHUNK_SIZE)
-        if chunk_size is None
-        else chunk_size
-    )
-
-    rep = f"{header} \n"
-    if services_missing:
-        rep += f"\n-== Missing {len(services_missing)} service(s) from "
-        rep += f"{len(service_list)} found in your config:\n"
-        rep += render(hass, REPORT_ENTRY_TYPE_SERVICE)
-        rep += "\n"
-    elif len(service_list) > 0:
-        rep += f"\n-== Congratulations, all {len(service_list)} services from "
-        rep += "your config are available!\n"
-    else:
-        rep += "\n-== No services found in configuration files!\n"
+    def __init__(self, lines=(), total=None):
+        super().__init__(lines)
+        self.total = len(self) if total is None else total
 
-    if entities_missing:
-        rep += f"\n-== Missing {len(entities_missing)} entity(ies) from "
-        rep += f"{len(entity_list)} found in your config:\n"
-        rep += render(hass, REPORT_ENTRY_TYPE_ENTITY)
-        rep += "\n"
+    def add(self, lineno):
+        """count an occurrence, store its line number while below the limit"""
+        self.total += 1
+        if len(self) < OCCURRENCES_LIMIT:
+            self.append(lineno)
 
-    elif len(entity_list) > 0:
-        rep += f"\n-== Congratulations, all {len(entity_list)} entities from "
-        rep += "your config are available!\n"
-    else:
-        rep += "\n-== No entities found in configuration files!\n"
 
-    def get_timezone(hass):
-        return pytz.timezone(hass.config.time_zone)
+def count_occurrences(data):
+    """exact number of occurrences of an entry across files"""
+    return sum(getattr(lines, "total", len(lines)) for lines in data.values())
 
-    timezone = await hass.async_add_executor_job(get_timezone, hass)
 
-    if not test_mode:
-        report_datetime = datetime.now(timezone).strftime("%d %b %Y %H:%M:%S")
-        parse_duration = hass.data[DOMAIN][HASS_DATA_PARSE_DURATION]
-        check_duration = hass.data[DOMAIN][HASS_DATA_CHECK_DURATION]
-        render_duration = time.time() - start_time
-    else:
-        report_datetime = "01 Jan 1970 00:00:00"
-        parse_duration = 0.01
-        check_duration = 0.105
-        render_duration = 0.0003
-
-    rep += f"\n-== Report created on {report_datetime}\n"
-    rep += (
-        f"-== Parsed {files_parsed} files in {parse_duration:.2f}s., "
-        f"ignored {files_ignored} files \n"
-    )
-    rep += f"-== Generated in: {render_duration:.2f}s. Validated in: {check_duration:.2f}s."
-    report_chunks = []
-    chunk = ""
-    for line in iter(rep.splitlines()):
-        chunk += f"{line}\n"
-        if chunk_size > 0 and len(chunk) > chunk_size:
-            report_chunks.append(chunk)
-            chunk = ""
-    if chunk:
-        report_chunks.append(chunk)
-    return report_chunks
+def add_occurrences(parsed_list, entry, occurrences):
+    """merge occurrences of an entry, keeping OCCURRENCES_LIMIT line numbers"""
+    merged = parsed_list.setdefault(entry, {})
+    room = OCCURRENCES_LIMIT - sum(len(lines) for lines in merged.values())
+    for path, lines in occurrences.items():
+        if len(lines) > room:
+            total = getattr(lines, "total", len(lines))
+            lines = Locations(lines[: max(room, 0)], total)
+        room -= len(lines)
+        merged[path] = lines
+
+
+def format_occurrences(data):
+    """format file:line locations of an entry, other occurrences are counted"""
+    key, val = next(((k, v) for k, v in data.items() if v), next(iter(data.items())))
+    out = f"{key}:{','.join([str(v) for v in val])}"
+    more = count_occurrences(data) - len(val)
+    return f"{out} and {more} more" if more else out
@@ -0,0 +1,164 @@
+"""WebSocket commands of watchman"""
+
+import glob
+
+import voluptuous as vol
+from homeassistant.components import websocket_api
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
+
+from .const import (
+    COORD_DATA_ENTITY_ATTRS,
+    COORD_DATA_SERVICE_ATTRS,
+    CONF_QUERY_DOMAIN,
+    CONF_QUERY_FILE,
+    CONF_QUERY_GLOB,
+    CONF_QUERY_LIMIT,
+    CONF_QUERY_OFFSET,
+    CONF_QUERY_STATE,
+    CONF_QUERY_TYPE,
+    DOMAIN,
+    HASS_DATA_COORDINATOR,
+    QUERY_DEFAULT_LIMIT,
+    QUERY_MAX_LIMIT,
+    QUERY_STATES,
+)
+from .history import STATUS_OK
+from .utils import async_import_module
+
+# "type" is taken by websocket message type
+CONF_ENTRY_TYPE = "entry_type"
+
+PAGE_SCHEMA = {
+    vol.Optional(CONF_QUERY_LIMIT, default=QUERY_DEFAULT_LIMIT): vol.All(
+        vol.Coerce(int), vol.Range(min=1, max=QUERY_MAX_LIMIT)
+    ),
+    vol.Optional(CONF_QUERY_OFFSET, default=0): cv.positive_int,
+}
+
+
+@callback
+def async_register_commands(hass: HomeAssistant):
+    """register watchman websocket commands"""
+    websocket_api.async_register_command(hass, websocket_list)
+    websocket_api.async_register_command(hass, websocket_file)
+    websocket_api.async_register_command(hass, websocket_subscribe)
+
+
+async def _async_query(hass, connection, msg, filters):
+    """send query result or error back to the client"""
+    query = await async_import_module(hass, "query")
+    try:
+        connection.send_result(msg["id"], query.query_entries(hass, filters))
+    except HomeAssistantError as err:
+        connection.send_error(msg["id"], websocket_api.ERR_NOT_FOUND, str(err))
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): "watchman/list",
+        vol.Optional(CONF_ENTRY_TYPE): vol.In(["entity", "service"]),
+        vol.Optional(CONF_QUERY_DOMAIN): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional(CONF_QUERY_GLOB): cv.string,
+        vol.Optional(CONF_QUERY_STATE): vol.All(cv.ensure_list, [vol.In(QUERY_STATES)]),
+        **PAGE_SCHEMA,
+    }
+)
+@websocket_api.async_response
+async def websocket_list(hass, connection, msg):
+    """page of reported entries, all states except ok by default"""
+    filters = {
+        key: msg[key]
+        for key in (CONF_QUERY_DOMAIN, CONF_QUERY_GLOB, CONF_QUERY_LIMIT)
+        if key in msg
+    }
+    filters[CONF_QUERY_OFFSET] = msg[CONF_QUERY_OFFSET]
+    filters[CONF_QUERY_STATE] = msg.get(
+        CONF_QUERY_STATE, [s for s in QUERY_STATES if s != STATUS_OK]
+    )
+    if CONF_ENTRY_TYPE in msg:
+        filters[CONF_QUERY_TYPE] = msg[CONF_ENTRY_TYPE]
+    await _async_query(hass, connection, msg, filters)
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): "watchman/file",
+        vol.Required(CONF_QUERY_FILE): cv.string,
+        **PAGE_SCHEMA,
+    }
+)
+@websocket_api.async_response
+async def websocket_file(hass, connection, msg):
+    """page of entries referenced from a given file"""
+    filters = {
+        CONF_QUERY_FILE: glob.escape(msg[CONF_QUERY_FILE]),
+        CONF_QUERY_LIMIT: msg[CONF_QUERY_LIMIT],
+        CONF_QUERY_OFFSET: msg[CONF_QUERY_OFFSET],
+    }
+    await _async_query(hass, connection, msg, filters)
+
+
+def _snapshot(data):
+    """{(kind, id): compact item} of reported entries from coordinator data
+
+    An id may be both an entity and a service, e.g. a script, so items
+    are told apart by their kind.
+    """
+    if not data:
+        return {}
+    items = {}
+    for kind, key in (
+        ("entity", COORD_DATA_ENTITY_ATTRS),
+        ("service", COORD_DATA_SERVICE_ATTRS),
+    ):
+        for attrs in data.get(key, []):
+            items[(kind, attrs["id"])] = {
+                "id": attrs["id"],
+                "type": kind,
+                "state": attrs.get("state", "missing"),
+                "missing_since": attrs["missing_since"],
+            }
+    return items
+
+
+@websocket_api.websocket_command({vol.Required("type"): "watchman/subscribe"})
+@callback
+def websocket_subscribe(hass, connection, msg):
+    """push reported entries once, then only changes after each update"""
+    coordinator = hass.data.get(DOMAIN, {}).get(HASS_DATA_COORDINATOR)
+    if coordinator is None:
+        connection.send_error(
+            msg["id"], websocket_api.ERR_NOT_FOUND, "Watchman is not loaded"
+        )
+        return
+    sent = _snapshot(coordinator.data)
+
+    @callback
+    def async_on_update():
+        nonlocal sent
+        current = _snapshot(coordinator.data)
+        added = [item for key, item in current.items() if sent.get(key) != item]
+        removed = [
+            {"id": entry, "type": kind}
+            for kind, entry in sent
+            if (kind, entry) not in current
+        ]
+        sent = current
+        if added or removed:
+            connection.send_message(
+                websocket_api.event_message(
+                    msg["id"], {"added": added, "removed": removed}
+                )
+            )
+
+    connection.subscriptions[msg["id"]] = coordinator.async_add_listener(
+        async_on_update
+    )
+    connection.send_result(msg["id"])
+    connection.send_message(
+        websocket_api.event_message(
+            msg["id"], {"added": list(sent.values()), "removed": []}
+        )
+    )
@@ -0,0 +1,80 @@
+"""Test offline command line check"""
+
+import io
+import json
+from custom_components.watchman import cli
+
+REGISTRY_ENTRY = {
+    "aliases": [],
+    "area_id": None,
+    "categories": {},
+    "capabilities": None,
+    "config_entry_id": None,
+    "device_class": None,
+    "device_id": None,
+    "disabled_by": "user",
+    "entity_category": None,
+    "hidden_by": None,
+    "icon": None,
+    "id": "0123456789abcdef",
+    "has_entity_name": False,
+    "labels": [],
+    "name": None,
+    "options": {},
+    "original_device_class": None,
+    "original_icon": None,
+    "original_name": None,
+    "platform": "template",
+    "previous_unique_id": None,
+    "supported_features": 0,
+    "translation_key": None,
+    "unique_id": "disabled",
+    "unit_of_measurement": None,
+}
+
+
+def test_cli(tmp_path, hass_storage):
+    """ids are checked against registry and snapshot, exit code reflects result"""
+    (tmp_path / "automations.yaml").write_text(
+        "- action:\n"
+        "    - service: light.turn_on\n"
+        "      entity_id: light.kitchen\n"
+        "    - service: fake.service\n"
+        "      entity_id: sensor.disabled\n",
+        encoding="utf-8",
+    )
+    # storage is mocked in tests, registry is read from .storage otherwise
+    hass_storage["core.entity_registry"] = {
+        "version": 1,
+        "minor_version": 14,
+        "key": "core.entity_registry",
+        "data": {
+            "entities": [REGISTRY_ENTRY | {"entity_id": "sensor.disabled"}],
+            "deleted_entities": [],
+        },
+    }
+    snapshot = tmp_path / "snapshot.json"
+    snapshot.write_text(
+        json.dumps(
+            {
+                "states": [{"entity_id": "light.kitchen", "state": "on"}],
+                "services": [{"domain": "light", "services": {"turn_on": {}}}],
+            }
+        ),
+        encoding="utf-8",
+    )
+    args = cli.get_arg_parser().parse_args(
+        [str(tmp_path), "--snapshot", str(snapshot), "--concurrency", "2"]
+    )
+    out = io.StringIO()
+    assert cli.asyncio.run(cli.async_main(args, out)) == 1
+    assert out.getvalue().splitlines() == [
+        "entity  sensor.disabled  disabled  automations.yaml:5",
+        "service  fake.service  missing  automations.yaml:4",
+    ]
+
+    args = cli.get_arg_parser().parse_args(
+        [str(tmp_path), "--snapshot", str(snapshot), "--ignored-items", "*.disabled"]
+        + ["--ignored-items", "fake.*"]
+    )
+    assert cli.asyncio.run(cli.async_main(args, io.StringIO())) == 0
@@ -0,0 +1,75 @@
+"""Test diagnostics and runtime metrics"""
+
+from copy import deepcopy
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+from homeassistant.const import EVENT_CALL_SERVICE
+from custom_components.watchman import (
+    async_setup_entry,
+)
+from custom_components.watchman.const import (
+    CONF_INCLUDED_FOLDERS,
+    CONF_SERVICE_NAME,
+)
+from custom_components.watchman.config_flow import DEFAULT_DATA
+from custom_components.watchman.diagnostics import (
+    async_get_config_entry_diagnostics,
+)
+from custom_components.watchman.metrics import WatchmanMetrics
+
+TEST_INCLUDED_FOLDERS = ["/workspaces/thewatchman/tests/input"]
+
+
+async def test_diagnostics(hass):
+    """diagnostics publish event, file and timing metrics"""
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = TEST_INCLUDED_FOLDERS
+    options[CONF_SERVICE_NAME] = "notify.secret"
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+    hass.states.async_set("sensor.test1_unknown", "unknown")
+    hass.states.async_set("sensor.unrelated", "42")
+    hass.bus.async_fire(EVENT_CALL_SERVICE, {"domain": "light", "service": "reload"})
+    await hass.async_block_till_done()
+
+    diagnostics = await async_get_config_entry_diagnostics(hass, config_entry)
+    assert diagnostics["options"][CONF_SERVICE_NAME] == "**REDACTED**"
+    assert diagnostics["index"]["files_parsed"] == 3
+    counters = diagnostics["metrics"]["counters"]
+    assert counters["files_scanned"] == 3
+    assert counters["bytes_read"] > 0
+    assert counters["regex_matches"] >= 7
+    assert counters["events_received.state_changed"] == 2
+    assert counters["events_filtered.state_changed"] == 1
+    assert counters["events_filtered.configuration_changed"] >= 1
+    assert counters["refreshes"] >= 1
+    assert counters["partial_refreshes"] == 1
+    assert diagnostics["index"]["size"] > 0
+    timings = diagnostics["metrics"]["timings"]
+    assert timings["parse"]["runs"] == 1
+    assert timings["check"]["histogram"]["le_inf"] == timings["check"]["runs"]
+
+
+def test_timing_history():
+    """timing statistics cover a bounded number of recent runs"""
+    metrics = WatchmanMetrics(history=3)
+    for duration in (0.001, 2, 0.2, 0.02):
+        metrics.observe("parse", duration)
+    timings = metrics.as_dict()["timings"]["parse"]
+    assert timings["runs"] == 3
+    assert timings["last"] == metrics.last_parse_duration == 0.02
+    assert timings["max"] == 2
+    assert timings["histogram"]["le_0.05"] == 1
+    assert timings["histogram"]["le_5"] == 3
+
+
+def test_metrics_runs():
+    """only timed runs make metrics snapshots stale, counters do not"""
+    metrics = WatchmanMetrics()
+    metrics.count("partial_refreshes")
+    metrics.event("state_changed")
+    assert metrics.runs == 0
+    metrics.observe("partial_parse", 0.01)
+    metrics.observe("check", 0.01)
+    assert metrics.runs == 2
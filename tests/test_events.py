@@ -3,16 +3,23 @@
 from copy import deepcopy
 from pytest_homeassistant_custom_component.common import MockConfigEntry
 from homeassistant.core import callback
+from homeassistant.helpers import entity_registry as er
 from custom_components.watchman import (
     async_setup_entry,
 )
 from custom_components.watchman.const import (
+    COORD_DATA_ENTITY_ATTRS,
+    COORD_DATA_MISSING_SERVICES,
+    COORD_DATA_SERVICE_ATTRS,
     DOMAIN,
     CONF_INCLUDED_FOLDERS,
+    HASS_DATA_COORDINATOR,
     HASS_DATA_MISSING_ENTITIES,
     HASS_DATA_MISSING_SERVICES,
+    HASS_DATA_METRICS,
 )
 from custom_components.watchman.config_flow import DEFAULT_DATA
+from custom_components.watchman.utils import get_entity_state
 
 TEST_INCLUDED_FOLDERS = ["/workspaces/thewatchman/tests/input"]
 
@@ -36,12 +43,24 @@ async def test_add_service(hass):
     assert await async_setup_entry(hass, config_entry)
     assert len(hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]) == 3
     assert len(hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]) == 3
+    coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
+    entity_attrs = coordinator.data[COORD_DATA_ENTITY_ATTRS]
+    refreshes = hass.data[DOMAIN][HASS_DATA_METRICS].counters["refreshes"]
     hass.services.async_register("fake", "service1", dummy_service_handler)
     await hass.async_block_till_done()
     assert len(hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]) == 2
+    assert [a["id"] for a in coordinator.data[COORD_DATA_SERVICE_ATTRS]] == [
+        "fake.service2",
+        "timer.cancel",
+    ]
+    assert coordinator.data[COORD_DATA_MISSING_SERVICES] == 2
     hass.services.async_remove("fake", "service1")
     await hass.async_block_till_done()
     assert len(hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]) == 3
+    assert coordinator.data[COORD_DATA_SERVICE_ATTRS][-1]["id"] == "fake.service1"
+    # entities are not checked again
+    assert coordinator.data[COORD_DATA_ENTITY_ATTRS] is entity_attrs
+    assert hass.data[DOMAIN][HASS_DATA_METRICS].counters["refreshes"] == refreshes
 
 
 async def test_change_state(hass):
@@ -97,3 +116,46 @@ async def test_add_entity(hass):
     hass.states.async_set("sensor.test4_avail", "42")
     await hass.async_block_till_done()
     assert len(hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]) == 3
+
+
+async def test_entity_registry_update(hass):
+    """registry changes of monitored entities are applied without full check"""
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = TEST_INCLUDED_FOLDERS
+    hass.states.async_set("sensor.test1_unknown", "unknown")
+    hass.states.async_set("sensor.test3_unavail", "unavailable")
+    hass.states.async_set("sensor.test4_avail", "42")
+    registry = er.async_get(hass)
+    registry.async_get_or_create(
+        "sensor", "test", "test2", suggested_object_id="test2_missing"
+    )
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+    entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
+    assert "sensor.test2_missing" in entities_missing
+    metrics = hass.data[DOMAIN][HASS_DATA_METRICS]
+    refreshes = metrics.counters["refreshes"]
+
+    registry.async_update_entity(
+        "sensor.test2_missing", disabled_by=er.RegistryEntryDisabler.USER
+    )
+    await hass.async_block_till_done()
+    entities_missing = hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]
+    assert "sensor.test2_missing" in entities_missing
+    assert get_entity_state(hass, "sensor.test2_missing")[0] == "disabled"
+
+    registry.async_update_entity(
+        "sensor.test2_missing", new_entity_id="sensor.test2_renamed"
+    )
+    await hass.async_block_till_done()
+    assert get_entity_state(hass, "sensor.test2_missing")[0] == "missing"
+
+    registry.async_get_or_create(
+        "sensor", "test", "test1", suggested_object_id="unrelated"
+    )
+    await hass.async_block_till_done()
+    assert metrics.counters["events_filtered.entity_registry_updated"] == 1
+    assert metrics.counters["partial_refreshes"] == 2
+    assert metrics.counters["refreshes"] == refreshes
@@ -0,0 +1,64 @@
+"""Test missing status history"""
+
+from copy import deepcopy
+from datetime import datetime, timezone
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+from custom_components.watchman import (
+    async_setup_entry,
+)
+from custom_components.watchman.const import (
+    CONF_INCLUDED_FOLDERS,
+    COORD_DATA_ENTITY_ATTRS,
+    DOMAIN,
+    HASS_DATA_COORDINATOR,
+)
+from custom_components.watchman.config_flow import DEFAULT_DATA
+from custom_components.watchman.history import MissingHistory
+
+TEST_INCLUDED_FOLDERS = ["/workspaces/thewatchman/tests/input"]
+
+
+async def test_history_ring(hass, freezer):
+    """transitions are logged in a bounded ring, missing since is kept apart"""
+    history = MissingHistory(hass, size=3)
+    freezer.move_to("2024-01-01 10:00:00+00:00")
+    history.async_update({"sensor.a": "missing", "sensor.b": "unknown"})
+    freezer.move_to("2024-01-01 11:00:00+00:00")
+    history.async_update({"sensor.a": "unavail"})
+
+    since = datetime(2024, 1, 1, 10, tzinfo=timezone.utc)
+    assert history.missing_since("sensor.a") == since
+    assert history.missing_since("sensor.b") is None
+    assert [(t["id"], t["old"], t["new"]) for t in history.transitions()] == [
+        ("sensor.b", "ok", "unknown"),
+        ("sensor.b", "unknown", "ok"),
+        ("sensor.a", "missing", "unavail"),
+    ]
+
+    await history.async_save()
+    restored = MissingHistory(hass, size=3)
+    await restored.async_load()
+    assert restored.missing_since("sensor.a") == since
+    assert restored.transitions() == history.transitions()
+
+
+async def test_missing_since_attribute(hass):
+    """sensor attributes carry the time an entity went missing"""
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = TEST_INCLUDED_FOLDERS
+    hass.states.async_set("sensor.test1_unknown", "unknown")
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+    coordinator = hass.data[DOMAIN][HASS_DATA_COORDINATOR]
+    attrs = {a["id"]: a for a in coordinator.data[COORD_DATA_ENTITY_ATTRS]}
+    since = attrs["sensor.test1_unknown"]["missing_since"]
+    assert datetime.fromisoformat(since) <= datetime.now(timezone.utc)
+
+    hass.states.async_set("sensor.test1_unknown", "on")
+    await hass.async_block_till_done()
+    hass.states.async_set("sensor.test1_unknown", "unknown")
+    await hass.async_block_till_done()
+    attrs = {a["id"]: a for a in coordinator.data[COORD_DATA_ENTITY_ATTRS]}
+    assert attrs["sensor.test1_unknown"]["missing_since"] >= since
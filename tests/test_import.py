@@ -0,0 +1,43 @@
+"""Test integration import time"""
+
+import json
+import os
+import subprocess
+import sys
+
+# watchman's own share of the import, Home Assistant modules are preloaded
+IMPORT_TIME_BUDGET = 0.25
+
+IMPORT_PROBE = """
+import json, sys, time
+import voluptuous
+import homeassistant.helpers.config_validation
+import homeassistant.helpers.update_coordinator
+import homeassistant.helpers.event
+import homeassistant.components.persistent_notification
+import homeassistant.config_entries
+start = time.perf_counter()
+import custom_components.watchman
+duration = time.perf_counter() - start
+print(json.dumps({"duration": duration, "modules": list(sys.modules)}))
+"""
+
+
+def test_import_time():
+    """integration import should be fast and should not load report/parser stack"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=root,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    probe = json.loads(result.stdout.splitlines()[-1])
+    assert "custom_components.watchman.report" not in probe["modules"]
+    assert "custom_components.watchman.parser" not in probe["modules"]
+    assert "custom_components.watchman.query" not in probe["modules"]
+    assert "custom_components.watchman.websocket" not in probe["modules"]
+    assert "prettytable" not in probe["modules"]
+    assert "pytz" not in probe["modules"]
+    assert probe["duration"] < IMPORT_TIME_BUDGET
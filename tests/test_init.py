@@ -1,6 +1,7 @@
 """Test setup process."""
 
 from copy import deepcopy
+import os
 from pytest_homeassistant_custom_component.common import MockConfigEntry
 from custom_components.watchman import (
     async_setup_entry,
@@ -15,6 +16,8 @@ from custom_components.watchman.const import (
     HASS_DATA_MISSING_SERVICES,
     HASS_DATA_PARSED_ENTITY_LIST,
     HASS_DATA_PARSED_SERVICE_LIST,
+    HASS_DATA_PARSE_MAX_STALL,
+    PARSE_STALL_BUDGET,
 )
 from custom_components.watchman.config_flow import DEFAULT_DATA
 
@@ -119,3 +122,18 @@ async def test_ignored_items(hass):
     assert len(hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]) == 2
     assert len(hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]) == 2
     assert len(hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]) == 2
+
+
+async def test_parse_stall(hass, tmpdir):
+    """large files are scanned without stalling the event loop"""
+    with open(os.path.join(tmpdir, "large.yaml"), "w", encoding="utf-8") as f:
+        for i in range(20000):
+            f.write(f"  - entity_id: sensor.large_{i % 100}  # comment {i}\n")
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = [str(tmpdir)]
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+    assert len(hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]) == 100
+    assert hass.data[DOMAIN][HASS_DATA_PARSE_MAX_STALL] < PARSE_STALL_BUDGET
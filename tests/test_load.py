@@ -0,0 +1,175 @@
+"""Event firehose load test of watchman event handlers
+
+Replays a mix of state changes and service calls at a fixed rate, first
+without watchman and then with it loaded, and prints the time spent per
+event, coordinator refreshes and event loop lag percentiles of both runs.
+Defaults keep the run short, a real load test is run with e.g.
+
+    WATCHMAN_LOAD_EVENTS=200000 WATCHMAN_LOAD_RATE=5000 pytest tests/test_load.py -s
+
+WATCHMAN_LOAD_MIX sets shares of monitored and other state changes, other
+service calls and tracked reload calls, which trigger a rescan.
+"""
+
+import asyncio
+from copy import deepcopy
+import os
+import random
+import time
+from homeassistant.const import EVENT_CALL_SERVICE
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+from custom_components.watchman import async_setup_entry
+from custom_components.watchman.const import (
+    CONF_INCLUDED_FOLDERS,
+    DOMAIN,
+    HASS_DATA_METRICS,
+)
+from custom_components.watchman.config_flow import DEFAULT_DATA
+
+TEST_INCLUDED_FOLDERS = ["/workspaces/thewatchman/tests/input"]
+MONITORED_ENTITIES = ["sensor.test1_unknown", "sensor.test3_unavail"]
+LOAD_EVENTS = int(os.environ.get("WATCHMAN_LOAD_EVENTS", 2000))
+LOAD_RATE = int(os.environ.get("WATCHMAN_LOAD_RATE", 5000))
+LOAD_MIX = os.environ.get(
+    "WATCHMAN_LOAD_MIX", "monitored=0.1,other=0.7,service=0.2,reload=0"
+)
+# events are fired in batches once per tick
+TICK = 0.01
+LAG_INTERVAL = 0.001
+
+
+def parse_mix(mix):
+    """{kind: share} from kind=share pairs separated by commas"""
+    return {
+        kind.strip(): float(share)
+        for kind, share in (pair.split("=") for pair in mix.split(","))
+    }
+
+
+def build_events(hass, count, mix, seed=0):
+    """list of callables firing one event each, in a reproducible order"""
+    rnd = random.Random(seed)
+    counter = iter(range(count))
+    # monitored entities start "on" and alternate, so each call is a change
+    flips = dict.fromkeys(MONITORED_ENTITIES, False)
+
+    def monitored():
+        entity = rnd.choice(MONITORED_ENTITIES)
+        flips[entity] = not flips[entity]
+        value = "unavailable" if flips[entity] else "on"
+        return lambda: hass.states.async_set(entity, value)
+
+    def other():
+        entity = f"sensor.load_{rnd.randrange(500)}"
+        value = f"{seed}.{next(counter)}"
+        return lambda: hass.states.async_set(entity, value)
+
+    def service():
+        data = {"domain": "light", "service": "turn_on", "service_data": {}}
+        return lambda: hass.bus.async_fire(EVENT_CALL_SERVICE, data)
+
+    def reload():
+        data = {"domain": "input_boolean", "service": "reload", "service_data": {}}
+        return lambda: hass.bus.async_fire(EVENT_CALL_SERVICE, data)
+
+    makers = {
+        "monitored": monitored,
+        "other": other,
+        "service": service,
+        "reload": reload,
+    }
+    kinds = rnd.choices(list(mix), weights=list(mix.values()), k=count)
+    return [(kind, makers[kind]()) for kind in kinds]
+
+
+def percentile(values, share):
+    """nearest rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[int(share * (len(ordered) - 1))] if ordered else 0.0
+
+
+async def sample_lag(lags, stop):
+    """record how late the event loop wakes up a sleeping task"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LAG_INTERVAL
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(loop.time() - expected)
+
+
+async def async_replay(hass, events, rate):
+    """fire events at a fixed rate, returns time busy and loop lags"""
+    per_tick = max(1, int(rate * TICK))
+    lags = []
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    # test loop runs in debug mode, which records a traceback for every task
+    debug = loop.get_debug()
+    loop.set_debug(False)
+    sampler = loop.create_task(sample_lag(lags, stop))
+    busy = 0.0
+    next_tick = time.monotonic()
+    for start in range(0, len(events), per_tick):
+        started = time.perf_counter()
+        for _, fire in events[start : start + per_tick]:
+            fire()
+        await hass.async_block_till_done()
+        busy += time.perf_counter() - started
+        next_tick += TICK
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+    stop.set()
+    await sampler
+    loop.set_debug(debug)
+    return busy, lags
+
+
+def summary(label, events, busy, lags, metrics=None):
+    """one line of the load test report"""
+    line = (
+        f"{label:<10} {len(events)} events, {busy / len(events) * 1e6:.1f}us/event, "
+        f"lag p50={percentile(lags, 0.5) * 1e3:.2f}ms "
+        f"p95={percentile(lags, 0.95) * 1e3:.2f}ms "
+        f"p99={percentile(lags, 0.99) * 1e3:.2f}ms"
+    )
+    if metrics is not None:
+        line += (
+            f", refreshes={metrics['refreshes']}"
+            f", partial refreshes={metrics['partial_refreshes']}"
+        )
+    return line
+
+
+async def test_event_overhead(hass):
+    """watchman handles every event and refreshes only for monitored ones"""
+    mix = parse_mix(LOAD_MIX)
+    for entity in MONITORED_ENTITIES:
+        hass.states.async_set(entity, "on")
+    events = build_events(hass, LOAD_EVENTS, mix)
+    baseline_busy, baseline_lags = await async_replay(hass, events, LOAD_RATE)
+
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = TEST_INCLUDED_FOLDERS
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+    metrics = hass.data[DOMAIN][HASS_DATA_METRICS]
+    for entity in MONITORED_ENTITIES:
+        hass.states.async_set(entity, "on")
+    await hass.async_block_till_done()
+    before = metrics.counters.copy()
+    events = build_events(hass, LOAD_EVENTS, mix, seed=1)
+    busy, lags = await async_replay(hass, events, LOAD_RATE)
+    delta = metrics.counters - before
+
+    print()
+    print(summary("baseline", events, baseline_busy, baseline_lags))
+    print(summary("watchman", events, busy, lags, delta))
+    print(f"added {(busy - baseline_busy) / len(events) * 1e6:.1f}us/event")
+
+    fired = {kind: sum(1 for k, _ in events if k == kind) for kind in mix}
+    state_events = fired.get("monitored", 0) + fired.get("other", 0)
+    assert delta["events_received.state_changed"] == state_events
+    # only transitions to and from monitored states are checked again
+    assert delta["partial_refreshes"] <= fired.get("monitored", 0)
+    assert delta["refreshes"] <= fired.get("reload", 0)
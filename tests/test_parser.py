@@ -0,0 +1,480 @@
+"""Test configuration file scanners"""
+
+from copy import deepcopy
+import os
+import time
+from types import SimpleNamespace
+import pytest
+from homeassistant.core import CoreState
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+from custom_components.watchman import async_setup_entry
+from custom_components.watchman import parser
+from custom_components.watchman.parser import (
+    ENTITY_PATTERN,
+    ScanLimitError,
+    build_domain_map,
+    build_reference_index,
+    find_entities_linear,
+    scan_file,
+    scan_file_mmap,
+)
+from custom_components.watchman.const import (
+    CONF_INCLUDED_FOLDERS,
+    CONF_MAX_FILE_SIZE,
+    CONF_SCAN_CONCURRENCY,
+    CONF_THROTTLE_FILES,
+    DOMAIN,
+    DOMAIN_DATA,
+    HASS_DATA_LIMITED_FILES,
+    HASS_DATA_STARTED,
+    OCCURRENCES_LIMIT,
+    SCAN_BACKOFF_BACKLOG,
+    SCAN_SETTLE_TIME,
+)
+from custom_components.watchman.config_flow import DEFAULT_DATA
+from custom_components.watchman.metrics import WatchmanMetrics
+from custom_components.watchman.report import report, text_renderer
+from custom_components.watchman.scheduler import ParseCancelledError, ScanToken
+from custom_components.watchman.utils import (
+    add_occurrences,
+    count_occurrences,
+    format_occurrences,
+)
+
+TEST_CONFIG = """\
+automation: !include automations.yaml
+script:
+  morning:
+    sequence:
+      - service: light.turn_on  # service: light.commented
+        entity_id: light.kitchen
+      - service: notify.mobile_app
+        data:
+          message: "{{ states('sensor.outdoor_temp') }}"
+# sensor.commented_out
+      - condition: state
+        entity_id:
+          - binary_sensor.door, binary_sensor.window
+        state: "on" # binary_sensor.commented
+template:
+  - sensor:
+      - name: sensor.*_wildcard
+        state: "{{ states.sensor.indoor_temp.state }}"
+"""
+
+
+def write_config(tmpdir, content, repeat=1):
+    """write test configuration file"""
+    path = os.path.join(tmpdir, "configuration.yaml")
+    with open(path, "wb") as f:
+        for _ in range(repeat):
+            f.write(content)
+    return path
+
+
+def test_mmap_scan_equivalence(tmpdir):
+    """bytes level scan finds the same entries as line by line scan"""
+    path = write_config(tmpdir, TEST_CONFIG.encode("utf-8"), repeat=50)
+    entities, services, scope, _ = scan_file(path, "configuration.yaml")
+    mm_entities, mm_services, mm_scope, _ = scan_file_mmap(path, "configuration.yaml")
+    assert "sensor.commented_out" not in entities
+    assert "light.commented" not in services
+    assert "binary_sensor.window" in entities
+    assert mm_entities == entities
+    assert mm_services == services
+    assert mm_scope.keys == scope.keys
+    assert mm_scope.includes == scope.includes
+
+
+def test_mmap_scan_invalid_utf8(tmpdir):
+    """invalid UTF-8 does not abort bytes level scan of a file"""
+    content = TEST_CONFIG.encode("utf-8").replace(b"template:", b"template: \xff\xfe")
+    path = write_config(tmpdir, content)
+    entities, services, scope, _ = scan_file_mmap(path, "configuration.yaml")
+    assert "sensor.indoor_temp" in entities
+    assert "notify.mobile_app" in services
+    assert "template" not in scope.keys
+
+
+def test_fallback_equivalence():
+    """linear time fallback finds the same entities as the entity pattern"""
+    for line in TEST_CONFIG.splitlines():
+        expected = [
+            match.group(2)
+            for match in ENTITY_PATTERN.finditer(line)
+            if match.group(1) != "service:"
+        ]
+        assert [val for _, val in find_entities_linear(line)] == expected
+        found = find_entities_linear(line.encode("utf-8"))
+        assert [val for _, val in found] == expected
+
+
+@pytest.mark.parametrize("scanner", [scan_file, scan_file_mmap])
+def test_long_lines(tmpdir, scanner):
+    """oversized lines are scanned in linear time and reported"""
+    blob = "\t" * 100000 + "sensor.after_blob"
+    content = f"{TEST_CONFIG}  data: {blob} # sensor.commented\n".encode("utf-8")
+    path = write_config(tmpdir, content)
+    start = time.monotonic()
+    entities, services, _, limits = scanner(path, "configuration.yaml")
+    assert time.monotonic() - start < 1
+    assert "sensor.after_blob" in entities
+    assert "sensor.commented" not in entities
+    assert "light.turn_on" in services
+    assert len(limits) == 1
+    assert limits[0].startswith("1 line(s) longer than")
+
+
+@pytest.mark.parametrize("scanner", [scan_file, scan_file_mmap])
+def test_scan_time_budget(tmpdir, monkeypatch, scanner):
+    """scan of a file stops once its time budget is spent"""
+    monkeypatch.setattr(parser, "SCAN_FILE_TIME_BUDGET", -1)
+    path = write_config(tmpdir, TEST_CONFIG.encode("utf-8"))
+    entities, _, _, limits = scanner(path, "configuration.yaml")
+    assert not entities
+    assert limits[0].startswith("scan stopped at line 1")
+
+
+async def test_max_file_size(hass, tmpdir):
+    """files over max_file_size are skipped and listed in the report"""
+    path = write_config(tmpdir, TEST_CONFIG.encode("utf-8"), repeat=2000)
+    with pytest.raises(ScanLimitError):
+        scan_file(path, "configuration.yaml", 1024 * 1024)
+
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = [str(tmpdir)]
+    options[CONF_MAX_FILE_SIZE] = 1
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+    short_path = os.path.relpath(path, hass.config.config_dir)
+    assert short_path in hass.data[DOMAIN][HASS_DATA_LIMITED_FILES]
+    chunks = await report(hass, text_renderer, chunk_size=0, test_mode=True)
+    assert "-== Scan limits hit in 1 file(s):" in chunks[0]
+    assert f"   {short_path}: skipped, size of" in chunks[0]
+
+
+def test_bounded_occurrences(tmpdir):
+    """only first line numbers of an entry are stored, all are counted"""
+    path = write_config(
+        tmpdir, b"- condition: state\n  entity_id: switch.guest_mode\n", 100
+    )
+    entities, _, _, _ = scan_file(path, "configuration.yaml")
+    lines = entities["switch.guest_mode"]["configuration.yaml"]
+    assert lines == list(range(2, 2 * OCCURRENCES_LIMIT + 1, 2))
+    assert lines.total == 100
+
+    parsed_list = {}
+    add_occurrences(parsed_list, "switch.guest_mode", entities["switch.guest_mode"])
+    add_occurrences(parsed_list, "switch.guest_mode", {"other.yaml": [1, 2, 3]})
+    occurrences = parsed_list["switch.guest_mode"]
+    assert not occurrences["other.yaml"]
+    assert count_occurrences(occurrences) == 103
+    assert format_occurrences(occurrences) == (
+        f"configuration.yaml:{','.join(str(n) for n in lines)} "
+        f"and {103 - OCCURRENCES_LIMIT} more"
+    )
+
+
+DASHBOARD = b"""{
+  "data": {
+    "config": {
+      "views": [
+        {
+          "title": "Home",
+          "cards": [
+            {
+              "type": "entities",
+              "entities": ["light.kitchen"]
+            },
+            {
+              "type": "vertical-stack",
+              "cards": [
+                {
+                  "type": "glance",
+                  "entities": ["switch.pump"]
+                }
+              ],
+              "title": "Stack"
+            }
+          ]
+        }
+      ]
+    }
+  }
+}
+"""
+
+
+@pytest.mark.parametrize("scanner", [scan_file, scan_file_mmap])
+def test_card_owners(tmpdir, scanner):
+    """references in dashboards are owned by the innermost card"""
+    path = os.path.join(tmpdir, "lovelace")
+    with open(path, "wb") as f:
+        f.write(DASHBOARD)
+    _, _, scope, _ = scanner(path, "lovelace")
+    assert build_reference_index({"lovelace": scope}, {}) == {
+        "light.kitchen": ["card: entities (Home)"],
+        "switch.pump": ["card: glance (Home)"],
+    }
+
+
+async def test_labeled_domain_keys(hass, tmpdir):
+    """includes below labeled domain keys belong to the domain"""
+    root = str(tmpdir)
+    files = {
+        "configuration.yaml": (
+            "script: !include scripts.yaml\n"
+            "automation manual: !include_dir_merge_list automations/\n"
+            "automation: !include automations.yaml\n"
+        ),
+        "scripts.yaml": "wake:\n  sequence:\n    - service: switch.turn_on\n",
+        "automations.yaml": (
+            "- alias: Evening\n  action:\n    - service: light.turn_off\n"
+        ),
+        "automations/morning.yaml": (
+            "- alias: Morning\n  action:\n    - service: light.turn_on\n"
+        ),
+    }
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+        with open(os.path.join(root, path), "w", encoding="utf-8") as f:
+            f.write(content)
+    file_scopes = (await parser.parse(hass, [(root, "**/*.yaml")], [], root))[4]
+    domain_files = build_domain_map(file_scopes)
+    assert domain_files["automation"] == {
+        "configuration.yaml",
+        "automations.yaml",
+        "automations/morning.yaml",
+        os.path.join("automations", ""),
+    }
+    assert domain_files["script"] == {"configuration.yaml", "scripts.yaml"}
+    references = build_reference_index(file_scopes, domain_files)
+    assert references["light.turn_on"] == ["automation: Morning"]
+    assert references["switch.turn_on"] == ["script: wake"]
+
+
+@pytest.mark.parametrize("concurrency", [1, 8])
+async def test_scan_concurrency(hass, concurrency):
+    """results do not depend on number of files in flight"""
+    folder = "/workspaces/thewatchman/tests/input_reload"
+    folders = [(folder, "**/*.yaml"), (folder, "*.yaml")]
+    hass.data[DOMAIN_DATA] = {CONF_SCAN_CONCURRENCY: 1}
+    expected = await parser.parse(hass, folders, [], folder)
+    hass.data[DOMAIN_DATA] = {CONF_SCAN_CONCURRENCY: concurrency}
+    metrics = WatchmanMetrics()
+    result = await parser.parse(hass, folders, [], folder, metrics=metrics)
+    assert list(result[0].items()) == list(expected[0].items())
+    assert list(result[1].items()) == list(expected[1].items())
+    assert list(result[4]) == list(expected[4])
+    # files matched by both folder patterns are scanned once
+    assert result[2] == 4
+    assert list(metrics.gauges["scan_time_by_folder"]) == [folder]
+
+
+async def test_throttle(hass, monkeypatch):
+    """background scans are throttled, foreground and cancelled ones are not"""
+    folder = "/workspaces/thewatchman/tests/input_reload"
+    folders = [(folder, "**/*.yaml")]
+    now = [0.0]
+    delays = []
+    real_sleep = ScanToken.async_sleep
+
+    async def sleep(token, delay):  # pylint: disable=unused-argument
+        delays.append(delay)
+        now[0] += delay
+
+    monkeypatch.setattr(parser.ScanThrottle, "clock", staticmethod(lambda: now[0]))
+    monkeypatch.setattr(ScanToken, "async_sleep", sleep)
+    hass.data[DOMAIN_DATA] = {CONF_THROTTLE_FILES: 40}
+    metrics = WatchmanMetrics()
+    expected = await parser.parse(hass, folders, [], folder, ScanToken(), None, metrics)
+    assert not delays
+    assert "scan_throttle_wait" not in metrics.timings
+
+    result = await parser.parse(
+        hass, folders, [], folder, ScanToken(background=True), None, metrics
+    )
+    assert list(result[0].items()) == list(expected[0].items())
+    # four files at 40 files per second, the first one is read at once
+    assert delays == pytest.approx([0.025] * 3)
+    assert metrics.timings["scan_throttle_wait"][-1] == pytest.approx(0.075)
+
+    async def cancelled_sleep(token, delay):
+        delays.append(delay)
+        hass.loop.call_soon(token.cancel)
+        # the wait only ends early if cancellation wakes it up
+        await real_sleep(token, 3600)
+
+    monkeypatch.setattr(ScanToken, "async_sleep", cancelled_sleep)
+    hass.data[DOMAIN_DATA] = {CONF_THROTTLE_FILES: 1}
+    delays.clear()
+    with pytest.raises(ParseCancelledError):
+        await parser.parse(hass, folders, [], folder, ScanToken(background=True))
+    assert delays == [1.0]
+
+
+async def test_throttle_backoff(hass, monkeypatch):
+    """throttled waits are stretched until Home Assistant settled after start"""
+    now = [1000.0]
+    delays = []
+
+    async def sleep(token, delay):  # pylint: disable=unused-argument
+        delays.append(delay)
+        now[0] += delay
+
+    monkeypatch.setattr(parser.ScanThrottle, "clock", staticmethod(lambda: now[0]))
+    monkeypatch.setattr(ScanToken, "async_sleep", sleep)
+    throttle = parser.ScanThrottle(hass, ScanToken(background=True), 0, 1)
+    assert not throttle.is_busy()
+
+    hass.set_state(CoreState.starting)
+    assert throttle.is_busy()
+    hass.set_state(CoreState.running)
+    hass.data[DOMAIN] = {HASS_DATA_STARTED: now[0]}
+    assert throttle.is_busy()
+    throttle.charge(files=1)
+    await throttle.async_wait()
+    assert delays == [2.0]
+
+    now[0] += SCAN_SETTLE_TIME
+    assert not throttle.is_busy()
+    hass.data["recorder_instance"] = SimpleNamespace(backlog=SCAN_BACKOFF_BACKLOG + 1)
+    assert throttle.is_busy()
+
+
+async def test_extractors(hass, tmpdir):
+    """files are handed over to extractors by path and prefilter"""
+    root = str(tmpdir)
+    files = {
+        "custom_templates/lights.jinja": (
+            "{% macro lit() %}\n"
+            "{{ is_state('light.kitchen', 'on') and states.sensor.lux.state }}\n"
+            "{{ states('fake.domain') }}\n"
+            "{% endmacro %}\n"
+        ),
+        "custom_templates/empty.jinja": "{% macro nothing() %}{% endmacro %}\n",
+        "blueprints/automation/motion.yaml": (
+            "blueprint:\n"
+            "  input:\n"
+            "    lights:\n"
+            "      default: [light.hall, light.porch]\n"
+        ),
+        ".storage/lovelace": (
+            '{\n  "data": {\n    "config": {\n      "views": [\n'
+            '        {"tap_action": {\n'
+            '          "action": "call-service",\n'
+            '          "service": "light.toggle"}}\n'
+            "      ]\n    }\n  }\n}\n"
+        ),
+    }
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+        with open(os.path.join(root, path), "w", encoding="utf-8") as f:
+            f.write(content)
+    hass.data[DOMAIN_DATA] = {}
+    metrics = WatchmanMetrics()
+    entities, services, *_ = await parser.parse(
+        hass,
+        [(root, "**/*.yaml"), (root, ".storage/lovelace*"), (root, "**/*.jinja")],
+        [],
+        root,
+        metrics=metrics,
+    )
+    assert {e: list(o) for e, o in entities.items()} == {
+        "light.hall": ["blueprints/automation/motion.yaml"],
+        "light.porch": ["blueprints/automation/motion.yaml"],
+        "light.kitchen": ["custom_templates/lights.jinja"],
+        "sensor.lux": ["custom_templates/lights.jinja"],
+    }
+    assert entities["light.hall"]["blueprints/automation/motion.yaml"] == [4]
+    assert entities["light.porch"]["blueprints/automation/motion.yaml"] == [4]
+    assert entities["sensor.lux"]["custom_templates/lights.jinja"] == [2]
+    assert {s: list(o) for s, o in services.items()} == {
+        "light.toggle": [".storage/lovelace"]
+    }
+    assert metrics.counters["extractor_runs.references"] == 2
+    assert metrics.counters["extractor_runs.jinja"] == 1
+    assert metrics.counters["extractor_prefiltered.jinja"] == 1
+    assert set(metrics.gauges["scan_time_by_extractor"]) == {
+        "references",
+        "lovelace",
+        "jinja",
+        "blueprint",
+    }
+
+
+async def test_duplicate_files(hass, tmpdir):
+    """a file is scanned once and attributed to all its paths"""
+    root = str(tmpdir)
+    os.makedirs(os.path.join(root, "packages"))
+    os.makedirs(os.path.join(root, "copies"))
+    for path in ("packages/garden.yaml", "copies/garden.yaml"):
+        with open(os.path.join(root, path), "w", encoding="utf-8") as f:
+            f.write(
+                "script:\n  water:\n    sequence:\n      - service: switch.turn_on\n"
+            )
+    os.symlink(os.path.join(root, "packages"), os.path.join(root, "linked"))
+    os.symlink(root, os.path.join(root, "packages", "loop"))
+    metrics = WatchmanMetrics()
+    services, files_parsed, file_scopes = [
+        (result[1], result[2], result[4])
+        for result in [
+            await parser.parse(hass, [(root, "**/*.yaml")], [], root, metrics=metrics)
+        ]
+    ][0]
+    assert files_parsed == 1
+    assert sorted(services["switch.turn_on"]) == [
+        "copies/garden.yaml",
+        "linked/garden.yaml",
+        "packages/garden.yaml",
+    ]
+    assert file_scopes["linked/garden.yaml"].path == "linked/garden.yaml"
+    assert metrics.counters["files_deduplicated"] == 2
+
+
+async def test_templates(hass, tmpdir, monkeypatch):
+    """literal ids are taken from templates, repeated templates are cached"""
+    root = str(tmpdir)
+    template = "{{states.sensor.braced}}"
+    files = {
+        "a.yaml": (
+            f"value_template: '{template}'\n"
+            "message: >\n"
+            "  {% if (is_state('light.hall','on')) %}on\n"
+            "  {% elif [states.switch['pump']] %}pump\n"
+            "  {% endif %}\n"
+            "# {{(states('sensor.commented'))}}\n"
+        ),
+        "b.yaml": f"value_template: '{template}'\n",
+        ".storage/lovelace": (
+            '{"content": "{{ expand([\\"light.a\\",\\"light.b\\"]) }}"}\n'
+        ),
+    }
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+        with open(os.path.join(root, path), "w", encoding="utf-8") as f:
+            f.write(content)
+    # files one at a time, so the second one finds the template cached
+    hass.data[DOMAIN_DATA] = {CONF_SCAN_CONCURRENCY: 1}
+    monkeypatch.setattr(parser, "TEMPLATES", parser.TemplateCache())
+    metrics = WatchmanMetrics()
+    entities, *_ = await parser.parse(
+        hass,
+        [(root, "**/*.yaml"), (root, ".storage/lovelace*")],
+        [],
+        root,
+        metrics=metrics,
+    )
+    assert {e: {p: list(n) for p, n in o.items()} for e, o in entities.items()} == {
+        "sensor.braced": {"a.yaml": [1], "b.yaml": [1]},
+        "light.hall": {"a.yaml": [3]},
+        "switch.pump": {"a.yaml": [4]},
+        "light.a": {".storage/lovelace": [1]},
+        "light.b": {".storage/lovelace": [1]},
+    }
+    assert metrics.gauges["template_cache"] == {"size": 4, "hits": 1, "misses": 4}
+
+    await parser.parse(hass, [(root, "**/*.yaml")], [], root, metrics=metrics)
+    assert metrics.gauges["template_cache"] == {"size": 4, "hits": 5, "misses": 4}
@@ -0,0 +1,68 @@
+"""Test watchman.query service"""
+
+from copy import deepcopy
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+import pytest
+import voluptuous as vol
+from custom_components.watchman import (
+    async_setup_entry,
+)
+from custom_components.watchman.const import (
+    CONF_INCLUDED_FOLDERS,
+)
+from custom_components.watchman.config_flow import DEFAULT_DATA
+
+TEST_INCLUDED_FOLDERS = ["/workspaces/thewatchman/tests/input"]
+
+
+async def query(hass, **data):
+    """call watchman.query and return its response"""
+    return await hass.services.async_call(
+        "watchman", "query", data, blocking=True, return_response=True
+    )
+
+
+async def test_query(hass):
+    """entries are filtered and paginated from in-memory lists"""
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = TEST_INCLUDED_FOLDERS
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    hass.states.async_set("sensor.test1_unknown", "unknown")
+    hass.states.async_set("sensor.test3_unavail", "unavailable")
+    hass.states.async_set("sensor.test4_avail", "42")
+    assert await async_setup_entry(hass, config_entry)
+
+    result = await query(hass)
+    assert result["total"] == 7
+    assert [item["id"] for item in result["items"]][:2] == [
+        "fake.service1",
+        "fake.service2",
+    ]
+
+    result = await query(hass, type="entity", state=["ok"])
+    assert result["total"] == 1
+    item = result["items"][0]
+    assert item["id"] == "sensor.test4_avail"
+    assert item["missing_since"] is None
+    assert item["count"] == 1
+    assert list(item["occurrences"].values()) == [[4]]
+
+    result = await query(hass, glob="sensor.test?_*", state=["unknown", "unavail"])
+    assert [(i["id"], i["state"]) for i in result["items"]] == [
+        ("sensor.test1_unknown", "unknown"),
+        ("sensor.test3_unavail", "unavail"),
+    ]
+    assert result["items"][0]["missing_since"] is not None
+
+    result = await query(hass, domain="fake", file="*test_services.yaml")
+    assert result["total"] == 2
+    assert {i["type"] for i in result["items"]} == {"service"}
+
+    result = await query(hass, limit=2, offset=6)
+    assert result["total"] == 7
+    assert [i["id"] for i in result["items"]] == ["timer.cancel"]
+
+    with pytest.raises(vol.Invalid):
+        await query(hass, state="broken")
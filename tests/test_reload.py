@@ -0,0 +1,266 @@
+"""Test reload-scope-aware partial reparse"""
+
+import asyncio
+from copy import deepcopy
+import os
+import shutil
+from types import SimpleNamespace
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+from homeassistant.const import EVENT_CALL_SERVICE
+from homeassistant.setup import async_setup_component
+from homeassistant.util.yaml import load_yaml
+from custom_components.watchman import (
+    async_setup_entry,
+)
+from custom_components.watchman.const import (
+    DOMAIN,
+    CONF_CHECK_LOVELACE,
+    CONF_INCLUDED_FOLDERS,
+    CONF_LOADED_CONFIGS,
+    EVENT_AUTOMATION_RELOADED,
+    EVENT_LOVELACE_UPDATED,
+    HASS_DATA_DOMAIN_FILES,
+    HASS_DATA_METRICS,
+    HASS_DATA_MISSING_ENTITIES,
+    HASS_DATA_MISSING_SERVICES,
+    HASS_DATA_PARSED_ENTITY_LIST,
+    HASS_DATA_PARSED_SERVICE_LIST,
+    HASS_DATA_REFERENCES,
+)
+from custom_components.watchman.config_flow import DEFAULT_DATA
+
+TEST_INPUT_FOLDER = "/workspaces/thewatchman/tests/input_reload"
+
+
+async def setup_watchman(hass, tmpdir, **extra_options):
+    """copy test configuration to a temporary folder and set up watchman"""
+    folder = os.path.join(tmpdir, "config")
+    shutil.copytree(TEST_INPUT_FOLDER, folder, dirs_exist_ok=True)
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = [folder]
+    options.update(extra_options)
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+    return folder
+
+
+def append_line(path, line):
+    """append a line to configuration file"""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(f"{line}\n")
+
+
+def write_dashboard(folder, key, service):
+    """dashboard storage file with a single tap action"""
+    os.makedirs(os.path.join(folder, ".storage"), exist_ok=True)
+    with open(os.path.join(folder, ".storage", key), "w", encoding="utf-8") as f:
+        f.write(
+            '{\n  "data": {\n    "config": {\n      "views": [\n'
+            '        {"tap_action": {\n'
+            '          "action": "call-service",\n'
+            f'          "service": "{service}"}}}}\n'
+            "      ]\n    }\n  }\n}\n"
+        )
+
+
+def storage_dashboard(dashboard_id):
+    """lovelace dashboard kept in .storage, with the store it writes through"""
+    return SimpleNamespace(
+        mode="storage",
+        config=dashboard_id and {"id": dashboard_id},
+        _store=SimpleNamespace(_write_lock=asyncio.Lock()),
+    )
+
+
+async def save_dashboard(hass, folder, url_path, key, service):
+    """save a dashboard the way lovelace does: event first, then the write"""
+    dashboard = hass.data["lovelace"]["dashboards"][url_path]
+    hass.bus.async_fire(EVENT_LOVELACE_UPDATED, {"url_path": url_path})
+    async with dashboard._store._write_lock:  # pylint: disable=protected-access
+        # a slow disk, the file is written well after the event
+        await asyncio.sleep(0.1)
+        await hass.async_add_executor_job(write_dashboard, folder, key, service)
+
+
+async def test_dashboard_update(hass, tmpdir):
+    """saved dashboard is rescanned alone and only its references re-checked"""
+    hass.config.config_dir = os.path.join(tmpdir, "config")
+    write_dashboard(hass.config.config_dir, "lovelace", "light.turn_on")
+    write_dashboard(hass.config.config_dir, "lovelace.garden", "switch.pump_on")
+    hass.data["lovelace"] = {
+        "dashboards": {
+            None: storage_dashboard(None),
+            "dashboard-garden": storage_dashboard("garden"),
+        }
+    }
+    folder = await setup_watchman(hass, tmpdir, **{CONF_CHECK_LOVELACE: True})
+    parsed_service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+    assert ".storage/lovelace.garden" in parsed_service_list["switch.pump_on"]
+    assert "switch.pump_on" in hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+
+    append_line(os.path.join(folder, "automations.yaml"), "    - sensor.new_one")
+    write_dashboard(folder, "lovelace", "light.turn_off")
+    await save_dashboard(
+        hass, folder, "dashboard-garden", "lovelace.garden", "switch.pump_off"
+    )
+    await hass.async_block_till_done()
+    parsed_service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+    assert "switch.pump_on" not in parsed_service_list
+    assert "switch.pump_off" in parsed_service_list
+    # other dashboards and yaml files are left as they were
+    assert "light.turn_on" in parsed_service_list
+    assert "light.turn_off" not in parsed_service_list
+    assert "sensor.new_one" not in hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+    services_missing = hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES]
+    assert "switch.pump_on" not in services_missing
+    assert "switch.pump_off" in services_missing
+
+    await save_dashboard(hass, folder, None, "lovelace", "light.toggle")
+    await hass.async_block_till_done()
+    parsed_service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+    assert "light.toggle" in parsed_service_list
+    assert "light.turn_off" not in parsed_service_list
+
+
+async def test_dashboard_update_without_store_lock(hass, tmpdir):
+    """without the store lock the dashboard file is polled until written"""
+    hass.config.config_dir = os.path.join(tmpdir, "config")
+    write_dashboard(hass.config.config_dir, "lovelace.garden", "switch.pump_on")
+    hass.data["lovelace"] = {
+        "dashboards": {
+            "dashboard-garden": SimpleNamespace(mode="storage", config={"id": "garden"})
+        }
+    }
+    folder = await setup_watchman(hass, tmpdir, **{CONF_CHECK_LOVELACE: True})
+
+    hass.bus.async_fire(EVENT_LOVELACE_UPDATED, {"url_path": "dashboard-garden"})
+    await asyncio.sleep(0.1)
+    await hass.async_add_executor_job(
+        write_dashboard, folder, "lovelace.garden", "switch.pump_off"
+    )
+    await hass.async_block_till_done()
+    parsed_service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+    assert "switch.pump_on" not in parsed_service_list
+    assert "switch.pump_off" in parsed_service_list
+
+
+async def test_domain_map(hass, tmpdir):
+    """domains are mapped to the files which define them"""
+    folder = await setup_watchman(hass, tmpdir)
+
+    def rel(path):
+        return os.path.relpath(os.path.join(folder, path), hass.config.config_dir)
+
+    domain_files = hass.data[DOMAIN][HASS_DATA_DOMAIN_FILES]
+    assert rel("automations.yaml") in domain_files["automation"]
+    assert rel("input_boolean.yaml") in domain_files["input_boolean"]
+    assert rel("packages/garden.yaml") in domain_files["script"]
+    assert os.path.join(rel("packages"), "") in domain_files["script"]
+    assert rel("packages/garden.yaml") not in domain_files["automation"]
+
+
+async def test_partial_reparse(hass, tmpdir):
+    """domain reload rescans only files of the domain"""
+    folder = await setup_watchman(hass, tmpdir)
+    assert len(hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]) == 3
+
+    append_line(os.path.join(folder, "automations.yaml"), "# sensor.new_one")
+    append_line(os.path.join(folder, "automations.yaml"), "    - sensor.new_one")
+    append_line(os.path.join(folder, "packages", "garden.yaml"), "# switch.pump")
+    append_line(os.path.join(folder, "packages", "garden.yaml"), "  switch.pump:")
+
+    hass.bus.async_fire(EVENT_AUTOMATION_RELOADED)
+    await hass.async_block_till_done()
+    parsed_entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+    assert "sensor.new_one" in parsed_entity_list
+    assert "switch.pump" not in parsed_entity_list
+    assert "switch.garden_valve" in parsed_entity_list
+    assert len(hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]) == 4
+
+    hass.bus.async_fire(EVENT_CALL_SERVICE, {"domain": "script", "service": "reload"})
+    await hass.async_block_till_done()
+    parsed_entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+    assert "switch.pump" in parsed_entity_list
+    assert len(hass.data[DOMAIN][HASS_DATA_MISSING_ENTITIES]) == 5
+
+
+async def test_reference_index(hass, tmpdir):
+    """references are mapped to automations and scripts which own them"""
+    folder = await setup_watchman(hass, tmpdir)
+    references = hass.data[DOMAIN][HASS_DATA_REFERENCES]
+    assert references["binary_sensor.bedroom_motion"] == ["automation: Morning lights"]
+    assert references["light.turn_on"] == ["automation: Morning lights"]
+    assert references["switch.garden_valve"] == ["script: water_garden"]
+
+    append_line(os.path.join(folder, "packages", "garden.yaml"), "  sleep:")
+    append_line(os.path.join(folder, "packages", "garden.yaml"), "    sequence:")
+    append_line(
+        os.path.join(folder, "packages", "garden.yaml"),
+        "      - service: switch.turn_off",
+    )
+    hass.bus.async_fire(EVENT_CALL_SERVICE, {"domain": "script", "service": "reload"})
+    await hass.async_block_till_done()
+    references = hass.data[DOMAIN][HASS_DATA_REFERENCES]
+    assert references["switch.turn_off"] == ["script: sleep"]
+    assert references["binary_sensor.bedroom_motion"] == ["automation: Morning lights"]
+
+
+async def test_loaded_configs(hass, tmpdir):
+    """automations are taken from memory once their files are known"""
+    folder = await setup_watchman(hass, tmpdir, **{CONF_LOADED_CONFIGS: True})
+    path = os.path.join(folder, "automations.yaml")
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content.replace("light.bedroom", "light.hall"))
+    automations = await hass.async_add_executor_job(load_yaml, path)
+    assert await async_setup_component(hass, "automation", {"automation": automations})
+    await hass.async_block_till_done()
+    # not loaded by Home Assistant, so not seen either
+    append_line(path, "    - sensor.disk_only")
+    metrics = hass.data[DOMAIN][HASS_DATA_METRICS]
+    before = metrics.counters.copy()
+
+    hass.bus.async_fire(EVENT_AUTOMATION_RELOADED)
+    await hass.async_block_till_done()
+    delta = metrics.counters - before
+    assert delta["files_loaded"] == 1
+    # configuration.yaml includes automations among other domains
+    assert delta["files_scanned"] == 1
+    short_path = os.path.relpath(path, hass.config.config_dir)
+    parsed_entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+    assert "sensor.disk_only" not in parsed_entity_list
+    assert "light.bedroom" not in parsed_entity_list
+    assert parsed_entity_list["light.hall"] == {short_path: [9]}
+    assert parsed_entity_list["binary_sensor.bedroom_motion"] == {short_path: [5]}
+    parsed_service_list = hass.data[DOMAIN][HASS_DATA_PARSED_SERVICE_LIST]
+    assert parsed_service_list["light.turn_on"] == {short_path: [7]}
+    assert hass.data[DOMAIN][HASS_DATA_REFERENCES]["light.hall"] == [
+        "automation: Morning lights"
+    ]
+
+
+async def test_loaded_configs_script_reload(hass, tmpdir):
+    """script.reload is announced before scripts are read, so disk is read"""
+    folder = await setup_watchman(hass, tmpdir, **{CONF_LOADED_CONFIGS: True})
+    path = os.path.join(folder, "packages", "garden.yaml")
+    package = await hass.async_add_executor_job(load_yaml, path)
+    assert await async_setup_component(hass, "script", {"script": package["script"]})
+    await hass.async_block_till_done()
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content.replace("switch.garden_valve", "switch.garden_pump"))
+    metrics = hass.data[DOMAIN][HASS_DATA_METRICS]
+    before = metrics.counters.copy()
+
+    # scripts loaded by Home Assistant still hold the old entity
+    hass.bus.async_fire(EVENT_CALL_SERVICE, {"domain": "script", "service": "reload"})
+    await hass.async_block_till_done()
+    delta = metrics.counters - before
+    assert not delta["files_loaded"]
+    parsed_entity_list = hass.data[DOMAIN][HASS_DATA_PARSED_ENTITY_LIST]
+    assert "switch.garden_pump" in parsed_entity_list
+    assert "switch.garden_valve" not in parsed_entity_list
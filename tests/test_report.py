@@ -1,6 +1,11 @@
 """Test table reports"""
+
 from copy import deepcopy
-from pytest_homeassistant_custom_component.common import MockConfigEntry
+import json
+from pytest_homeassistant_custom_component.common import (
+    MockConfigEntry,
+    async_mock_service,
+)
 from custom_components.watchman import (
     async_setup_entry,
 )
@@ -11,8 +16,15 @@ from custom_components.watchman.const import (
     CONF_IGNORED_FILES,
     CONF_REPORT_PATH,
     CONF_COLUMNS_WIDTH,
+    HASS_DATA_METRICS,
+    HASS_DATA_MISSING_ENTITIES,
+    HASS_DATA_MISSING_SERVICES,
+    HASS_DATA_PARSED_ENTITY_LIST,
+    HASS_DATA_PARSED_SERVICE_LIST,
 )
 from custom_components.watchman.config_flow import DEFAULT_DATA
+from custom_components.watchman.metrics import WatchmanMetrics
+from custom_components.watchman.report import delta_report
 
 TEST_INCLUDED_FOLDERS = ["/workspaces/thewatchman/tests/input"]
 
@@ -119,3 +131,82 @@ async def test_column_resize(hass, tmpdir):
     await hass.services.async_call(DOMAIN, "report", {"test_mode": True})
     await hass.async_block_till_done()
     assert_files_equal(base_report, test_report)
+
+
+async def test_summary(hass, tmpdir):
+    """summary rendering with totals and most affected files"""
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = TEST_INCLUDED_FOLDERS
+    base_report = "/workspaces/thewatchman/tests/input/test_report5.txt"
+    test_report = tmpdir.join("test_report5.txt")
+    options[CONF_REPORT_PATH] = test_report
+    hass.states.async_set("sensor.test1_unknown", "unknown")
+    hass.states.async_set("sensor.test3_unavail", "unavailable")
+    hass.states.async_set("sensor.test4_avail", "42")
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+
+    await hass.services.async_call(
+        DOMAIN, "report", {"test_mode": True, "summary": True}
+    )
+    await hass.async_block_till_done()
+    assert_files_equal(base_report, test_report)
+
+
+async def test_delta_notification(hass):
+    """delta mode notifies only about changes since the last delivery"""
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = TEST_INCLUDED_FOLDERS
+    hass.states.async_set("sensor.test1_unknown", "unknown")
+    hass.states.async_set("sensor.test4_avail", "42")
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    calls = async_mock_service(hass, "notify", "test")
+    assert await async_setup_entry(hass, config_entry)
+
+    data = {
+        "send_notification": True,
+        "create_file": False,
+        "service": "notify.test",
+        "delta": True,
+        "chunk_size": 0,
+    }
+    await hass.services.async_call(DOMAIN, "report", data, blocking=True)
+    assert len(calls) == 1
+    assert "-== 6 new or changed missing item(s):" in calls[0].data["message"]
+
+    await hass.services.async_call(DOMAIN, "report", data, blocking=True)
+    assert len(calls) == 1
+
+    hass.states.async_set("sensor.test2_missing", "on")
+    await hass.async_block_till_done()
+    await hass.services.async_call(DOMAIN, "report", data, blocking=True)
+    assert len(calls) == 2
+    message = calls[1].data["message"]
+    assert "new or changed" not in message
+    assert "-== 1 resolved item(s):\nsensor.test2_missing\n" in message
+
+
+async def test_delta_same_id(hass):
+    """an entity and a service of the same id are tracked apart"""
+    occurrences = {"scripts.yaml": [3]}
+    hass.data[DOMAIN] = {
+        HASS_DATA_PARSED_ENTITY_LIST: {"script.wake": occurrences},
+        HASS_DATA_PARSED_SERVICE_LIST: {"script.wake": occurrences},
+        HASS_DATA_MISSING_ENTITIES: {"script.wake": occurrences},
+        HASS_DATA_MISSING_SERVICES: {"script.wake": occurrences},
+        HASS_DATA_METRICS: WatchmanMetrics(),
+    }
+    chunks, delivered = delta_report(hass, {}, 0, test_mode=True)
+    assert "-== 2 new or changed missing item(s):" in chunks[0]
+
+    # the service is back, the entity is still missing
+    hass.data[DOMAIN][HASS_DATA_MISSING_SERVICES] = {}
+    delivered = json.loads(json.dumps(delivered))
+    chunks, delivered = delta_report(hass, delivered, 0, test_mode=True)
+    assert "new or changed" not in chunks[0]
+    assert "-== 1 resolved item(s):\nscript.wake\n" in chunks[0]
+    assert delivered["entries"] == [["entity", "script.wake", "missing"]]
@@ -0,0 +1,125 @@
+"""Test parse scheduler"""
+
+import asyncio
+import pytest
+from custom_components.watchman.scheduler import ParseScheduler
+
+
+class FakeScan:
+    """scan which processes files one by one until released"""
+
+    def __init__(self, files=3):
+        self.files = files
+        self.started = []
+        self.completed = []
+        self.scopes = []
+        self.background = []
+        self.loaded = []
+        self.gate = asyncio.Event()
+
+    async def __call__(self, reason, token, files):
+        self.started.append(reason)
+        self.scopes.append(files)
+        self.background.append(token.background)
+        self.loaded.append(token.loaded)
+        for _ in range(self.files):
+            token.raise_if_cancelled()
+            await self.gate.wait()
+            await asyncio.sleep(0)
+        token.raise_if_cancelled()
+        self.completed.append(reason)
+
+
+async def test_single_flight(hass):
+    """concurrent requests are coalesced into one follow-up scan"""
+    scan = FakeScan()
+    scheduler = ParseScheduler(hass, scan)
+    first = hass.async_create_task(scheduler.async_parse("first"))
+    await asyncio.sleep(0)
+    assert scheduler.is_running
+    second = hass.async_create_task(scheduler.async_parse("second"))
+    third = hass.async_create_task(scheduler.async_parse("third"))
+    await asyncio.sleep(0)
+    scan.gate.set()
+    await asyncio.gather(first, second, third)
+    assert scan.started == ["first", "first, second, third"]
+    assert scan.completed == ["first, second, third"]
+    assert not scheduler.is_running
+
+
+async def test_sequential_requests(hass):
+    """requests made after a scan completes start a new scan"""
+    scan = FakeScan()
+    scan.gate.set()
+    scheduler = ParseScheduler(hass, scan)
+    await scheduler.async_parse("first")
+    await scheduler.async_parse("second")
+    assert scan.completed == ["first", "second"]
+
+
+async def test_partial_scopes(hass):
+    """partial scans are merged, a full scan absorbs partial ones"""
+    scan = FakeScan()
+    scheduler = ParseScheduler(hass, scan)
+    first = hass.async_create_task(scheduler.async_parse("first", {"a.yaml"}))
+    await asyncio.sleep(0)
+    second = hass.async_create_task(scheduler.async_parse("second", {"b.yaml"}))
+    await asyncio.sleep(0)
+    scan.gate.set()
+    await asyncio.gather(first, second)
+    assert scan.scopes[-1] == {"a.yaml", "b.yaml"}
+
+    scan.gate.clear()
+    first = hass.async_create_task(scheduler.async_parse("first", {"a.yaml"}))
+    await asyncio.sleep(0)
+    second = hass.async_create_task(scheduler.async_parse("second"))
+    await asyncio.sleep(0)
+    scan.gate.set()
+    await asyncio.gather(first, second)
+    assert scan.scopes[-1] is None
+
+
+async def test_cancel(hass):
+    """cancellation stops the scan in flight and releases waiters"""
+    scan = FakeScan()
+    scheduler = ParseScheduler(hass, scan)
+    waiter = hass.async_create_task(scheduler.async_parse("first"))
+    await asyncio.sleep(0)
+    await scheduler.async_cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert not scan.completed
+    assert not scheduler.is_running
+
+
+async def test_foreground_takes_over(hass):
+    """a foreground request restarts a background scan without throttling"""
+    scan = FakeScan()
+    scheduler = ParseScheduler(hass, scan)
+    first = hass.async_create_task(scheduler.async_parse("reload", background=True))
+    await asyncio.sleep(0)
+    second = hass.async_create_task(scheduler.async_parse("report"))
+    await asyncio.sleep(0)
+    scan.gate.set()
+    await asyncio.gather(first, second)
+    assert scan.background == [True, False]
+    assert scan.completed == ["reload, report"]
+
+    await scheduler.async_parse("reload", background=True)
+    assert scan.background[-1] is True
+
+
+async def test_loaded_requires_all(hass):
+    """loaded configs are used only if every coalesced request allows them"""
+    scan = FakeScan()
+    scheduler = ParseScheduler(hass, scan)
+    first = hass.async_create_task(scheduler.async_parse("automation", loaded=True))
+    await asyncio.sleep(0)
+    second = hass.async_create_task(scheduler.async_parse("script"))
+    await asyncio.sleep(0)
+    scan.gate.set()
+    await asyncio.gather(first, second)
+    assert scan.loaded == [True, False]
+
+    await scheduler.async_parse("automation", loaded=True)
+    assert scan.loaded[-1] is True
@@ -0,0 +1,99 @@
+"""Test watchman websocket commands"""
+
+from copy import deepcopy
+import os
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+from custom_components.watchman import (
+    async_setup_entry,
+)
+from custom_components.watchman.const import (
+    CONF_INCLUDED_FOLDERS,
+)
+from custom_components.watchman.config_flow import DEFAULT_DATA
+
+TEST_INCLUDED_FOLDERS = ["/workspaces/thewatchman/tests/input"]
+
+
+async def test_websocket(hass, hass_ws_client):
+    """paginated listing, file lookup and delta subscription"""
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = TEST_INCLUDED_FOLDERS
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    hass.states.async_set("sensor.test1_unknown", "unknown")
+    hass.states.async_set("sensor.test4_avail", "42")
+    assert await async_setup_entry(hass, config_entry)
+    client = await hass_ws_client(hass)
+
+    await client.send_json_auto_id(
+        {"type": "watchman/list", "entry_type": "entity", "limit": 2}
+    )
+    msg = await client.receive_json()
+    assert msg["success"]
+    assert msg["result"]["total"] == 3
+    assert [i["id"] for i in msg["result"]["items"]] == [
+        "sensor.test1_unknown",
+        "sensor.test2_missing",
+    ]
+
+    await client.send_json_auto_id(
+        {
+            "type": "watchman/file",
+            "file": next(
+                iter(hass.data["watchman"]["entity_list"]["sensor.test4_avail"])
+            ),
+        }
+    )
+    msg = await client.receive_json()
+    assert msg["result"]["total"] == 4
+
+    await client.send_json_auto_id({"type": "watchman/subscribe"})
+    msg = await client.receive_json()
+    assert msg["success"]
+    msg = await client.receive_json()
+    assert len(msg["event"]["added"]) == 6
+
+    hass.states.async_set("sensor.test2_missing", "on")
+    await hass.async_block_till_done()
+    msg = await client.receive_json()
+    assert msg["event"] == {
+        "added": [],
+        "removed": [{"id": "sensor.test2_missing", "type": "entity"}],
+    }
+
+    hass.states.async_set("sensor.test4_avail", "unavailable")
+    await hass.async_block_till_done()
+    msg = await client.receive_json()
+    assert [i["id"] for i in msg["event"]["added"]] == ["sensor.test4_avail"]
+    assert msg["event"]["added"][0]["state"] == "unavail"
+
+
+async def test_subscribe_entity_and_service(hass, hass_ws_client, tmpdir):
+    """an id missing both as an entity and a service is sent twice"""
+    with open(os.path.join(tmpdir, "wake.yaml"), "w", encoding="utf-8") as f:
+        f.write("service: script.wake\nentity_id: script.wake\n")
+    options = deepcopy(DEFAULT_DATA)
+    options[CONF_INCLUDED_FOLDERS] = [str(tmpdir)]
+    config_entry = MockConfigEntry(
+        domain="watchman", data={}, options=options, entry_id="test"
+    )
+    assert await async_setup_entry(hass, config_entry)
+    client = await hass_ws_client(hass)
+
+    await client.send_json_auto_id({"type": "watchman/subscribe"})
+    msg = await client.receive_json()
+    assert msg["success"]
+    msg = await client.receive_json()
+    assert sorted((i["type"], i["id"]) for i in msg["event"]["added"]) == [
+        ("entity", "script.wake"),
+        ("service", "script.wake"),
+    ]
+
+    hass.services.async_register("script", "wake", lambda call: None)
+    await hass.async_block_till_done()
+    msg = await client.receive_json()
+    assert msg["event"] == {
+        "added": [],
+        "removed": [{"id": "script.wake", "type": "service"}],
+    }